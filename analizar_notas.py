@@ -1,7 +1,5 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
-import requests
-from datetime import datetime
 
 # Inicializar Firebase Admin SDK una sola vez
 try:
@@ -12,54 +10,79 @@ except ValueError:
 
 db = firestore.client()
 
-def analizar_y_guardar_analisis_ia():
-    print("Iniciando análisis de notas...")
-    usuarios_ref = db.collection('users')
-    usuarios = usuarios_ref.stream()
+def _encolar_nota(pipeline, conteo, nota_doc):
+    """Entrega una nota sin análisis al pipeline; las ya analizadas o vacías se saltan."""
+    from api.note_discovery import patient_uid_of
 
-    for usuario in usuarios:
-        uid = usuario.id
-        print(f"Analizando notas del usuario: {uid}")
-        notas_ref = usuarios_ref.document(uid).collection('notes')
+    nota_data = nota_doc.to_dict()
+    content = nota_data.get("content")
 
-        #No filtramos por analisis_IA para evitar inconsistencias
-        notas = notas_ref.limit(10).stream()
+    if "analisis_IA" in nota_data:
+        conteo['already_analyzed'] += 1
+    elif not content:
+        conteo['empty'] += 1
+    else:
+        # Se bloquea si la etapa de análisis va por detrás (backpressure).
+        pipeline.put(patient_uid_of(nota_doc), nota_doc.id, content, created_at=nota_data.get("createdAt"))
+        conteo['queued'] += 1
+    return True
 
-        for nota_doc in notas:
-            nota_data = nota_doc.to_dict()
-            content = nota_data.get("content")
-            ya_tiene_analisis = "analisis_IA" in nota_data
 
-            if content and not ya_tiene_analisis:
-                try:
-                    print(f"Analizando nota {nota_doc.id}...")
-                    response = requests.post(
-                        "http://127.0.0.1:8000/api/analyze-note/",
-                        json={"note": content},
-                        timeout=120  # Aumentado para IA lenta
-                    )
+def analizar_y_guardar_analisis_ia(analysis_workers=None):
+    """
+    Analiza las notas nuevas de todos los pacientes. Usa una consulta collection group
+    sobre 'notes' a partir de la última posición procesada (api/note_discovery.py) y
+    un pipeline por etapas (api/analysis_pipeline.py): análisis concurrente acotado y
+    escritura agrupada en Firestore. La posición solo avanza cuando las notas de la
+    página ya están escritas, y cada nota se analiza bajo un lease (api/leases.py) para
+    que otros procesos no la repitan. Antes de descubrir notas nuevas se reintentan las
+    que fallaron o quedaron abandonadas en ejecuciones anteriores (leases sin completar).
 
-                    if response.status_code == 200:
-                        analisis = response.json().get("analisis_completo", "Sin análisis")
-                        notas_ref.document(nota_doc.id).update({
-                            "analisis_IA": analisis,
-                            "analizadoEn": datetime.utcnow()
-                        })
-                        print(f"Análisis guardado para nota {nota_doc.id}")
-                    else:
-                        print(f"Falló análisis: {response.status_code} - {response.text}")
+    `analysis_workers` sustituye a IA_PIPELINE_ANALYSIS_WORKERS para esta ejecución.
 
-                except requests.exceptions.Timeout:
-                    print(f"Timeout alcanzado en la nota {nota_doc.id} de {uid}.")
-                except Exception as e:
-                    print(f"Error inesperado con UID {uid}, nota {nota_doc.id}: {e}")
-            else:
-                if ya_tiene_analisis:
-                    print(f"Nota {nota_doc.id} ya tiene análisis.")
-                else:
-                    print(f"Nota {nota_doc.id} vacía o sin contenido válido.")
+    Las estadísticas de cada ejecución se guardan en AnalysisRun (api/analysis_metrics.py)
+    y se exponen en /api/metrics/.
+    """
+    from django.conf import settings
 
-    print("Proceso de análisis finalizado.")
+    from api.analysis_metrics import RunRecorder
+    from api.analysis_pipeline import AnalysisPipeline
+    from api.ia_logic import analyze_note
+    from api.leases import purge_leases, worker_id
+    from api.note_discovery import discover_new_notes, retry_failed_notes
+
+    print("Iniciando análisis de notas nuevas...")
+    recorder = RunRecorder(worker=worker_id())
+    recorder.start()
+    conteo = {'queued': 0, 'already_analyzed': 0, 'empty': 0}
+    descubrimiento = stats = None
+    reintentos = {'retried': 0, 'resolved': 0}
+    try:
+        purge_leases(getattr(settings, 'IA_NOTE_LEASE_RETENTION_SECONDS', 24 * 3600))
+        pipeline = AnalysisPipeline.from_settings(db, analyze_note, analysis_workers=analysis_workers).start()
+        encolar = lambda nota_doc: _encolar_nota(pipeline, conteo, nota_doc)
+        try:
+            if getattr(settings, 'IA_NOTE_LEASES_ENABLED', True):
+                reintentos = retry_failed_notes(db, encolar)
+            descubrimiento = discover_new_notes(db, encolar, before_save=pipeline.drain)
+        finally:
+            stats = pipeline.close()
+    except Exception as e:
+        recorder.finish(conteo, descubrimiento, stats, error=e)
+        raise
+
+    run = recorder.finish(conteo, descubrimiento, stats)
+    print(
+        f"Proceso de análisis finalizado: {run.scanned} notas recorridas, {run.queued} encoladas "
+        f"({reintentos['retried']} reintentos), {run.written} análisis guardados, {run.failed} fallidos "
+        f"en {run.duration_seconds}s."
+    )
 
 if __name__ == "__main__":
+    # Ejecutado fuera de Django: la posición del descubrimiento se guarda en su base de datos.
+    import os
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+    django.setup()
     analizar_y_guardar_analisis_ia()
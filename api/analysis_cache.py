@@ -0,0 +1,214 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_note(note: str) -> str:
+    """Normaliza la nota para que variaciones triviales (espacios, mayúsculas) compartan entrada."""
+    return ' '.join(note.split()).lower()
+
+
+def make_cache_key(note: str, model_version: str, generation_params: dict) -> str:
+    payload = json.dumps(
+        {
+            'note': normalize_note(note),
+            'model_version': model_version,
+            'generation': generation_params,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """Caché en memoria con expulsión LRU por tamaño y expiración por TTL."""
+
+    def __init__(self, max_entries=1024, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._data[key]
+                self.evictions += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class AnalysisCache:
+    """
+    Caché de dos niveles delante de la generación de análisis:
+    un LRU en memoria por proceso y una tabla en Postgres compartida (AnalysisCacheEntry).
+    Los fallos del nivel persistente se registran pero nunca interrumpen el análisis.
+    """
+
+    # Cada cuántas escrituras se revisa el tamaño de la tabla.
+    DB_EVICTION_INTERVAL = 100
+
+    def __init__(self, memory_max_entries=1024, ttl_seconds=7 * 24 * 3600, db_max_entries=50000):
+        self.ttl_seconds = ttl_seconds
+        self.db_max_entries = db_max_entries
+        self.memory = LRUCache(memory_max_entries, ttl_seconds)
+
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.db_errors = 0
+        self.db_evictions = 0
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('memory_hits')
+            return value
+
+        value = self._db_get(key)
+        if value is not None:
+            self.memory.set(key, value)
+            self._count('db_hits')
+            return value
+
+        self._count('misses')
+        return None
+
+    def set(self, key, value, model_version):
+        self.memory.set(key, value)
+        self._db_set(key, value, model_version)
+        self._count('writes')
+        if self.writes % self.DB_EVICTION_INTERVAL == 0:
+            self.evict_db()
+
+    def _db_get(self, key):
+        from .models import AnalysisCacheEntry
+
+        try:
+            entries = AnalysisCacheEntry.objects.filter(key=key)
+            if self.ttl_seconds is not None:
+                entries = entries.filter(created_at__gte=timezone.now() - timedelta(seconds=self.ttl_seconds))
+            entry = entries.only('result').first()
+            if entry is None:
+                return None
+            AnalysisCacheEntry.objects.filter(pk=entry.pk).update(
+                last_accessed_at=timezone.now(), hits=F('hits') + 1
+            )
+            return entry.result
+        except Exception as e:
+            self._count('db_errors')
+            logger.error(f"AnalysisCache: Error al leer de la caché persistente. Detalles: {e}")
+            return None
+
+    def _db_set(self, key, value, model_version):
+        from .models import AnalysisCacheEntry
+
+        try:
+            now = timezone.now()
+            AnalysisCacheEntry.objects.update_or_create(
+                key=key,
+                defaults={
+                    'model_version': model_version,
+                    'result': value,
+                    'created_at': now,
+                    'last_accessed_at': now,
+                },
+            )
+        except Exception as e:
+            self._count('db_errors')
+            logger.error(f"AnalysisCache: Error al escribir en la caché persistente. Detalles: {e}")
+
+    def evict_db(self):
+        """Elimina entradas expiradas y, si la tabla supera `db_max_entries`, las menos usadas recientemente."""
+        from .models import AnalysisCacheEntry
+
+        try:
+            deleted = 0
+            if self.ttl_seconds is not None:
+                cutoff = timezone.now() - timedelta(seconds=self.ttl_seconds)
+                deleted += AnalysisCacheEntry.objects.filter(created_at__lt=cutoff).delete()[0]
+
+            excess = AnalysisCacheEntry.objects.count() - self.db_max_entries
+            if excess > 0:
+                stale_ids = list(
+                    AnalysisCacheEntry.objects.order_by('last_accessed_at').values_list('pk', flat=True)[:excess]
+                )
+                deleted += AnalysisCacheEntry.objects.filter(pk__in=stale_ids).delete()[0]
+
+            with self._lock:
+                self.db_evictions += deleted
+            return deleted
+        except Exception as e:
+            self._count('db_errors')
+            logger.error(f"AnalysisCache: Error al expulsar entradas de la caché persistente. Detalles: {e}")
+            return 0
+
+    def invalidate_version(self, model_version):
+        """
+        Elimina las entradas persistentes generadas con `model_version` y vacía el nivel en
+        memoria (sus claves no guardan la versión de forma recuperable). Devuelve las filas borradas.
+        """
+        from .models import AnalysisCacheEntry
+
+        self.memory.clear()
+        try:
+            deleted = AnalysisCacheEntry.objects.filter(model_version=model_version).delete()[0]
+            with self._lock:
+                self.db_evictions += deleted
+            return deleted
+        except Exception as e:
+            self._count('db_errors')
+            logger.error(f"AnalysisCache: Error al invalidar la versión {model_version}. Detalles: {e}")
+            return 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.db_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'hit_ratio': round((self.memory_hits + self.db_hits) / lookups, 3) if lookups else 0.0,
+                'writes': self.writes,
+                'memory_entries': len(self.memory),
+                'memory_evictions': self.memory.evictions,
+                'db_evictions': self.db_evictions,
+                'db_errors': self.db_errors,
+            }
@@ -0,0 +1,184 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import AnalysisJob
+from .note_summary import touch_patients
+
+logger = logging.getLogger(__name__)
+
+STALE_JOB_ERROR = 'El trabajo no terminó a tiempo (el proceso que lo ejecutaba se reinició o se detuvo).'
+
+
+class JobQueueFullError(Exception):
+    """La cola local de trabajos de análisis está llena."""
+
+
+class AnalysisJobPool:
+    """
+    Pool local y acotado de hilos que procesa trabajos de análisis.
+    `max_workers` limita las inferencias simultáneas y `max_queued` los trabajos
+    aceptados que aún no han terminado; por encima de ese límite `submit` falla
+    en lugar de acumular trabajo sin límite.
+    """
+
+    def __init__(self, max_workers=2, max_queued=100):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis-job')
+        self._slots = threading.BoundedSemaphore(max_queued)
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFullError(f"La cola de análisis está llena ({self.max_queued} trabajos)")
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> AnalysisJobPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = AnalysisJobPool(
+                    max_workers=getattr(settings, 'IA_JOB_WORKERS', 2),
+                    max_queued=getattr(settings, 'IA_JOB_QUEUE_SIZE', 100),
+                )
+                # Primer uso del pool en este proceso: se cierran los trabajos que dejó
+                # colgados un proceso anterior que se reinició.
+                try:
+                    expired = fail_stale_jobs()
+                    if expired:
+                        logger.warning(f"AnalysisJobPool: {expired} trabajos abandonados marcados como fallidos.")
+                except Exception as e:
+                    logger.error(f"AnalysisJobPool: No se pudieron cerrar los trabajos abandonados. Detalles: {e}")
+    return _pool
+
+
+def _stale_jobs():
+    """
+    Trabajos pendientes o en curso desde hace más de IA_JOB_STALE_SECONDS. El pool es
+    local al proceso, así que si ese proceso se reinició nadie los va a terminar.
+    """
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'IA_JOB_STALE_SECONDS', 1800))
+    return AnalysisJob.objects.filter(
+        Q(status=AnalysisJob.STATUS_PENDING, created_at__lt=cutoff)
+        | Q(status=AnalysisJob.STATUS_RUNNING, started_at__lt=cutoff)
+    )
+
+
+def fail_stale_jobs(**filters):
+    """Marca como fallidos los trabajos abandonados (opcionalmente filtrados). Devuelve cuántos."""
+    return _stale_jobs().filter(**filters).update(
+        status=AnalysisJob.STATUS_FAILED, error=STALE_JOB_ERROR, finished_at=timezone.now()
+    )
+
+
+def _active_job(patient_uid, note_id):
+    return AnalysisJob.objects.filter(
+        patient_uid=patient_uid,
+        note_id=note_id,
+        status__in=[AnalysisJob.STATUS_PENDING, AnalysisJob.STATUS_RUNNING],
+    ).first()
+
+
+def submit_job(note, patient_uid='', note_id=''):
+    """
+    Crea un trabajo de análisis y lo encola en el pool local.
+    Si ya hay un trabajo activo para la misma nota de Firestore, se devuelve ese; uno
+    abandonado (más antiguo que IA_JOB_STALE_SECONDS) se marca como fallido y no cuenta.
+    La restricción api_job_active_note_uniq garantiza un único trabajo activo por nota
+    aunque lleguen dos solicitudes a la vez.
+    """
+    if patient_uid and note_id:
+        fail_stale_jobs(patient_uid=patient_uid, note_id=note_id)
+        active = _active_job(patient_uid, note_id)
+        if active is not None:
+            return active
+
+    try:
+        with transaction.atomic():
+            job = AnalysisJob.objects.create(note=note, patient_uid=patient_uid or '', note_id=note_id or '')
+    except IntegrityError:
+        # Otra solicitud creó el trabajo de la misma nota entre la consulta y el INSERT.
+        active = _active_job(patient_uid, note_id) if patient_uid and note_id else None
+        if active is None:
+            raise
+        return active
+    try:
+        _get_pool().submit(_run_job, job.id)
+    except JobQueueFullError:
+        job.delete()
+        raise
+    return job
+
+
+def analysis_update(analysis, model_version=None):
+    """Campos que se escriben en el documento de la nota al terminar su análisis."""
+    return {
+        'analisis_IA': analysis,
+        'analisis_IA_version': model_version,
+        'analizadoEn': timezone.now(),
+    }
+
+
+def write_analysis_to_firestore(patient_uid, note_id, analysis, model_version=None):
+    """Guarda el análisis y la versión del modelo que lo generó en el documento de la nota."""
+    from firebase_config import db
+
+    db.collection('users').document(patient_uid).collection('notes').document(note_id).update(
+        analysis_update(analysis, model_version)
+    )
+    touch_patients([patient_uid])
+
+
+def _run_job(job_id):
+    from .ia_logic import analyze_note
+
+    close_old_connections()
+    try:
+        started = AnalysisJob.objects.filter(pk=job_id, status=AnalysisJob.STATUS_PENDING).update(
+            status=AnalysisJob.STATUS_RUNNING, started_at=timezone.now()
+        )
+        if not started:
+            # Esperó tanto en la cola que ya se marcó como abandonado.
+            logger.warning(f"AnalysisJob {job_id}: El trabajo ya no está pendiente; no se ejecuta.")
+            return
+        job = AnalysisJob.objects.get(pk=job_id)
+
+        analysis, model_version = analyze_note(job.note)
+        if analysis.startswith("Error"):
+            raise RuntimeError(analysis)
+
+        if job.patient_uid and job.note_id:
+            write_analysis_to_firestore(job.patient_uid, job.note_id, analysis, model_version)
+
+        AnalysisJob.objects.filter(pk=job_id).update(
+            status=AnalysisJob.STATUS_DONE,
+            result=analysis,
+            model_version=model_version or '',
+            finished_at=timezone.now(),
+        )
+        logger.info(f"AnalysisJob {job_id}: Análisis completado.")
+    except Exception as e:
+        logger.error(f"AnalysisJob {job_id}: Error al procesar el trabajo. Detalles: {e}", exc_info=True)
+        AnalysisJob.objects.filter(pk=job_id).update(
+            status=AnalysisJob.STATUS_FAILED, error=str(e), finished_at=timezone.now()
+        )
+    finally:
+        close_old_connections()
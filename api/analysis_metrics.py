@@ -0,0 +1,251 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import AnalysisRun, DiscoveryCursor, NoteLease
+from .note_pages import decode_created_at
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores (segundos) de los buckets del histograma de latencia por nota.
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+RUN_COUNT_FIELDS = (
+    'scanned', 'queued', 'already_analyzed', 'empty', 'analyzed', 'failed', 'skipped', 'written', 'write_errors',
+)
+PHASE_FIELDS = (('fetch', 'fetch_seconds'), ('analysis', 'analysis_seconds'), ('write', 'write_seconds'))
+
+
+class LatencyHistogram:
+    """Histograma de latencias con buckets fijos (LATENCY_BUCKETS), serializable en JSON."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        index = len(LATENCY_BUCKETS)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def merge(self, data):
+        counts = data.get('counts') or []
+        with self._lock:
+            for i, value in enumerate(counts[:len(self.counts)]):
+                self.counts[i] += value
+            self.sum += data.get('sum', 0.0)
+            self.count += data.get('count', 0)
+
+    def to_dict(self):
+        with self._lock:
+            return {'buckets': list(LATENCY_BUCKETS), 'counts': list(self.counts), 'sum': round(self.sum, 6), 'count': self.count}
+
+
+def classify_error(text):
+    """Clase de error estable (para métricas) a partir del texto "Error..." del análisis."""
+    lowered = text.lower()
+    if 'no respondió' in lowered or 'timeout' in lowered:
+        return 'timeout'
+    if 'servidor de inferencia' in lowered:
+        return 'inference_server'
+    if 'no está disponible' in lowered or 'no está listo' in lowered:
+        return 'model_not_ready'
+    return 'generation'
+
+
+class RunRecorder:
+    """Registra en AnalysisRun una ejecución del barrido: se crea al empezar y se completa al terminar."""
+
+    def __init__(self, worker=''):
+        self.worker = worker
+        self.run = None
+        self._started_at = None
+
+    def start(self):
+        stale_before = timezone.now() - timedelta(seconds=getattr(settings, 'IA_ANALYSIS_RUN_STALE_SECONDS', 3600))
+        # Ejecuciones de procesos que murieron a mitad: no deben bloquear las métricas.
+        AnalysisRun.objects.filter(status=AnalysisRun.STATUS_RUNNING, started_at__lt=stale_before).update(
+            status=AnalysisRun.STATUS_ABANDONED, finished_at=timezone.now()
+        )
+        self._started_at = time.monotonic()
+        self.run = AnalysisRun.objects.create(worker=self.worker)
+        return self.run
+
+    def finish(self, counts, discovery=None, pipeline=None, error=None):
+        run = self.run
+        for field in RUN_COUNT_FIELDS:
+            if field in counts:
+                setattr(run, field, counts[field])
+        if discovery is not None:
+            run.scanned = discovery['scanned']
+            run.hit_limit = discovery['hit_limit']
+            run.fetch_seconds = round(discovery['fetch_seconds'], 3)
+        if pipeline is not None:
+            run.analyzed = pipeline['analyzed']
+            run.failed = pipeline['failed']
+            run.skipped = pipeline['skipped']
+            run.written = pipeline['written']
+            run.write_errors = pipeline['write_errors']
+            run.analysis_seconds = round(pipeline['analysis_seconds'], 3)
+            run.write_seconds = round(pipeline['write_seconds'], 3)
+            run.latency_histogram = pipeline['latency_histogram']
+            run.error_classes = dict(pipeline['error_classes'])
+        if error is not None:
+            run.status = AnalysisRun.STATUS_FAILED
+            run.error = str(error)
+            run.error_classes[type(error).__name__] = run.error_classes.get(type(error).__name__, 0) + 1
+        else:
+            run.status = AnalysisRun.STATUS_DONE
+        run.finished_at = timezone.now()
+        run.duration_seconds = round(time.monotonic() - self._started_at, 3)
+        run.save()
+        return run
+
+
+class _RunTotals:
+    """
+    Acumulado de todas las ejecuciones terminadas, leído de forma incremental: cada
+    consulta solo lee las filas nuevas. Solo se avanza sobre el prefijo de ejecuciones
+    ya terminadas, para no contar dos veces una que seguía en curso.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.last_id = 0
+        self.runs = {}
+        self.counts = {field: 0 for field in RUN_COUNT_FIELDS}
+        self.phases = {phase: 0.0 for phase, _ in PHASE_FIELDS}
+        self.errors = {}
+        self.histogram = LatencyHistogram()
+
+    def refresh(self):
+        with self._lock:
+            for run in AnalysisRun.objects.filter(pk__gt=self.last_id).order_by('pk').iterator():
+                if run.status == AnalysisRun.STATUS_RUNNING:
+                    break
+                self.runs[run.status] = self.runs.get(run.status, 0) + 1
+                for field in RUN_COUNT_FIELDS:
+                    self.counts[field] += getattr(run, field)
+                for phase, field in PHASE_FIELDS:
+                    self.phases[phase] += getattr(run, field)
+                for name, value in (run.error_classes or {}).items():
+                    self.errors[name] = self.errors.get(name, 0) + value
+                if run.latency_histogram:
+                    self.histogram.merge(run.latency_histogram)
+                self.last_id = run.pk
+        return self
+
+
+_totals = _RunTotals()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Writer:
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name, kind, help_text, samples):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+            self.lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def _parse_watermark(value):
+    created_at = decode_created_at(value)
+    if isinstance(created_at, datetime):
+        return created_at.timestamp()
+    try:
+        return datetime.fromisoformat(created_at.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+def render_prometheus():
+    """Métricas del análisis programado en formato de texto de Prometheus (0.0.4)."""
+    totals = _totals.refresh()
+    out = _Writer()
+
+    out.metric('pulsoft_analysis_runs_total', 'counter', 'Ejecuciones terminadas del barrido de análisis.',
+               [({'status': status}, count) for status, count in sorted(totals.runs.items())])
+    out.metric('pulsoft_analysis_notes_total', 'counter', 'Notas procesadas por el barrido, por resultado.',
+               [({'outcome': field}, totals.counts[field]) for field in RUN_COUNT_FIELDS])
+    out.metric('pulsoft_analysis_errors_total', 'counter', 'Errores de análisis por clase.',
+               [({'class': name}, count) for name, count in sorted(totals.errors.items())])
+    out.metric('pulsoft_analysis_phase_seconds_total', 'counter', 'Tiempo acumulado por fase del barrido.',
+               [({'phase': phase}, round(seconds, 3)) for phase, seconds in totals.phases.items()])
+
+    histogram = totals.histogram.to_dict()
+    cumulative = 0
+    buckets = []
+    for bound, count in zip(list(LATENCY_BUCKETS) + ['+Inf'], histogram['counts']):
+        cumulative += count
+        buckets.append(({'le': bound}, cumulative))
+    out.metric('pulsoft_analysis_note_latency_seconds', 'histogram', 'Latencia de análisis por nota.', [])
+    for labels, value in buckets:
+        out.lines.append(f'pulsoft_analysis_note_latency_seconds_bucket{{le="{labels["le"]}"}} {value}')
+    out.lines.append(f"pulsoft_analysis_note_latency_seconds_sum {histogram['sum']}")
+    out.lines.append(f"pulsoft_analysis_note_latency_seconds_count {histogram['count']}")
+
+    last = AnalysisRun.objects.exclude(status=AnalysisRun.STATUS_RUNNING).order_by('-pk').first()
+    if last is not None:
+        out.metric('pulsoft_analysis_last_run_timestamp_seconds', 'gauge', 'Fin de la última ejecución.',
+                   [({}, last.finished_at.timestamp() if last.finished_at else 0)])
+        out.metric('pulsoft_analysis_last_run_duration_seconds', 'gauge', 'Duración de la última ejecución.',
+                   [({}, last.duration_seconds or 0)])
+        out.metric('pulsoft_analysis_last_run_notes', 'gauge', 'Notas de la última ejecución, por resultado.',
+                   [({'outcome': field}, getattr(last, field)) for field in RUN_COUNT_FIELDS])
+        out.metric('pulsoft_analysis_backlog_limited', 'gauge',
+                   '1 si la última ejecución alcanzó el máximo de notas por ejecución.',
+                   [({}, int(last.hit_limit))])
+
+    watermark = DiscoveryCursor.objects.values_list('created_at_watermark', flat=True).first()
+    watermark_ts = _parse_watermark(watermark)
+    if watermark_ts is not None:
+        out.metric('pulsoft_analysis_discovery_lag_seconds', 'gauge',
+                   'Antigüedad de la última nota alcanzada por el descubrimiento.',
+                   [({}, round(time.time() - watermark_ts, 3))])
+
+    now = timezone.now()
+    out.metric('pulsoft_analysis_leases_active', 'gauge', 'Notas con un lease de análisis vigente.',
+               [({}, NoteLease.objects.filter(completed_at__isnull=True, expires_at__gt=now).count())])
+
+    from .link_cache import link_cache
+    link_stats = link_cache.stats()
+    out.metric('pulsoft_link_cache_lookups_total', 'counter', 'Consultas a la caché de vínculos de este proceso.',
+               [({'result': 'hit'}, link_stats['hits']), ({'result': 'miss'}, link_stats['misses'])])
+    out.metric('pulsoft_link_cache_invalidations_total', 'counter', 'Invalidaciones de la caché de vínculos.',
+               [({}, link_stats['invalidations'])])
+
+    # Métricas del listener de este proceso, si se ejecuta aquí.
+    from .note_listener import get_listener
+    listener = get_listener()
+    if listener is not None:
+        stats = listener.stats()
+        out.metric('pulsoft_analysis_listener_up', 'gauge', '1 si la suscripción on_snapshot está activa.',
+                   [({}, int(stats['listening']))])
+        out.metric('pulsoft_analysis_queue_depth', 'gauge', 'Notas esperando análisis en el pipeline del listener.',
+                   [({'priority': name}, depth) for name, depth in stats['pipeline']['queued'].items()])
+        out.metric('pulsoft_analysis_listener_notes_total', 'counter', 'Notas entregadas o descartadas por el listener.',
+                   [({'outcome': 'delivered'}, stats['delivered']), ({'outcome': 'dropped'}, stats['dropped'])])
+
+    return out.text()
@@ -0,0 +1,311 @@
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .analysis_jobs import analysis_update
+from .analysis_metrics import LatencyHistogram, classify_error
+from .analysis_priority import PRIORITY_NORMAL, PatientPriority, PriorityLatency, PriorityNoteQueue
+from .leases import NoteLeases, note_path
+from .note_summary import touch_patients
+
+logger = logging.getLogger(__name__)
+
+# Firestore no admite más de 500 escrituras por lote.
+MAX_WRITE_BATCH_SIZE = 500
+
+_STOP = object()
+_FLUSH = object()
+
+
+class AnalysisPipeline:
+    """
+    Pipeline por etapas para el análisis programado de notas:
+
+    1. fetch: quien descubre las notas las entrega con `put()`;
+    2. análisis: `analysis_workers` hilos llaman a `analyze(content)`, que devuelve
+       `(texto, versión_del_modelo)`; sus llamadas concurrentes se agrupan en el micro-batcher;
+    3. escritura: un hilo acumula resultados y los guarda en Firestore con lotes de
+       hasta `write_batch_size` actualizaciones, o antes si pasan `write_flush_seconds`.
+
+    Las colas entre etapas son acotadas (`fetch_queue_size`, `write_queue_size`): si el
+    análisis no da abasto `put()` se bloquea, y si la escritura se retrasa esperan los
+    hilos de análisis. Así la memoria no crece con el tamaño del backlog.
+
+    Con `leases` (api/leases.py), cada nota se analiza solo si se obtiene su lease justo
+    antes del análisis; así varios procesos o un listener y un barrido simultáneos no
+    repiten trabajo.
+
+    La cola de análisis es una PriorityNoteQueue (api/analysis_priority.py): con
+    `priority` (un PatientPriority) las notas de pacientes en pánico o alerta se analizan
+    antes que las demás, y dentro de cada nivel la más antigua primero. La prioridad solo
+    reordena las notas que ya están en la cola (como mucho `fetch_queue_size`): no adelanta
+    notas que aún no se han descubierto. Quien no deba bloquearse en la lectura de la
+    Realtime DB la resuelve antes con `priorities_of()` y la pasa a `put()`/`offer()`.
+    """
+
+    def __init__(self, db, analyze, analysis_workers=4, fetch_queue_size=100, write_queue_size=200,
+                 write_batch_size=100, write_flush_seconds=2.0, leases=None, priority=None,
+                 starvation_seconds=120):
+        self._db = db
+        self._analyze = analyze
+        self._leases = leases
+        self._priority = priority
+        self._latency = PriorityLatency()
+        self.analysis_workers = max(analysis_workers, 1)
+        self.write_batch_size = min(max(write_batch_size, 1), MAX_WRITE_BATCH_SIZE)
+        self.write_flush_seconds = write_flush_seconds
+
+        self._analysis_queue = PriorityNoteQueue(maxsize=fetch_queue_size, starvation_seconds=starvation_seconds)
+        self._write_queue = queue.Queue(maxsize=write_queue_size)
+        self._threads = []
+
+        self._lock = threading.Lock()
+        self._started_at = None
+        self.fetched = 0
+        self.analyzed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.written = 0
+        self.write_batches = 0
+        self.write_errors = 0
+        self.analysis_seconds = 0.0
+        self.write_seconds = 0.0
+        self.error_classes = {}
+        self._histogram = LatencyHistogram()
+
+    @classmethod
+    def from_settings(cls, db, analyze, analysis_workers=None):
+        """Pipeline configurado con los IA_PIPELINE_*; `analysis_workers` sustituye al de settings."""
+        leases = None
+        if getattr(settings, 'IA_NOTE_LEASES_ENABLED', True):
+            leases = NoteLeases(ttl_seconds=getattr(settings, 'IA_NOTE_LEASE_SECONDS', 300))
+        priority = None
+        if getattr(settings, 'IA_PRIORITY_ENABLED', True):
+            priority = PatientPriority(ttl_seconds=getattr(settings, 'IA_PRIORITY_CACHE_SECONDS', 30))
+        return cls(
+            db,
+            analyze,
+            analysis_workers=analysis_workers or getattr(settings, 'IA_PIPELINE_ANALYSIS_WORKERS', 8),
+            fetch_queue_size=getattr(settings, 'IA_PIPELINE_FETCH_QUEUE_SIZE', 100),
+            write_queue_size=getattr(settings, 'IA_PIPELINE_WRITE_QUEUE_SIZE', 200),
+            write_batch_size=getattr(settings, 'IA_PIPELINE_WRITE_BATCH_SIZE', 100),
+            write_flush_seconds=getattr(settings, 'IA_PIPELINE_WRITE_FLUSH_SECONDS', 2.0),
+            leases=leases,
+            priority=priority,
+            starvation_seconds=getattr(settings, 'IA_PRIORITY_STARVATION_SECONDS', 120),
+        )
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def _count_error(self, error_class):
+        with self._lock:
+            self.error_classes[error_class] = self.error_classes.get(error_class, 0) + 1
+
+    def start(self):
+        self._started_at = time.monotonic()
+        for index in range(self.analysis_workers):
+            self._threads.append(threading.Thread(
+                target=self._analysis_loop, name=f'analysis-pipeline-{index}', daemon=True
+            ))
+        self._threads.append(threading.Thread(target=self._write_loop, name='analysis-pipeline-writer', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _priority_of(self, patient_uid):
+        return self._priority.get(patient_uid) if self._priority is not None else PRIORITY_NORMAL
+
+    def priorities_of(self, patient_uids):
+        """Prioridad de varios pacientes de una vez (lecturas en paralelo), `{uid: prioridad}`."""
+        if self._priority is None:
+            return {patient_uid: PRIORITY_NORMAL for patient_uid in patient_uids}
+        return self._priority.get_many(patient_uids)
+
+    def put(self, patient_uid, note_id, content, created_at='', priority=None):
+        """
+        Entrega una nota a la etapa de análisis; se bloquea si la cola está llena. Sin
+        `priority`, se lee la del paciente (puede bloquear en la Realtime DB).
+        """
+        if priority is None:
+            priority = self._priority_of(patient_uid)
+        self._analysis_queue.put((patient_uid, note_id, content), priority=priority, created_at=created_at)
+        self._count('fetched')
+
+    def offer(self, patient_uid, note_id, content, created_at='', priority=None):
+        """Como `put()`, pero sin bloquear: devuelve False si la cola de análisis está llena."""
+        if priority is None:
+            priority = self._priority_of(patient_uid)
+        try:
+            self._analysis_queue.put_nowait((patient_uid, note_id, content), priority=priority, created_at=created_at)
+        except queue.Full:
+            return False
+        self._count('fetched')
+        return True
+
+    def drain(self):
+        """Espera a que todas las notas entregadas estén analizadas y escritas en Firestore."""
+        self._analysis_queue.join()
+        self._write_queue.put(_FLUSH)
+        self._write_queue.join()
+
+    def close(self):
+        """Vacía el pipeline, detiene sus hilos y devuelve las estadísticas de la ejecución."""
+        self.drain()
+        for _ in range(self.analysis_workers):
+            self._analysis_queue.put_control(_STOP)
+        self._write_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        return self.stats()
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+            return {
+                'fetched': self.fetched,
+                'analyzed': self.analyzed,
+                'failed': self.failed,
+                'skipped': self.skipped,
+                'written': self.written,
+                'write_batches': self.write_batches,
+                'write_errors': self.write_errors,
+                'elapsed_seconds': round(elapsed, 3),
+                'notes_per_second': round(self.written / elapsed, 3) if elapsed else 0.0,
+                'analysis_seconds': round(self.analysis_seconds, 3),
+                'write_seconds': round(self.write_seconds, 3),
+                'error_classes': dict(self.error_classes),
+                'latency_histogram': self._histogram.to_dict(),
+                'leases': self._leases.stats() if self._leases is not None else None,
+                'queued': self._analysis_queue.qsize_by_priority(),
+                'priorities': self._latency.stats(),
+                'starvation_promotions': self._analysis_queue.promotions,
+            }
+
+    def _analysis_loop(self):
+        try:
+            while True:
+                item, priority, enqueued_at = self._analysis_queue.get()
+                try:
+                    if item is _STOP:
+                        return
+                    patient_uid, note_id, content = item
+                    # Los hilos viven mucho: se descartan conexiones caídas o caducadas.
+                    close_old_connections()
+                    path = note_path(patient_uid, note_id)
+                    if self._leases is not None and not self._leases.acquire(path):
+                        # Otro proceso la está analizando o ya la completó.
+                        self._count('skipped')
+                        continue
+                    started_at = time.monotonic()
+                    error_class = None
+                    try:
+                        analysis, model_version = self._analyze(content)
+                    except Exception as e:
+                        analysis, model_version = f"Error: {e}", None
+                        error_class = type(e).__name__
+                    seconds = time.monotonic() - started_at
+                    self._count('analysis_seconds', seconds)
+                    self._histogram.observe(seconds)
+
+                    if analysis.startswith("Error"):
+                        self._count('failed')
+                        self._count_error(error_class or classify_error(analysis))
+                        if self._leases is not None:
+                            self._leases.release(path)
+                        logger.error(f"AnalysisPipeline: No se pudo analizar la nota {note_id} de {patient_uid}: {analysis}")
+                    else:
+                        self._count('analyzed')
+                        self._latency.record(priority, time.monotonic() - enqueued_at)
+                        self._write_queue.put((patient_uid, note_id, analysis, model_version))
+                finally:
+                    self._analysis_queue.task_done()
+        finally:
+            close_old_connections()
+
+    def _write_loop(self):
+        try:
+            self._write_items()
+        finally:
+            close_old_connections()
+
+    def _write_items(self):
+        pending = []
+        oldest_at = None
+        while True:
+            timeout = None
+            if pending:
+                timeout = max(self.write_flush_seconds - (time.monotonic() - oldest_at), 0)
+            try:
+                item = self._write_queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush(pending)
+                pending = []
+                continue
+
+            if item is _STOP:
+                self._write_queue.task_done()
+                return
+            if item is _FLUSH:
+                self._flush(pending)
+                pending = []
+                self._write_queue.task_done()
+                continue
+
+            if not pending:
+                oldest_at = time.monotonic()
+            pending.append(item)
+            if len(pending) >= self.write_batch_size:
+                self._flush(pending)
+                pending = []
+
+    def _flush(self, pending):
+        if not pending:
+            return
+        close_old_connections()
+        started_at = time.monotonic()
+        self._commit(pending)
+        self._count('write_seconds', time.monotonic() - started_at)
+        touch_patients(patient_uid for patient_uid, _, _, _ in pending)
+        # Los elementos del lote se marcan como terminados una vez guardados.
+        for _ in pending:
+            self._write_queue.task_done()
+
+    def _note_ref(self, patient_uid, note_id):
+        return self._db.collection('users').document(patient_uid).collection('notes').document(note_id)
+
+    def _commit(self, pending):
+        batch = self._db.batch()
+        for patient_uid, note_id, analysis, model_version in pending:
+            batch.update(self._note_ref(patient_uid, note_id), analysis_update(analysis, model_version))
+        try:
+            batch.commit()
+            self._count('written', len(pending))
+            self._count('write_batches')
+            self._complete_leases(pending)
+            return
+        except Exception as e:
+            # El lote es atómico: una nota borrada lo hace fallar entero. Se reintenta nota a nota.
+            logger.warning(f"AnalysisPipeline: Falló un lote de {len(pending)} escrituras, reintentando por separado: {e}")
+
+        for patient_uid, note_id, analysis, model_version in pending:
+            try:
+                self._note_ref(patient_uid, note_id).update(analysis_update(analysis, model_version))
+                self._count('written')
+                self._complete_leases([(patient_uid, note_id, analysis, model_version)])
+            except Exception as e:
+                self._count('write_errors')
+                self._count_error(f'write_{type(e).__name__}')
+                if self._leases is not None:
+                    self._leases.release(note_path(patient_uid, note_id))
+                logger.error(f"AnalysisPipeline: No se pudo guardar el análisis de la nota {note_id} de {patient_uid}: {e}")
+
+    def _complete_leases(self, written):
+        if self._leases is not None:
+            self._leases.complete([note_path(patient_uid, note_id) for patient_uid, note_id, _, _ in written])
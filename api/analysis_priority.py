@@ -0,0 +1,214 @@
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .analysis_cache import LRUCache
+from .benchmarking import percentile
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_PANIC = 0
+PRIORITY_ALERT = 1
+PRIORITY_NORMAL = 2
+PRIORITY_NAMES = {
+    PRIORITY_PANIC: 'panic',
+    PRIORITY_ALERT: 'alert',
+    PRIORITY_NORMAL: 'normal',
+}
+
+# Latencias recientes que se conservan por prioridad para los percentiles.
+LATENCY_WINDOW = 1000
+
+
+class PatientPriority:
+    """
+    Prioridad de un paciente según sus signos en la Realtime Database
+    (`patients/{uid}`: `panicMode` y `alert`, escritos por la app). Las lecturas se
+    cachean `ttl_seconds` por paciente; si la lectura falla se usa la prioridad normal.
+    `get_many` resuelve varios pacientes a la vez, con hasta `max_concurrent_reads`
+    lecturas en paralelo para los que no están en caché.
+    """
+
+    def __init__(self, ttl_seconds=30, max_entries=10000, max_concurrent_reads=8):
+        self._cache = LRUCache(max_entries, ttl_seconds)
+        self.max_concurrent_reads = max(max_concurrent_reads, 1)
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.errors = 0
+
+    def get(self, patient_uid):
+        priority = self._cache.get(patient_uid)
+        if priority is not None:
+            return priority
+        priority = self._read(patient_uid)
+        self._cache.set(patient_uid, priority)
+        return priority
+
+    def get_many(self, patient_uids):
+        """Devuelve `{uid: prioridad}`; los pacientes sin caché se leen en paralelo."""
+        result = {}
+        missing = []
+        for patient_uid in set(patient_uids):
+            priority = self._cache.get(patient_uid)
+            if priority is None:
+                missing.append(patient_uid)
+            else:
+                result[patient_uid] = priority
+        if len(missing) == 1:
+            result[missing[0]] = self.get(missing[0])
+        elif missing:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrent_reads, len(missing))) as executor:
+                for patient_uid, priority in zip(missing, executor.map(self._read, missing)):
+                    self._cache.set(patient_uid, priority)
+                    result[patient_uid] = priority
+        return result
+
+    def _read(self, patient_uid):
+        from firebase_config import db_realtime
+
+        with self._lock:
+            self.lookups += 1
+        try:
+            vitals = db_realtime.child('patients').child(patient_uid).get() or {}
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            logger.warning(f"PatientPriority: No se pudo leer patients/{patient_uid}: {e}")
+            return PRIORITY_NORMAL
+        if not isinstance(vitals, dict):
+            return PRIORITY_NORMAL
+        if vitals.get('panicMode'):
+            return PRIORITY_PANIC
+        if vitals.get('alert'):
+            return PRIORITY_ALERT
+        return PRIORITY_NORMAL
+
+
+class PriorityNoteQueue:
+    """
+    Cola acotada para la etapa de análisis, con la interfaz de `queue.Queue` que usa el
+    pipeline (put/get/task_done/join). Sirve primero las notas de pacientes en pánico,
+    luego en alerta y después el resto; dentro de cada nivel, la nota más antigua
+    (`createdAt`) primero.
+
+    Protección contra inanición: si la nota en cabeza de un nivel inferior lleva más de
+    `starvation_seconds` esperando, se sirve antes que las de niveles superiores.
+
+    Los elementos de control (fin de hilos) van por `put_control` y se sirven antes que
+    cualquier nota, sin contar para `maxsize`.
+    """
+
+    def __init__(self, maxsize=0, starvation_seconds=120):
+        self.maxsize = maxsize
+        self.starvation_seconds = starvation_seconds
+        self._heaps = {priority: [] for priority in PRIORITY_NAMES}
+        self._control = deque()
+        self._seq = itertools.count()
+        self._size = 0
+        self._unfinished = 0
+
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._not_full = threading.Condition(self._mutex)
+        self._all_done = threading.Condition(self._mutex)
+        self.promotions = 0
+
+    def put(self, item, priority=PRIORITY_NORMAL, created_at='', block=True):
+        with self._not_full:
+            if self.maxsize > 0:
+                if not block and self._size >= self.maxsize:
+                    raise queue.Full
+                while self._size >= self.maxsize:
+                    self._not_full.wait()
+            entry = (str(created_at or ''), next(self._seq), time.monotonic(), item)
+            heapq.heappush(self._heaps[priority], entry)
+            self._size += 1
+            self._unfinished += 1
+            self._not_empty.notify()
+
+    def put_nowait(self, item, priority=PRIORITY_NORMAL, created_at=''):
+        self.put(item, priority, created_at, block=False)
+
+    def put_control(self, item):
+        with self._mutex:
+            self._control.append(item)
+            self._unfinished += 1
+            self._not_empty.notify()
+
+    def get(self):
+        """Devuelve `(item, prioridad, instante_de_encolado)`; la prioridad es None para control."""
+        with self._not_empty:
+            while not self._size and not self._control:
+                self._not_empty.wait()
+            if self._control:
+                return self._control.popleft(), None, None
+            priority = self._select()
+            _, _, enqueued_at, item = heapq.heappop(self._heaps[priority])
+            self._size -= 1
+            self._not_full.notify()
+            return item, priority, enqueued_at
+
+    def _select(self):
+        now = time.monotonic()
+        best = min(priority for priority, heap in self._heaps.items() if heap)
+        starving = [
+            (now - heap[0][2], priority)
+            for priority, heap in self._heaps.items()
+            if priority > best and heap and now - heap[0][2] > self.starvation_seconds
+        ]
+        if starving:
+            self.promotions += 1
+            return max(starving)[1]
+        return best
+
+    def task_done(self):
+        with self._all_done:
+            self._unfinished -= 1
+            if self._unfinished < 0:
+                raise ValueError('task_done() llamado más veces que elementos encolados')
+            if self._unfinished == 0:
+                self._all_done.notify_all()
+
+    def join(self):
+        with self._all_done:
+            while self._unfinished:
+                self._all_done.wait()
+
+    def qsize_by_priority(self):
+        with self._mutex:
+            return {PRIORITY_NAMES[priority]: len(heap) for priority, heap in self._heaps.items()}
+
+
+class PriorityLatency:
+    """Latencia encolado -> análisis terminado por prioridad (ventana de las últimas LATENCY_WINDOW)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {priority: deque(maxlen=LATENCY_WINDOW) for priority in PRIORITY_NAMES}
+        self._counts = {priority: 0 for priority in PRIORITY_NAMES}
+
+    def record(self, priority, seconds):
+        with self._lock:
+            self._samples[priority].append(seconds * 1000.0)
+            self._counts[priority] += 1
+
+    def stats(self):
+        with self._lock:
+            result = {}
+            for priority, name in PRIORITY_NAMES.items():
+                samples = list(self._samples[priority])
+                result[name] = {
+                    'analyzed': self._counts[priority],
+                    'latency_ms': {
+                        'avg': round(sum(samples) / len(samples), 1),
+                        'p50': round(percentile(samples, 50), 1),
+                        'p95': round(percentile(samples, 95), 1),
+                        'max': round(max(samples), 1),
+                    } if samples else None,
+                }
+            return result
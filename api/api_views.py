@@ -1,16 +1,45 @@
 # api/api_views.py
+import hmac
+import json
 import logging
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
 
+from django.conf import settings
+from django.db import IntegrityError
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
 
 # Importamos la lógica de IA
-from .ia_logic import generate_diagnosis_and_suggestions
-from .models import FirebaseUser, CaregiverPatientLink
-from firebase_config import db
+from .ia_logic import (
+    analyze_note,
+    astream_diagnosis_and_suggestions,
+    get_inference_stats,
+    get_model_status,
+)
+from .analysis_metrics import render_prometheus
+from .link_cache import link_cache
+from .links import aauthorized_link, aauthorized_patients, alink_denial, authorized_link, authorized_patients, link_denial
+from .note_pages import (
+    InvalidPageRequest,
+    afetch_merged_notes_page,
+    afetch_notes_page,
+    fetch_merged_notes_page,
+    fetch_notes_page,
+    fields_from,
+    page_size_from,
+)
+from .note_summary import aget_summary, etag_for, get_summary, not_modified, notes_etag, set_validators
+from .decorators import closes_async_db
+from .model_lifecycle import ModelNotReadyError
+from .note_listener import get_listener
+from .scheduler import get_election
+from .analysis_jobs import JobQueueFullError, fail_stale_jobs, submit_job
+from .models import FirebaseUser, CaregiverPatientLink, AnalysisJob
+from firebase_config import db, get_async_db
 
 # Configurar el logger para este módulo
 logger = logging.getLogger(__name__)
@@ -20,24 +49,31 @@ class AnalyzeNoteView(APIView):
     def post(self, request, *args, **kwargs):
         """
         Procesa una nota clínica enviada por POST para generar un diagnóstico y sugerencias de IA.
+        El campo opcional `assisted` activa la decodificación asistida por n-gramas del prompt.
         """
         try:
             note = request.data.get('note', '')
+            assisted = request.data.get('assisted')
+            if assisted is not None and not isinstance(assisted, bool):
+                return Response({'error': 'El campo "assisted" debe ser booleano'}, status=status.HTTP_400_BAD_REQUEST)
 
             if not note:
                 logger.warning("AnalyzeNoteView: El campo 'note' es requerido en la solicitud POST.")
                 return Response({'error': 'El campo "note" es requerido'}, status=status.HTTP_400_BAD_REQUEST)
 
             # Llama a la función de lógica de IA
-            # generate_diagnosis_and_suggestions devuelve una cadena única
-            generated_analysis = generate_diagnosis_and_suggestions(note)
+            # analyze_note devuelve el texto y la versión del modelo que lo generó
+            generated_analysis, model_version = analyze_note(note, assisted=assisted)
 
             if generated_analysis.startswith("Error:"):
                 logger.error(f"AnalyzeNoteView: Error en la lógica de IA para la nota. Detalles: {generated_analysis}", exc_info=True)
                 return Response({'error': generated_analysis}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
             logger.info("AnalyzeNoteView: Análisis de IA generado exitosamente.")
-            return Response({'analisis_completo': generated_analysis}, status=status.HTTP_200_OK)
+            return Response(
+                {'analisis_completo': generated_analysis, 'model_version': model_version},
+                status=status.HTTP_200_OK,
+            )
 
         except Exception as e:
             logger.error(f"AnalyzeNoteView: Error inesperado en el método POST. Detalles: {e}", exc_info=True)
@@ -50,6 +86,177 @@ class AnalyzeNoteView(APIView):
         logger.info("AnalyzeNoteView: Solicitud GET recibida.")
         return Response({'message': 'Endpoint de análisis de notas de IA. Usa el método POST para enviar una nota para análisis.'}, status=status.HTTP_200_OK)
 
+def _serialize_job(job):
+    return {
+        'job_id': str(job.id),
+        'status': job.status,
+        'result': job.result,
+        'error': job.error,
+        'model_version': job.model_version or None,
+        'patient_uid': job.patient_uid or None,
+        'note_id': job.note_id or None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AnalysisJobCreateView(APIView):
+    def post(self, request, *args, **kwargs):
+        """
+        Encola una nota para análisis y responde inmediatamente con el id del trabajo.
+        Si se envían patient_uid y note_id, el resultado se escribe directamente en la nota de Firestore.
+        """
+        try:
+            note = request.data.get('note', '')
+            patient_uid = request.data.get('patient_uid', '')
+            note_id = request.data.get('note_id', '')
+
+            if not note:
+                return Response({'error': 'El campo "note" es requerido'}, status=status.HTTP_400_BAD_REQUEST)
+
+            if bool(patient_uid) != bool(note_id):
+                return Response({'error': 'patient_uid y note_id deben enviarse juntos'}, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                job = submit_job(note, patient_uid=patient_uid, note_id=note_id)
+            except JobQueueFullError as e:
+                logger.warning(f"AnalysisJobCreateView: {e}")
+                return Response({'error': 'La cola de análisis está llena. Inténtalo más tarde.'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+            data = _serialize_job(job)
+            data['status_url'] = request.build_absolute_uri(f'/api/analysis-jobs/{job.id}/')
+            return Response(data, status=status.HTTP_202_ACCEPTED)
+
+        except Exception as e:
+            logger.error(f"AnalysisJobCreateView: Error inesperado. Detalles: {e}", exc_info=True)
+            return Response({'error': 'Error interno del servidor'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AnalysisJobDetailView(APIView):
+    def get(self, request, job_id, *args, **kwargs):
+        """
+        Devuelve el estado y, si terminó, el resultado de un trabajo de análisis.
+        """
+        try:
+            try:
+                job = AnalysisJob.objects.get(pk=job_id)
+            except AnalysisJob.DoesNotExist:
+                return Response({'error': 'Trabajo no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+            if job.status in (AnalysisJob.STATUS_PENDING, AnalysisJob.STATUS_RUNNING) and fail_stale_jobs(pk=job.pk):
+                # Abandonado por un proceso que se reinició: el cliente deja de esperar.
+                job.refresh_from_db()
+            return Response(_serialize_job(job), status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.error(f"AnalysisJobDetailView: Error inesperado. Detalles: {e}", exc_info=True)
+            return Response({'error': 'Error interno del servidor'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def analyze_note_stream(request):
+    """
+    Variante en streaming de AnalyzeNoteView (Server-Sent Events).
+    Envía eventos `token` con el texto a medida que el modelo lo genera y un evento
+    `done` con el análisis completo. Pensada para ejecutarse bajo core/asgi.py.
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'JSON inválido'}, status=400)
+
+    note = data.get('note', '')
+    if not note:
+        logger.warning("analyze_note_stream: El campo 'note' es requerido en la solicitud POST.")
+        return JsonResponse({'error': 'El campo "note" es requerido'}, status=400)
+
+    async def event_stream():
+        chunks = []
+        try:
+            async for chunk in astream_diagnosis_and_suggestions(note):
+                chunks.append(chunk)
+                yield _sse_event('token', {'text': chunk})
+            logger.info("analyze_note_stream: Análisis de IA en streaming completado.")
+            yield _sse_event('done', {'analisis_completo': ''.join(chunks)})
+        except ModelNotReadyError as e:
+            logger.error(f"analyze_note_stream: El modelo no está listo. Detalles: {e}")
+            yield _sse_event('error', {'error': f'El modelo de IA no está disponible ({e.state}).'})
+        except Exception as e:
+            logger.error(f"analyze_note_stream: Error inesperado durante el streaming. Detalles: {e}", exc_info=True)
+            yield _sse_event('error', {'error': 'Error interno del servidor al procesar la solicitud.'})
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Evita que proxies como nginx acumulen la respuesta antes de enviarla.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ReadinessView(APIView):
+    def get(self, request, *args, **kwargs):
+        """
+        Sonda de readiness para balanceadores de carga.
+        Devuelve 200 cuando el modelo de IA está cargado y calentado, 503 en cualquier otro estado.
+        Si el modelo aún no se ha empezado a cargar, la consulta inicia la carga en segundo plano.
+        """
+        model_status = get_model_status(start_loading=True)
+        if model_status['ready']:
+            return Response(model_status, status=status.HTTP_200_OK)
+        return Response(model_status, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class InferenceStatsView(APIView):
+    def get(self, request, *args, **kwargs):
+        """
+        Devuelve estadísticas del micro-batching de inferencia (tamaño y llenado de los lotes),
+        de la caché de vínculos y, si están activos en este proceso, del listener de notas y
+        de la elección de líder.
+        """
+        try:
+            stats = get_inference_stats()
+            stats['link_cache'] = link_cache.stats()
+            listener = get_listener()
+            if listener is not None:
+                stats['note_listener'] = listener.stats()
+            election = get_election()
+            if election is not None:
+                stats['scheduler'] = election.status()
+            return Response(stats, status=status.HTTP_200_OK)
+        except Exception as e:
+            logger.error(f"InferenceStatsView: Error inesperado. Detalles: {e}", exc_info=True)
+            return Response({'error': 'Error interno del servidor'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+def _metrics_authorized(request):
+    """Usuario staff con sesión, o `Authorization: Bearer <IA_METRICS_TOKEN>`."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and user.is_staff:
+        return True
+    token = getattr(settings, 'IA_METRICS_TOKEN', None)
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    if not token or scheme.lower() != 'bearer':
+        return False
+    return hmac.compare_digest(credentials.strip().encode(), token.encode())
+
+@require_http_methods(["GET"])
+def analysis_metrics(request):
+    """
+    Métricas del análisis programado en formato de texto de Prometheus: ejecuciones,
+    notas por resultado, errores por clase, tiempo por fase, histograma de latencia
+    por nota, retraso del descubrimiento, estado del listener y aciertos de la caché
+    de vínculos. Solo para staff o para quien presente IA_METRICS_TOKEN (403 si no).
+    """
+    if not _metrics_authorized(request):
+        logger.warning("analysis_metrics: Acceso denegado a las métricas.")
+        return HttpResponse('Acceso denegado\n', status=403, content_type='text/plain; charset=utf-8')
+    try:
+        return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    except Exception as e:
+        logger.error(f"analysis_metrics: Error al generar las métricas. Detalles: {e}", exc_info=True)
+        return HttpResponse('Error interno del servidor\n', status=500, content_type='text/plain; charset=utf-8')
+
 @method_decorator(csrf_exempt, name='dispatch')
 class CaregiverPatientsView(APIView):
     def get(self, request, *args, **kwargs):
@@ -69,12 +276,11 @@ class CaregiverPatientsView(APIView):
             except FirebaseUser.DoesNotExist:
                 return Response({'error': 'Cuidador no encontrado'}, status=status.HTTP_404_NOT_FOUND)
 
-            # Obtener pacientes vinculados desde Firestore
-            query = db.collection('caregiverPatientLinks').where('caregiverUid', '==', caregiver_uid).stream()
-            patient_uids = [doc.to_dict().get('patientUid') for doc in query]
+            # Obtener pacientes vinculados (caché de vínculos sobre Postgres)
+            patient_uids = link_cache.patients_of(caregiver_uid)
 
             # Obtener información de los pacientes desde Django
-            linked_patients = FirebaseUser.objects.filter(uid__in=patient_uids, user_type='patient')
+            linked_patients = FirebaseUser.objects.filter(uid__in=patient_uids, user_type='patient').order_by('uid')
             
             patients_data = []
             for patient in linked_patients:
@@ -84,69 +290,248 @@ class CaregiverPatientsView(APIView):
                     'user_type': patient.user_type
                 })
 
-            return Response({
+            # La lista sale solo de Postgres: su versión es el propio contenido.
+            etag = etag_for(json.dumps(patients_data, sort_keys=True), request)
+            cached = not_modified(request, etag)
+            if cached is not None:
+                return cached
+
+            response = Response({
                 'caregiver_uid': caregiver_uid,
                 'linked_patients': patients_data,
                 'total_patients': len(patients_data)
             }, status=status.HTTP_200_OK)
+            return set_validators(response, etag)
 
         except Exception as e:
             logger.error(f"CaregiverPatientsView: Error inesperado. Detalles: {e}", exc_info=True)
             return Response({'error': 'Error interno del servidor'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-@method_decorator(csrf_exempt, name='dispatch')
-class PatientNotesView(APIView):
-    def get(self, request, *args, **kwargs):
-        """
-        Obtiene las notas de un paciente específico.
-        Requiere el UID del paciente como parámetro.
-        """
-        try:
-            patient_uid = request.GET.get('patient_uid')
-            caregiver_uid = request.GET.get('caregiver_uid')
-            
-            if not patient_uid:
-                return Response({'error': 'El parámetro patient_uid es requerido'}, status=status.HTTP_400_BAD_REQUEST)
-
-            if not caregiver_uid:
-                return Response({'error': 'El parámetro caregiver_uid es requerido'}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Verificar que el paciente existe
-            try:
-                patient = FirebaseUser.objects.get(uid=patient_uid, user_type='patient')
-            except FirebaseUser.DoesNotExist:
-                return Response({'error': 'Paciente no encontrado'}, status=status.HTTP_404_NOT_FOUND)
-
-            # Verificar que el cuidador existe
-            try:
-                caregiver = FirebaseUser.objects.get(uid=caregiver_uid, user_type='caregiver')
-            except FirebaseUser.DoesNotExist:
-                return Response({'error': 'Cuidador no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+def _patient_notes_params(request):
+    """(patient_uid, caregiver_uid, respuesta de error o None) de /api/patient-notes/."""
+    patient_uid = request.GET.get('patient_uid')
+    caregiver_uid = request.GET.get('caregiver_uid')
+    if not patient_uid:
+        return None, None, JsonResponse({'error': 'El parámetro patient_uid es requerido'}, status=status.HTTP_400_BAD_REQUEST)
+    if not caregiver_uid:
+        return None, None, JsonResponse({'error': 'El parámetro caregiver_uid es requerido'}, status=status.HTTP_400_BAD_REQUEST)
+    return patient_uid, caregiver_uid, None
+
+def _patient_notes_response(patient_uid, patient_email, caregiver_uid, page, page_size, etag, summary):
+    notes, next_cursor = page
+    response = JsonResponse({
+        'patient_uid': patient_uid,
+        'patient_email': patient_email,
+        'caregiver_uid': caregiver_uid,
+        'notes': notes,
+        # Notas de esta página; next_cursor es None en la última.
+        'total_notes': len(notes),
+        'page_size': page_size,
+        'next_cursor': next_cursor,
+    }, status=status.HTTP_200_OK)
+    return set_validators(response, etag, summary.last_modified)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def patient_notes_sync(request):
+    """
+    /api/patient-notes/ para el despliegue WSGI (IA_ASYNC_NOTE_VIEWS=0): misma respuesta
+    que `patient_notes`, con el cliente síncrono de Firestore y el ORM síncrono.
+    """
+    try:
+        patient_uid, caregiver_uid, error = _patient_notes_params(request)
+        if error is not None:
+            return error
+
+        # Autorización en una sola consulta: vínculo y tipo de ambos usuarios
+        link = authorized_link(caregiver_uid, patient_uid)
+        if link is None:
+            message, code = link_denial(caregiver_uid, patient_uid)
+            return JsonResponse({'error': message}, status=code)
+
+        summary = get_summary(db, patient_uid)
+        etag = notes_etag(summary, request)
+        cached = not_modified(request, etag, summary.last_modified)
+        if cached is not None:
+            return cached
 
-            # Verificar que existe el vínculo entre cuidador y paciente
-            query = db.collection('caregiverPatientLinks').where('caregiverUid', '==', caregiver_uid).where('patientUid', '==', patient_uid).stream()
-            if not list(query):
-                return Response({'error': 'No existe vínculo entre el cuidador y el paciente'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            page_size = page_size_from(request.GET.get('page_size'))
+            fields = fields_from(request.GET.get('fields'))
+            page = fetch_notes_page(db, patient_uid, page_size, cursor=request.GET.get('cursor'), fields=fields)
+        except InvalidPageRequest as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return _patient_notes_response(patient_uid, link.patient.email, caregiver_uid, page, page_size, etag, summary)
+
+    except Exception as e:
+        logger.error(f"patient_notes_sync: Error inesperado. Detalles: {e}", exc_info=True)
+        return JsonResponse({'error': 'Error interno del servidor'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@closes_async_db
+async def patient_notes(request):
+    """
+    Obtiene las notas de un paciente específico, paginadas de la más reciente a la más antigua.
+    Requiere el UID del paciente como parámetro. Opcionales: page_size (acotado por
+    IA_NOTES_MAX_PAGE_SIZE), cursor (el next_cursor de la página anterior) y fields
+    (campos separados por comas, o 'summary' para omitir el texto del análisis).
+
+    Vista asíncrona (AsyncClient de Firestore y ORM asíncrono): bajo core/asgi.py un
+    worker atiende muchas solicitudes mientras esperan a Firestore o a Postgres. Con
+    WSGI se usa `patient_notes_sync` (ver IA_ASYNC_NOTE_VIEWS).
+    """
+    try:
+        patient_uid, caregiver_uid, error = _patient_notes_params(request)
+        if error is not None:
+            return error
+
+        # Autorización en una sola consulta: vínculo y tipo de ambos usuarios
+        link = await aauthorized_link(caregiver_uid, patient_uid)
+        if link is None:
+            message, code = await alink_denial(caregiver_uid, patient_uid)
+            return JsonResponse({'error': message}, status=code)
+
+        # Versión de las notas desde el resumen en Postgres: si el cliente ya la tiene,
+        # 304 sin leer la colección de notas.
+        db_async = get_async_db()
+        summary = await aget_summary(db_async, patient_uid)
+        etag = notes_etag(summary, request)
+        cached = not_modified(request, etag, summary.last_modified)
+        if cached is not None:
+            return cached
+
+        # Una página de notas (cursor opaco, tamaño acotado en el servidor y proyección opcional)
+        try:
+            page_size = page_size_from(request.GET.get('page_size'))
+            fields = fields_from(request.GET.get('fields'))
+            page = await afetch_notes_page(
+                db_async, patient_uid, page_size, cursor=request.GET.get('cursor'), fields=fields
+            )
+        except InvalidPageRequest as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return _patient_notes_response(patient_uid, link.patient.email, caregiver_uid, page, page_size, etag, summary)
+
+    except Exception as e:
+        logger.error(f"patient_notes: Error inesperado. Detalles: {e}", exc_info=True)
+        return JsonResponse({'error': 'Error interno del servidor'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+def _caregiver_notes_params(request):
+    """(caregiver_uid, patient_uids o None para 'all', máximo, respuesta de error o None)."""
+    caregiver_uid = request.GET.get('caregiver_uid')
+    requested = request.GET.get('patient_uids', 'all')
+    max_patients = getattr(settings, 'IA_BATCH_NOTES_MAX_PATIENTS', 50)
+
+    if not caregiver_uid:
+        return None, None, max_patients, JsonResponse({'error': 'El parámetro caregiver_uid es requerido'}, status=status.HTTP_400_BAD_REQUEST)
+
+    patient_uids = None
+    if requested != 'all':
+        patient_uids = sorted({uid.strip() for uid in requested.split(',') if uid.strip()})
+        if not patient_uids:
+            return None, None, max_patients, JsonResponse({'error': 'El parámetro patient_uids no es válido'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(patient_uids) > max_patients:
+            return None, None, max_patients, JsonResponse({'error': f'Como máximo {max_patients} pacientes por solicitud'}, status=status.HTTP_400_BAD_REQUEST)
+    return caregiver_uid, patient_uids, max_patients, None
+
+def _caregiver_patients_denial(patient_uids, patients, max_patients):
+    """Respuesta de error si falta algún vínculo pedido o hay demasiados pacientes; si no, None."""
+    if patient_uids is not None:
+        unauthorized = sorted(set(patient_uids) - {patient.uid for patient in patients})
+        if unauthorized:
+            return JsonResponse({
+                'error': 'No existe vínculo entre el cuidador y algunos pacientes',
+                'unauthorized_patients': unauthorized,
+            }, status=status.HTTP_403_FORBIDDEN)
+    elif len(patients) > max_patients:
+        return JsonResponse({'error': f'Más de {max_patients} pacientes vinculados: indique patient_uids'}, status=status.HTTP_400_BAD_REQUEST)
+    return None
+
+def _caregiver_notes_response(caregiver_uid, patients, page, page_size):
+    notes, next_cursor = page
+    return JsonResponse({
+        'caregiver_uid': caregiver_uid,
+        'patients': [{'uid': patient.uid, 'email': patient.email} for patient in patients],
+        'notes': notes,
+        'total_notes': len(notes),
+        'page_size': page_size,
+        'next_cursor': next_cursor,
+    }, status=status.HTTP_200_OK)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+def caregiver_notes_sync(request):
+    """
+    /api/caregiver-notes/ para el despliegue WSGI (IA_ASYNC_NOTE_VIEWS=0): misma respuesta
+    que `caregiver_notes`; las páginas de cada paciente se leen en el pool de hilos del proceso.
+    """
+    try:
+        caregiver_uid, patient_uids, max_patients, error = _caregiver_notes_params(request)
+        if error is not None:
+            return error
+
+        # Autorización de todos los pacientes en una sola consulta
+        patients = authorized_patients(caregiver_uid, patient_uids)
+        if not patients and not FirebaseUser.objects.filter(uid=caregiver_uid, user_type='caregiver').exists():
+            return JsonResponse({'error': 'Cuidador no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+        denial = _caregiver_patients_denial(patient_uids, patients, max_patients)
+        if denial is not None:
+            return denial
 
-            # Obtener notas del paciente desde Firestore
-            notes_ref = db.collection('users').document(patient_uid).collection('notes')
-            notes = []
-            for doc in notes_ref.stream():
-                note_data = doc.to_dict()
-                note_data['note_id'] = doc.id
-                notes.append(note_data)
+        try:
+            page_size = page_size_from(request.GET.get('page_size'))
+            fields = fields_from(request.GET.get('fields'))
+            page = fetch_merged_notes_page(
+                db, [patient.uid for patient in patients], page_size,
+                cursor=request.GET.get('cursor'), fields=fields,
+            )
+        except InvalidPageRequest as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return _caregiver_notes_response(caregiver_uid, patients, page, page_size)
+
+    except Exception as e:
+        logger.error(f"caregiver_notes_sync: Error inesperado. Detalles: {e}", exc_info=True)
+        return JsonResponse({'error': 'Error interno del servidor'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@closes_async_db
+async def caregiver_notes(request):
+    """
+    Obtiene en una sola llamada las notas de varios pacientes de un cuidador, mezcladas
+    de la más reciente a la más antigua. Requiere caregiver_uid; patient_uids es una
+    lista separada por comas o 'all' (por defecto) para todos los vinculados.
+    Admite page_size, cursor y fields como /api/patient-notes/. Vista asíncrona: las
+    páginas de cada paciente se piden a Firestore a la vez. Con WSGI se usa
+    `caregiver_notes_sync` (ver IA_ASYNC_NOTE_VIEWS).
+    """
+    try:
+        caregiver_uid, patient_uids, max_patients, error = _caregiver_notes_params(request)
+        if error is not None:
+            return error
+
+        # Autorización de todos los pacientes en una sola consulta
+        patients = await aauthorized_patients(caregiver_uid, patient_uids)
+        if not patients and not await FirebaseUser.objects.filter(uid=caregiver_uid, user_type='caregiver').aexists():
+            return JsonResponse({'error': 'Cuidador no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+        denial = _caregiver_patients_denial(patient_uids, patients, max_patients)
+        if denial is not None:
+            return denial
 
-            return Response({
-                'patient_uid': patient_uid,
-                'patient_email': patient.email,
-                'caregiver_uid': caregiver_uid,
-                'notes': notes,
-                'total_notes': len(notes)
-            }, status=status.HTTP_200_OK)
+        try:
+            page_size = page_size_from(request.GET.get('page_size'))
+            fields = fields_from(request.GET.get('fields'))
+            page = await afetch_merged_notes_page(
+                get_async_db(), [patient.uid for patient in patients], page_size,
+                cursor=request.GET.get('cursor'), fields=fields,
+            )
+        except InvalidPageRequest as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return _caregiver_notes_response(caregiver_uid, patients, page, page_size)
 
-        except Exception as e:
-            logger.error(f"PatientNotesView: Error inesperado. Detalles: {e}", exc_info=True)
-            return Response({'error': 'Error interno del servidor'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except Exception as e:
+        logger.error(f"caregiver_notes: Error inesperado. Detalles: {e}", exc_info=True)
+        return JsonResponse({'error': 'Error interno del servidor'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @method_decorator(csrf_exempt, name='dispatch')
 class LinkPatientView(APIView):
@@ -189,11 +574,14 @@ class LinkPatientView(APIView):
                     'linked_at': existing_link.linked_at
                 }, status=status.HTTP_409_CONFLICT)
 
-            # Crear el vínculo en Django
-            link = CaregiverPatientLink.objects.create(
-                caregiver=caregiver,
-                patient=patient
-            )
+            # Crear el vínculo en Django (la restricción única cubre dos solicitudes simultáneas)
+            try:
+                link = CaregiverPatientLink.objects.create(
+                    caregiver=caregiver,
+                    patient=patient
+                )
+            except IntegrityError:
+                return Response({'error': 'El paciente ya está vinculado a este cuidador'}, status=status.HTTP_409_CONFLICT)
 
             # Crear el vínculo en Firestore también
             try:
@@ -210,6 +598,8 @@ class LinkPatientView(APIView):
                 link.delete()
                 return Response({'error': 'Error al crear el vínculo en la base de datos'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+            link_cache.invalidate(caregiver_uid)
+
             return Response({
                 'message': 'Paciente vinculado exitosamente',
                 'caregiver_uid': caregiver_uid,
@@ -266,6 +656,8 @@ class UnlinkPatientView(APIView):
                 logger.error(f"Error al eliminar vínculo en Firestore: {firestore_error}")
                 # No fallar si Firestore falla, el vínculo ya se eliminó en Django
 
+            link_cache.invalidate(caregiver_uid)
+
             return Response({
                 'message': 'Paciente desvinculado exitosamente',
                 'caregiver_uid': caregiver_uid,
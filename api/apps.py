@@ -1,10 +1,56 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
 
+# Servidores cuyos procesos atienden solicitudes (nombre del ejecutable o del módulo de `python -m`).
+SERVER_PROGRAMS = ('gunicorn', 'uvicorn', 'daphne', 'hypercorn')
+
+
+def _program_name():
+    if not sys.argv or not sys.argv[0]:
+        return ''
+    program = os.path.basename(sys.argv[0])
+    if program == '__main__.py':
+        # `python -m uvicorn ...`: el nombre útil es el del paquete.
+        return os.path.basename(os.path.dirname(os.path.abspath(sys.argv[0])))
+    return program
+
+
+def is_server_process():
+    """
+    True si este proceso atiende solicitudes: un worker de gunicorn/uvicorn/daphne/hypercorn,
+    el proceso hijo de `manage.py runserver`, o cualquier proceso con IA_SERVER_PROCESS=1
+    (otros servidores, p. ej. mod_wsgi). False para todo lo demás: migrate, shell, test y
+    otros comandos, pytest, scripts que llaman a django.setup() y el proceso padre del
+    auto-reload de runserver, que solo vigila los ficheros.
+    """
+    from django.conf import settings
+
+    if getattr(settings, 'IA_SERVER_PROCESS', False):
+        return True
+    program = _program_name()
+    if program in SERVER_PROGRAMS:
+        return True
+    if program not in ('manage.py', 'django-admin', 'django'):
+        return False
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command != 'runserver':
+        return False
+    return '--noreload' in sys.argv or os.environ.get('RUN_MAIN') == 'true'
+
+
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
-    
+
     def ready(self):
+        from django.conf import settings
         from . import scheduler
-        scheduler.start()
\ No newline at end of file
+        scheduler.start()
+
+        if settings.IA_MODEL_PRELOAD and is_server_process():
+            from .ia_logic import model_lifecycle, uses_inference_server
+            if not uses_inference_server():
+                model_lifecycle.start_background_load()
@@ -0,0 +1,80 @@
+import json
+import os
+import re
+import sys
+
+from django.conf import settings
+
+DEFAULT_DATASET_PATH = os.path.join(settings.BASE_DIR, 'notes_dataset.jsonl')
+
+_NOTE_PATTERN = re.compile(r'^Nota:\s*(.*?)\s*###', re.DOTALL)
+
+
+def extract_note(text):
+    """Devuelve solo la nota de un ejemplo "Nota: ... ### Diagnóstico: ..." del dataset."""
+    match = _NOTE_PATTERN.match(text)
+    return match.group(1) if match else text
+
+
+def generate_synthetic_notes(count, seed=None):
+    """Genera `count` notas simuladas con el mismo generador que notes_dataset.jsonl."""
+    import random
+    from generate_dataset import generate_note_data
+
+    if seed is not None:
+        random.seed(seed)
+    return [extract_note(generate_note_data()['text']) for _ in range(count)]
+
+
+def load_dataset_notes(path=DEFAULT_DATASET_PATH, limit=None):
+    """
+    Lee las notas de `notes_dataset.jsonl` (formato de generate_dataset.py) y devuelve
+    solo el texto de la nota, sin el diagnóstico ni las sugerencias de referencia.
+    """
+    notes = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            notes.append(extract_note(json.loads(line).get('text', '')))
+            if limit is not None and len(notes) >= limit:
+                break
+    return notes
+
+
+def percentile(values, pct):
+    """Percentil con interpolación lineal; `pct` entre 0 y 100."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def current_rss_mb():
+    """RSS actual del proceso en MB (psutil si está instalado; si no, /proc en Linux)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    """RSS máximo alcanzado por el proceso en MB, o None si la plataforma no lo expone."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en bytes en macOS y en KB en Linux.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
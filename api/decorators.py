@@ -1,4 +1,5 @@
 from functools import wraps
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import redirect
 
 def firebase_login_required(view_func):
@@ -8,3 +9,19 @@ def firebase_login_required(view_func):
             return redirect('login')
         return view_func(request, *args, **kwargs)
     return wrapper
+
+def closes_async_db(view_func):
+    """
+    Para vistas async que usan get_async_db(). Bajo WSGI Django ejecuta cada una en un
+    event loop nuevo: al terminar se cierra el AsyncClient de ese loop para no dejar un
+    canal gRPC abierto por solicitud. Bajo ASGI el cliente del worker se reutiliza.
+    """
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view_func(request, *args, **kwargs)
+        finally:
+            if not isinstance(request, ASGIRequest):
+                from firebase_config import aclose_async_db
+                await aclose_async_db()
+    return wrapper
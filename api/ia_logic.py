@@ -1,100 +1,681 @@
-import os
-from transformers import pipeline, AutoTokenizer, AutoModelForCausalLM
-import torch
+import copy
+import threading
+import time
+from django.conf import settings
 
-FINE_TUNED_MODEL_PATH = os.path.abspath(os.path.join(os.getcwd(), 'fine_tuned_distilgpt2_model'))
+from .analysis_cache import AnalysisCache, make_cache_key
+from .inference_backends import BACKEND_TORCH, load_causal_lm, supports_prefix_cache
+from .inference_batcher import MicroBatcher
+from .inference_server import OP_ANALYZE, OP_STATS, OP_STATUS, InferenceClient, InferenceServerError
+from . import model_registry
+from .model_lifecycle import ModelLifecycle, ModelNotReadyError
 
-generator_pipeline = None
-tokenizer = None
-model = None
-device = None
+INFERENCE_BACKEND = getattr(settings, 'IA_INFERENCE_BACKEND', BACKEND_TORCH)
 
-print(f"DEBUG: Intentando cargar el modelo fine-tuneado desde: {FINE_TUNED_MODEL_PATH}")
+WARMUP_NOTE = "El paciente reporta haber sentido palpitaciones en el transporte público."
 
-try:
-    tokenizer = AutoTokenizer.from_pretrained(FINE_TUNED_MODEL_PATH)
-    model = AutoModelForCausalLM.from_pretrained(FINE_TUNED_MODEL_PATH)
+
+# Bloque de instrucciones fijo. Va al principio del prompt para que sus
+# past_key_values se calculen una sola vez al cargar el modelo.
+PROMPT_PREFIX = """
+### Análisis del caso:
+1. **Causa probable:** Describe de forma concreta el evento o situación que desencadenó el problema, evitando el uso de "posiblemente".
+2. **Diagnóstico:** Indica claramente el diagnóstico principal.
+3. **Sugerencias de Prevención/Manejo:** Ofrece pasos de acción específicos y concretos para evitar que la situación se repita o para manejarla.
+"""
+
+# Cambia cuando cambia la forma del prompt, para no reutilizar análisis cacheados con el prompt anterior.
+PROMPT_VERSION = 2
+
+
+class LoadedModel:
+    """Tokenizador, modelo y dispositivo listos para generar, con la KV-cache del prefijo del prompt."""
+
+    def __init__(self, tokenizer, model, device, prefix_ids=None, prefix_cache=None, backend=BACKEND_TORCH, version=None):
+        self.version = version
+        self.tokenizer = tokenizer
+        self.model = model
+        self.device = device
+        self.backend = backend
+        self.prefix_ids = prefix_ids
+        self.prefix_cache = prefix_cache
+
+
+def _compute_prefix_cache(tokenizer, model, device):
+    """Codifica PROMPT_PREFIX una vez y devuelve sus ids y su DynamicCache (batch de 1)."""
+    import torch
+    from transformers import DynamicCache
+
+    prefix_ids = tokenizer(PROMPT_PREFIX, return_tensors='pt').input_ids.to(device)
+    with torch.no_grad():
+        outputs = model(prefix_ids, past_key_values=DynamicCache(), use_cache=True)
+    return prefix_ids, outputs.past_key_values
+
+
+def _load_model(model_path=None, backend=None, prefix_kv_cache=None, version=None) -> LoadedModel:
+    # torch y transformers se importan aquí para que los comandos de manage.py no paguen su coste.
+    import torch
+    from transformers import AutoTokenizer
+
+    if model_path is None:
+        version, model_path = model_registry.resolve_active()
+    backend = backend or INFERENCE_BACKEND
+    if prefix_kv_cache is None:
+        prefix_kv_cache = getattr(settings, 'IA_PREFIX_KV_CACHE', True)
+
+    print(f"DEBUG: Intentando cargar el modelo fine-tuneado {version} desde: {model_path} (backend: {backend})")
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = load_causal_lm(model_path, backend)
 
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
+    # Relleno a la izquierda: en modelos causales la generación continúa desde el último token.
+    tokenizer.padding_side = 'left'
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model.to(device)
-    model.eval()
+    if backend == BACKEND_TORCH:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model.to(device)
+        model.eval()
+    else:
+        # int8 dinámico y ONNX Runtime se ejecutan en CPU.
+        device = torch.device("cpu")
+
+    prefix_ids, prefix_cache = None, None
+    if prefix_kv_cache and supports_prefix_cache(backend):
+        prefix_ids, prefix_cache = _compute_prefix_cache(tokenizer, model, device)
+        print(f"DEBUG: KV-cache del prefijo del prompt precalculada ({prefix_ids.shape[1]} tokens).")
 
-    generator_pipeline = pipeline(
-        "text-generation",
-        model=model,
-        tokenizer=tokenizer,
-        device=0 if torch.cuda.is_available() else -1,
-    )
     print("DEBUG: Modelo fine-tuneado para generación de texto cargado correctamente en Django.")
+    return LoadedModel(tokenizer, model, device, prefix_ids, prefix_cache, backend, version)
+
 
-except Exception as e:
-    print(f"ERROR: No se pudo cargar el modelo fine-tuneado en ia_logic.py. Detalles: {e}")
-    print(f"Asegúrate de que la ruta '{FINE_TUNED_MODEL_PATH}' es correcta y el modelo existe.")
-    generator_pipeline = None
+def _warmup(loaded: LoadedModel):
+    """Generación corta para inicializar los kernels antes de la primera solicitud real."""
+    _run_generate(loaded, [WARMUP_NOTE], max_new_tokens=8)
 
 
-def generate_diagnosis_and_suggestions(note: str) -> str:
+model_lifecycle = ModelLifecycle(
+    _load_model,
+    warmup=_warmup,
+    name='fine_tuned_distilgpt2_model',
+    retry_seconds=getattr(settings, 'IA_MODEL_RETRY_SECONDS', 60),
+)
+
+_registry_checked_at = 0.0
+_registry_marker_mtime = None
+
+
+def _check_active_version():
     """
-    Genera un texto de diagnóstico y sugerencias para un paciente
-    basado en una nota clínica, utilizando el modelo de generación de texto fine-tuneado.
+    Comprueba (como mucho cada IA_MODEL_REGISTRY_POLL_SECONDS) si cambió la versión activa
+    del registro y, si es así, carga la nueva en segundo plano y la intercambia de forma
+    atómica. Las solicitudes en curso terminan con la versión que ya tenían.
     """
-    if generator_pipeline is None:
-        return "Error: El modelo de IA no se pudo cargar en la aplicación Django. Por favor, revisa la configuración y los logs."
+    global _registry_checked_at, _registry_marker_mtime
+    now = time.monotonic()
+    if now - _registry_checked_at < getattr(settings, 'IA_MODEL_REGISTRY_POLL_SECONDS', 10):
+        return
+    _registry_checked_at = now
 
-    prompt = f"""
-Nota: {note}
-### Análisis del caso:
-1. **Causa probable:** Describe de forma concreta el evento o situación que desencadenó el problema, evitando el uso de "posiblemente".
-2. **Diagnóstico:** Indica claramente el diagnóstico principal.
-3. **Sugerencias de Prevención/Manejo:** Ofrece pasos de acción específicos y concretos para evitar que la situación se repita o para manejarla.
-"""
-    try:
-        generated_results = generator_pipeline(
-            prompt,
-            max_new_tokens=500,       
-            num_return_sequences=1,
-            temperature=0.7,            
-            top_p=0.9,                  
-            do_sample=True,            
-            num_beams=1,                
-            no_repeat_ngram_size=3,    
-            early_stopping=False,       
+    mtime = model_registry.active_marker_mtime()
+    if mtime == _registry_marker_mtime:
+        return
+    _registry_marker_mtime = mtime
+    swap_to_active_version()
+
+
+def swap_to_active_version():
+    """Inicia el intercambio a la versión activa del registro si difiere de la cargada."""
+    loaded = model_lifecycle.loaded
+    if loaded is None:
+        return False
+    version, path = model_registry.resolve_active()
+    if version == loaded.version:
+        return False
+    print(f"DEBUG: Cambio de versión del modelo detectado: {loaded.version} -> {version}")
+    return model_lifecycle.swap(lambda: _load_model(model_path=path, version=version), label=version)
+
+
+def current_model_version():
+    """Versión que atenderá la próxima solicitud: la cargada o, si aún no hay, la activa."""
+    loaded = model_lifecycle.loaded
+    return loaded.version if loaded is not None else model_registry.resolve_active()[0]
+
+
+GENERATION_KWARGS = {
+    'max_new_tokens': 500,
+    'temperature': 0.7,
+    'top_p': 0.9,
+    'do_sample': True,
+    'num_beams': 1,
+    'no_repeat_ngram_size': 3,
+}
+
+# Modo determinista: decodificación greedy para que los análisis cacheados sean reproducibles.
+DETERMINISTIC_GENERATION_KWARGS = {
+    'max_new_tokens': 500,
+    'do_sample': False,
+    'num_beams': 1,
+    'no_repeat_ngram_size': 3,
+}
+
+# La generación se detiene cuando el modelo empieza una nueva nota.
+STOP_SEQUENCE = "Nota:"
+
+
+class GenerationStats:
+    """Tokens generados por solicitud y tokens ahorrados frente a agotar `max_new_tokens`."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.generated_tokens = 0
+        self.saved_tokens = 0
+        self.stopped_early = 0
+        self.assisted_requests = 0
+
+    def record(self, generated_tokens, max_new_tokens, assisted=False):
+        with self._lock:
+            self.requests += 1
+            if assisted:
+                self.assisted_requests += 1
+            self.generated_tokens += generated_tokens
+            self.saved_tokens += max(max_new_tokens - generated_tokens, 0)
+            if generated_tokens < max_new_tokens:
+                self.stopped_early += 1
+
+    def stats(self):
+        with self._lock:
+            requests = self.requests
+            return {
+                'requests': requests,
+                'generated_tokens': self.generated_tokens,
+                'saved_tokens': self.saved_tokens,
+                'stopped_early': self.stopped_early,
+                'assisted_requests': self.assisted_requests,
+                'avg_generated_tokens': round(self.generated_tokens / requests, 2) if requests else 0.0,
+                'avg_saved_tokens': round(self.saved_tokens / requests, 2) if requests else 0.0,
+            }
+
+
+_generation_stats = GenerationStats()
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+_analysis_cache = None
+_analysis_cache_lock = threading.Lock()
+
+_inference_client = None
+_local_inference_only = False
+
+
+def _generation_kwargs() -> dict:
+    if getattr(settings, 'IA_DETERMINISTIC_GENERATION', False):
+        return DETERMINISTIC_GENERATION_KWARGS
+    return GENERATION_KWARGS
+
+
+def _build_prompt_suffix(note: str) -> str:
+    return f"Nota: {note}\n### Diagnóstico:"
+
+
+def _build_prompt(note: str) -> str:
+    return PROMPT_PREFIX + _build_prompt_suffix(note)
+
+
+def _extract_response(generated_text: str) -> str:
+    """
+    Limpia el texto de los tokens nuevos (ya sin prompt, extraídos por offset de tokens)
+    y corta en la secuencia de parada si la generación se detuvo en ella.
+    """
+    final_response = generated_text.split(STOP_SEQUENCE, 1)[0].strip()
+    if not final_response:
+        print("DEBUG: La respuesta final después del post-procesamiento está vacía. Devolviendo texto generado crudo para depuración.")
+        return generated_text
+    return final_response
+
+
+def _count_generated_tokens(new_token_ids, pad_token_id) -> int:
+    """Tokens realmente generados por fila: las filas que terminan antes se rellenan con pad."""
+    padding = (new_token_ids == pad_token_id).nonzero()
+    return int(padding[0].item()) if len(padding) else int(new_token_ids.shape[0])
+
+
+def _encode_notes(loaded: LoadedModel, notes, use_prefix_cache=True):
+    """
+    Tokeniza las notas del lote y devuelve los argumentos de entrada para `generate`.
+
+    Con la KV-cache del prefijo, solo se tokenizan los sufijos (la nota), rellenados a la
+    izquierda, y se concatenan tras los ids del prefijo. La máscara de atención marca el
+    relleno intermedio y `generate` solo procesa los tokens que no están en la caché.
+    """
+    import torch
+
+    tokenizer = loaded.tokenizer
+    if not use_prefix_cache or loaded.prefix_cache is None:
+        prompts = [_build_prompt(note) for note in notes]
+        return dict(tokenizer(prompts, return_tensors='pt', padding=True).to(loaded.device))
+
+    batch_size = len(notes)
+    suffixes = tokenizer([_build_prompt_suffix(note) for note in notes], return_tensors='pt', padding=True).to(loaded.device)
+    prefix_ids = loaded.prefix_ids.expand(batch_size, -1)
+    past_key_values = copy.deepcopy(loaded.prefix_cache)
+    if batch_size > 1:
+        past_key_values.batch_repeat_interleave(batch_size)
+    return {
+        'input_ids': torch.cat([prefix_ids, suffixes['input_ids']], dim=1),
+        'attention_mask': torch.cat([torch.ones_like(prefix_ids), suffixes['attention_mask']], dim=1),
+        'past_key_values': past_key_values,
+    }
+
+
+def _run_generate(loaded: LoadedModel, notes, use_prefix_cache=True, generation_kwargs=None, **overrides):
+    """
+    Ejecuta `generate` y devuelve `(output_ids, input_length)`. Los tokens nuevos de cada
+    fila son `output_ids[i, input_length:]`. La generación se detiene en cuanto el modelo
+    empieza un nuevo bloque "Nota:" o emite EOS.
+    """
+    import torch
+
+    tokenizer = loaded.tokenizer
+    inputs = _encode_notes(loaded, notes, use_prefix_cache)
+    with torch.no_grad():
+        output_ids = loaded.model.generate(
+            **inputs,
+            **{
+                'stop_strings': [STOP_SEQUENCE],
+                'tokenizer': tokenizer,
+                **(generation_kwargs or _generation_kwargs()),
+                **overrides,
+            },
             pad_token_id=tokenizer.pad_token_id,
         )
-        generated_text = generated_results[0]['generated_text']
+    return output_ids, inputs['input_ids'].shape[1]
 
-        print("\n--- TEXTO GENERADO CRUDO (ANTES DEL POST-PROCESAMIENTO) ---")
+
+def _generate_batch(notes):
+    """
+    Ejecuta una única llamada a `generate` con todas las notas del lote, rellenadas a la izquierda.
+    Devuelve `(texto, versión_del_modelo, tokens_generados)` por nota.
+    """
+    loaded = model_lifecycle.ensure_loaded()
+    output_ids, input_length = _run_generate(loaded, notes)
+    new_token_ids = output_ids[:, input_length:]
+    generated_texts = loaded.tokenizer.batch_decode(new_token_ids, skip_special_tokens=True)
+
+    max_new_tokens = _generation_kwargs()['max_new_tokens']
+    token_counts = [_count_generated_tokens(row, loaded.tokenizer.pad_token_id) for row in new_token_ids]
+    for generated_tokens in token_counts:
+        _generation_stats.record(generated_tokens, max_new_tokens)
+
+    print(f"\n--- LOTE DE {len(notes)} TEXTOS GENERADOS CRUDOS (ANTES DEL POST-PROCESAMIENTO) ---")
+    for generated_text in generated_texts:
         print(generated_text)
-        print("----------------------------------------------------------\n")
-
-        final_response = generated_text
-        clean_prompt = ' '.join(prompt.split()).strip()
-        start_index = generated_text.find(prompt) 
-        if start_index == -1:
-            start_index = generated_text.find(clean_prompt)
-        
-        if start_index != -1:
-            if generated_text[start_index : start_index + len(prompt)] == prompt:
-                final_response = generated_text[start_index + len(prompt):].strip()
-            elif generated_text[start_index : start_index + len(clean_prompt)] == clean_prompt:
-                final_response = generated_text[start_index + len(clean_prompt):].strip()
-            else:
-                final_response = generated_text[start_index:].strip()
-        else:
-            final_response = generated_text.strip()
-        
-        if "Nota:" in final_response:
-            final_response = final_response.split("Nota:", 1)[0].strip()
-        
-        if not final_response:
-            print("DEBUG: La respuesta final después del post-procesamiento está vacía. Devolviendo texto generado crudo para depuración.")
-            return generated_text 
+        print("----------------------------------------------------------")
 
-        return final_response
+    return [
+        (_extract_response(text), loaded.version, generated_tokens)
+        for text, generated_tokens in zip(generated_texts, token_counts)
+    ]
+
+
+def _generate_assisted(note: str):
+    """
+    Decodificación asistida por búsqueda en el prompt (prompt lookup): los tokens borrador
+    se proponen copiando n-gramas de la propia nota y se verifican en una sola pasada del
+    modelo. Solo admite lotes de 1, por lo que no pasa por el micro-batching.
+    """
+    loaded = model_lifecycle.ensure_loaded()
+    output_ids, input_length = _run_generate(
+        loaded,
+        [note],
+        prompt_lookup_num_tokens=getattr(settings, 'IA_PROMPT_LOOKUP_NUM_TOKENS', 10),
+        max_matching_ngram_size=getattr(settings, 'IA_PROMPT_LOOKUP_MAX_NGRAM', 3),
+    )
+    new_token_ids = output_ids[0, input_length:]
+    generated_tokens = _count_generated_tokens(new_token_ids, loaded.tokenizer.pad_token_id)
+    _generation_stats.record(generated_tokens, _generation_kwargs()['max_new_tokens'], assisted=True)
+    text = _extract_response(loaded.tokenizer.decode(new_token_ids, skip_special_tokens=True))
+    return text, loaded.version, generated_tokens
+
+
+def _get_batcher() -> MicroBatcher:
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher(
+                    _generate_batch,
+                    max_batch_size=getattr(settings, 'IA_BATCH_MAX_SIZE', 8),
+                    max_wait_ms=getattr(settings, 'IA_BATCH_MAX_WAIT_MS', 10),
+                    name='ia-batcher',
+                )
+    return _batcher
+
+
+def force_local_inference():
+    """Lo llama el propio servidor de inferencia para no reenviarse solicitudes a sí mismo."""
+    global _local_inference_only
+    _local_inference_only = True
+
+
+def _get_inference_client():
+    """
+    Con IA_INFERENCE_SERVER_ADDRESS configurado, este proceso es un cliente ligero del
+    servidor de inferencia (manage.py run_inference_server) y no carga el modelo.
+    """
+    global _inference_client
+    address = getattr(settings, 'IA_INFERENCE_SERVER_ADDRESS', None)
+    if not address or _local_inference_only:
+        return None
+    if _inference_client is None:
+        _inference_client = InferenceClient(address, timeout=getattr(settings, 'IA_INFERENCE_SERVER_TIMEOUT', 300))
+    return _inference_client
+
+
+def uses_inference_server() -> bool:
+    return _get_inference_client() is not None
+
+
+def get_model_status(start_loading=False) -> dict:
+    """Estado del modelo local o, en modo cliente, el que informa el servidor de inferencia."""
+    client = _get_inference_client()
+    if client is not None:
+        try:
+            return client.call(OP_STATUS)
+        except InferenceServerError as e:
+            return {'model': 'inference_server', 'state': 'unreachable', 'ready': False, 'error': str(e)}
+    if start_loading:
+        # Tras un fallo, la sonda de readiness también reintenta la carga cuando toca.
+        model_lifecycle.reload()
+        model_lifecycle.start_background_load()
+    return model_lifecycle.status()
+
+
+def _get_analysis_cache():
+    global _analysis_cache
+    if not getattr(settings, 'IA_CACHE_ENABLED', True):
+        return None
+    if _analysis_cache is None:
+        with _analysis_cache_lock:
+            if _analysis_cache is None:
+                _analysis_cache = AnalysisCache(
+                    memory_max_entries=getattr(settings, 'IA_CACHE_MEMORY_MAX_ENTRIES', 1024),
+                    ttl_seconds=getattr(settings, 'IA_CACHE_TTL_SECONDS', 7 * 24 * 3600),
+                    db_max_entries=getattr(settings, 'IA_CACHE_DB_MAX_ENTRIES', 50000),
+                )
+    return _analysis_cache
+
+
+def _cache_key(note: str, model_version: str) -> str:
+    return make_cache_key(
+        note,
+        model_version,
+        {**_generation_kwargs(), 'prompt_version': PROMPT_VERSION, 'backend': INFERENCE_BACKEND},
+    )
+
+
+def get_inference_stats() -> dict:
+    """Estado del modelo, micro-batching, tokens generados/ahorrados y aciertos/fallos de la caché."""
+    client = _get_inference_client()
+    if client is not None:
+        return client.call(OP_STATS)
+
+    cache = _get_analysis_cache()
+    return {
+        'model': model_lifecycle.status(),
+        'batching': _get_batcher().stats(),
+        'generation': _generation_stats.stats(),
+        'cache': cache.stats() if cache is not None else None,
+    }
+
+
+def analyze_note(note: str, assisted=None, use_cache=True):
+    """
+    Genera un texto de diagnóstico y sugerencias para un paciente
+    basado en una nota clínica, utilizando el modelo de generación de texto fine-tuneado.
+    Devuelve `(texto, versión_del_modelo)`; en caso de error, el texto empieza por "Error".
+
+    Las solicitudes concurrentes se agrupan en lotes para una sola llamada a `generate`
+    y los resultados se cachean por nota normalizada, versión del modelo y parámetros.
+    Si hay un servidor de inferencia configurado, la llamada se delega en él.
+
+    `assisted` activa la decodificación asistida por n-gramas del prompt para esta
+    solicitud; si es None se usa IA_ASSISTED_DECODING. Con `use_cache=False` la solicitud
+    ni consulta ni guarda la caché de análisis (p. ej. en benchmarks); si no, manda
+    IA_CACHE_ENABLED.
+    """
+    return analyze_note_with_usage(note, assisted=assisted, use_cache=use_cache)[:2]
+
+
+def analyze_note_with_usage(note: str, assisted=None, use_cache=True):
+    """
+    Como `analyze_note`, pero devuelve `(texto, versión_del_modelo, tokens_generados)`.
+    Los tokens se cuentan sobre los ids que produjo `generate` (antes del post-procesamiento);
+    son 0 si el análisis salió de la caché o hubo un error.
+    """
+    if assisted is None:
+        assisted = getattr(settings, 'IA_ASSISTED_DECODING', False)
+
+    client = _get_inference_client()
+    if client is not None:
+        try:
+            return tuple(client.call(OP_ANALYZE, note=note, assisted=assisted, use_cache=use_cache, usage=True))
+        except InferenceServerError as e:
+            print(f"ERROR: {e}")
+            return f"Error: El servidor de inferencia no está disponible. Detalles: {e}", None, 0
+
+    _check_active_version()
+    model_version = current_model_version()
+    cache = _get_analysis_cache() if use_cache else None
+    cache_key = None
+    if cache is not None:
+        cache_key = _cache_key(note, model_version)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached, model_version, 0
+
+    try:
+        model_lifecycle.ensure_loaded(timeout=getattr(settings, 'IA_MODEL_LOAD_TIMEOUT', 300))
+    except ModelNotReadyError as e:
+        print(f"ERROR: {e}")
+        return f"Error: El modelo de IA no está disponible ({e.state}). Por favor, revisa la configuración y los logs.", None, 0
+
+    try:
+        if assisted:
+            result, used_version, generated_tokens = _generate_assisted(note)
+        else:
+            result, used_version, generated_tokens = _get_batcher().submit(note)
+        if cache is not None and not result.startswith("Error"):
+            # Si hubo un intercambio entre la consulta y la generación, la clave cambia con la versión.
+            if used_version != model_version:
+                cache_key = _cache_key(note, used_version)
+            cache.set(cache_key, result, used_version)
+        return result, used_version, generated_tokens
 
     except Exception as e:
         print(f"ERROR: Excepción en generate_diagnosis_and_suggestions: {e}")
-        return f"Error al generar diagnóstico/sugerencias con el modelo fine-tuneado: {e}"
\ No newline at end of file
+        return f"Error al generar diagnóstico/sugerencias con el modelo fine-tuneado: {e}", None, 0
+
+
+def generate_diagnosis_and_suggestions(note: str, assisted=None, use_cache=True) -> str:
+    """Igual que `analyze_note`, pero devuelve solo el texto del análisis."""
+    return analyze_note(note, assisted=assisted, use_cache=use_cache)[0]
+
+
+class _StopSequenceFilter:
+    """
+    Aplica de forma incremental el mismo post-procesamiento que `_extract_response`:
+    elimina los espacios iniciales y corta en la primera "Nota:". Retiene el final
+    del texto recibido mientras pueda ser el comienzo de la secuencia de parada.
+    """
+
+    def __init__(self, stop_sequence=STOP_SEQUENCE):
+        self.stop_sequence = stop_sequence
+        self.stopped = False
+        self._pending = ''
+        self._started = False
+
+    def feed(self, text: str) -> str:
+        if self.stopped:
+            return ''
+        self._pending += text
+        if not self._started:
+            self._pending = self._pending.lstrip()
+            if not self._pending:
+                return ''
+            self._started = True
+
+        stop_index = self._pending.find(self.stop_sequence)
+        if stop_index != -1:
+            chunk = self._pending[:stop_index].rstrip()
+            self._pending = ''
+            self.stopped = True
+            return chunk
+
+        keep = 0
+        for size in range(min(len(self.stop_sequence) - 1, len(self._pending)), 0, -1):
+            if self.stop_sequence.startswith(self._pending[-size:]):
+                keep = size
+                break
+        # Los espacios finales también se retienen: si después llega la parada, sobran.
+        chunk = self._pending[:len(self._pending) - keep].rstrip()
+        self._pending = self._pending[len(chunk):]
+        return chunk
+
+    def flush(self) -> str:
+        chunk = '' if self.stopped else self._pending.rstrip()
+        self._pending = ''
+        return chunk
+
+
+def _start_streaming_generation(loaded: LoadedModel, note: str, streamer, cancel_event: threading.Event, usage=None):
+    """
+    Lanza `generate` en un hilo propio; los tokens llegan a `streamer` según se producen.
+    Si se pasa el dict `usage`, al terminar se guarda en él `generated_tokens`.
+    """
+    from transformers import StoppingCriteria, StoppingCriteriaList
+
+    class _CancelCriteria(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return cancel_event.is_set()
+
+    def _target():
+        try:
+            output_ids, input_length = _run_generate(
+                loaded,
+                [note],
+                streamer=streamer,
+                stopping_criteria=StoppingCriteriaList([_CancelCriteria()]),
+            )
+            if usage is not None:
+                usage['generated_tokens'] = _count_generated_tokens(
+                    output_ids[0, input_length:], loaded.tokenizer.pad_token_id
+                )
+        except Exception as e:
+            print(f"ERROR: Excepción en la generación en streaming: {e}")
+            streamer.on_finalized_text('', stream_end=True)
+
+    thread = threading.Thread(target=_target, name='ia-stream', daemon=True)
+    thread.start()
+    return thread
+
+
+def stream_diagnosis_and_suggestions(note: str, usage=None):
+    """
+    Variante síncrona en streaming de `generate_diagnosis_and_suggestions`:
+    produce fragmentos de texto a medida que el modelo los genera. Si se pasa el dict
+    `usage`, al cerrar el generador contiene `generated_tokens` (p. ej. para benchmarks).
+    """
+    from transformers import TextIteratorStreamer
+
+    client = _get_inference_client()
+    if client is not None:
+        yield from client.stream(note, usage=usage)
+        return
+
+    _check_active_version()
+    loaded = model_lifecycle.ensure_loaded(timeout=getattr(settings, 'IA_MODEL_LOAD_TIMEOUT', 300))
+    streamer = TextIteratorStreamer(loaded.tokenizer, skip_prompt=True, skip_special_tokens=True)
+    cancel_event = threading.Event()
+    stop_filter = _StopSequenceFilter()
+    thread = _start_streaming_generation(loaded, note, streamer, cancel_event, usage)
+    try:
+        for text in streamer:
+            chunk = stop_filter.feed(text)
+            if chunk:
+                yield chunk
+            if stop_filter.stopped:
+                break
+        chunk = stop_filter.flush()
+        if chunk:
+            yield chunk
+    finally:
+        cancel_event.set()
+        if usage is not None:
+            # La generación se detiene en el siguiente paso; hace falta su recuento final.
+            thread.join()
+
+
+async def astream_diagnosis_and_suggestions(note: str):
+    """
+    Variante asíncrona en streaming para vistas ASGI. La generación corre en un hilo
+    aparte y los fragmentos llegan al event loop sin bloquear ningún worker síncrono.
+    Al terminar, el análisis completo se guarda en la caché de análisis.
+    """
+    import asyncio
+    from asgiref.sync import sync_to_async
+    from transformers import AsyncTextIteratorStreamer
+
+    client = _get_inference_client()
+    if client is not None:
+        remote_stream = client.stream(note)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, remote_stream, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            await asyncio.to_thread(remote_stream.close)
+
+    _check_active_version()
+    model_version = current_model_version()
+    cache = _get_analysis_cache()
+    cache_key = _cache_key(note, model_version) if cache is not None else None
+    if cache is not None:
+        cached = await sync_to_async(cache.get, thread_sensitive=False)(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    loaded = await asyncio.to_thread(
+        model_lifecycle.ensure_loaded, getattr(settings, 'IA_MODEL_LOAD_TIMEOUT', 300)
+    )
+    streamer = AsyncTextIteratorStreamer(loaded.tokenizer, skip_prompt=True, skip_special_tokens=True)
+    cancel_event = threading.Event()
+    stop_filter = _StopSequenceFilter()
+    chunks = []
+    _start_streaming_generation(loaded, note, streamer, cancel_event)
+    try:
+        async for text in streamer:
+            chunk = stop_filter.feed(text)
+            if chunk:
+                chunks.append(chunk)
+                yield chunk
+            if stop_filter.stopped:
+                break
+        chunk = stop_filter.flush()
+        if chunk:
+            chunks.append(chunk)
+            yield chunk
+    finally:
+        # Si el cliente se desconecta o se alcanzó "Nota:", se detiene la generación.
+        cancel_event.set()
+
+    full_text = ''.join(chunks)
+    if cache is not None and full_text:
+        if loaded.version != model_version:
+            cache_key = _cache_key(note, loaded.version)
+        await sync_to_async(cache.set, thread_sensitive=False)(cache_key, full_text, loaded.version)
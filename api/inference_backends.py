@@ -0,0 +1,86 @@
+import os
+
+BACKEND_TORCH = 'torch'
+BACKEND_INT8 = 'int8'
+BACKEND_ONNX = 'onnx'
+
+BACKENDS = (BACKEND_TORCH, BACKEND_INT8, BACKEND_ONNX)
+
+# Subdirectorio del modelo donde se guarda el grafo ONNX exportado.
+ONNX_SUBDIR = 'onnx'
+
+
+def supports_prefix_cache(backend: str) -> bool:
+    """Los backends de PyTorch aceptan una DynamicCache precalculada; ONNX Runtime no."""
+    return backend in (BACKEND_TORCH, BACKEND_INT8)
+
+
+def _conv1d_to_linear(model):
+    """
+    GPT-2 usa `Conv1D` (pesos transpuestos) en lugar de `nn.Linear`, y la cuantización
+    dinámica de PyTorch solo reconoce `nn.Linear`. Se reemplazan in situ por capas equivalentes.
+    """
+    from torch import nn
+    from transformers.pytorch_utils import Conv1D
+
+    for module in list(model.modules()):
+        for child_name, child in list(module.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = nn.Linear(in_features, out_features)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data.clone()
+                setattr(module, child_name, linear)
+    return model
+
+
+def _load_torch(model_path):
+    from transformers import AutoModelForCausalLM
+
+    return AutoModelForCausalLM.from_pretrained(model_path)
+
+
+def _load_int8(model_path):
+    import torch
+    from torch import nn
+
+    model = _conv1d_to_linear(_load_torch(model_path))
+    model.eval()
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def _load_onnx(model_path):
+    try:
+        from optimum.onnxruntime import ORTModelForCausalLM
+    except ImportError as e:
+        raise RuntimeError(
+            "El backend 'onnx' requiere optimum y onnxruntime (pip install optimum[onnxruntime])."
+        ) from e
+
+    onnx_path = os.path.join(model_path, ONNX_SUBDIR)
+    if os.path.isdir(onnx_path):
+        return ORTModelForCausalLM.from_pretrained(onnx_path, use_cache=True)
+
+    print(f"DEBUG: Exportando el modelo a ONNX con KV-cache en: {onnx_path}")
+    model = ORTModelForCausalLM.from_pretrained(model_path, export=True, use_cache=True)
+    model.save_pretrained(onnx_path)
+    return model
+
+
+_LOADERS = {
+    BACKEND_TORCH: _load_torch,
+    BACKEND_INT8: _load_int8,
+    BACKEND_ONNX: _load_onnx,
+}
+
+
+def load_causal_lm(model_path: str, backend: str = BACKEND_TORCH):
+    """
+    Carga el modelo causal con el backend indicado:
+    - 'torch': PyTorch float32 (comportamiento original).
+    - 'int8': PyTorch con cuantización dinámica int8 de las capas lineales (solo CPU).
+    - 'onnx': grafo ONNX Runtime con KV-cache, exportado la primera vez junto al modelo.
+    """
+    if backend not in _LOADERS:
+        raise ValueError(f"Backend de inferencia desconocido: '{backend}'. Opciones: {', '.join(BACKENDS)}")
+    return _LOADERS[backend](model_path)
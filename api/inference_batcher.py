@@ -0,0 +1,132 @@
+import queue
+import threading
+import time
+
+
+class _PendingRequest:
+    """Una solicitud individual esperando a ser procesada dentro de un lote."""
+
+    __slots__ = ('item', 'enqueued_at', 'event', 'result', 'error')
+
+    def __init__(self, item):
+        self.item = item
+        self.enqueued_at = time.monotonic()
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Agrupa solicitudes concurrentes en lotes pequeños.
+
+    Cada llamada a `submit` se encola y bloquea al llamante. Un hilo de fondo
+    toma la primera solicitud pendiente, espera como máximo `max_wait_ms`
+    milisegundos a que lleguen más (hasta `max_batch_size`) y ejecuta
+    `process_batch` una sola vez con todos los elementos. `process_batch`
+    debe devolver una lista de resultados en el mismo orden que recibió.
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait_ms=10, name='micro-batcher'):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size debe ser al menos 1")
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(max_wait_ms, 0) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._errors = 0
+        self._total_wait = 0.0
+        self._batch_size_histogram = {}
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item, timeout=None):
+        """Encola `item` y bloquea hasta obtener su resultado individual."""
+        self._ensure_started()
+        pending = _PendingRequest(item)
+        self._queue.put(pending)
+        if not pending.event.wait(timeout):
+            raise TimeoutError(f"{self.name}: la solicitud no se procesó en {timeout} segundos")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect_batch(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started_at = time.monotonic()
+            try:
+                results = self.process_batch([pending.item for pending in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(
+                        f"{self.name}: process_batch devolvió {len(results)} resultados para {len(batch)} solicitudes"
+                    )
+                for pending, result in zip(batch, results):
+                    pending.result = result
+                failed = False
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+                failed = True
+
+            self._record_batch(batch, started_at, failed)
+            for pending in batch:
+                pending.event.set()
+
+    def _record_batch(self, batch, started_at, failed):
+        size = len(batch)
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += size
+            if failed:
+                self._errors += 1
+            self._total_wait += sum(started_at - pending.enqueued_at for pending in batch)
+            self._batch_size_histogram[size] = self._batch_size_histogram.get(size, 0) + 1
+
+    def stats(self):
+        """Devuelve estadísticas acumuladas sobre el llenado de los lotes."""
+        with self._stats_lock:
+            batches = self._batches
+            requests = self._requests
+            avg_batch_size = requests / batches if batches else 0.0
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'batches': batches,
+                'requests': requests,
+                'failed_batches': self._errors,
+                'avg_batch_size': round(avg_batch_size, 3),
+                'avg_fill_ratio': round(avg_batch_size / self.max_batch_size, 3) if batches else 0.0,
+                'avg_queue_wait_ms': round(self._total_wait / requests * 1000.0, 3) if requests else 0.0,
+                'batch_size_histogram': dict(sorted(self._batch_size_histogram.items())),
+                'queued': self._queue.qsize(),
+            }
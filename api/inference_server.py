@@ -0,0 +1,209 @@
+import hashlib
+import ipaddress
+import os
+import signal
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
+
+# Protocolo: el cliente envía un dict {'op': ..., ...} y el servidor responde con
+# {'ok': True, 'result': ...} o {'ok': False, 'error': ...}. En 'stream' el servidor
+# envía varios {'ok': True, 'chunk': ...} y termina con {'ok': True, 'done': True}.
+# 'analyze' devuelve la tupla (texto, versión del modelo). Con 'usage': True, 'analyze'
+# añade a la tupla los tokens generados y 'stream' los envía en el mensaje final
+# ('generated_tokens').
+OP_ANALYZE = 'analyze'
+OP_STREAM = 'stream'
+OP_STATUS = 'status'
+OP_STATS = 'stats'
+
+
+class InferenceServerError(Exception):
+    """No se pudo completar una llamada al servidor de inferencia."""
+
+
+def _is_loopback(host: str) -> bool:
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def parse_address(address: str):
+    """
+    Convierte la dirección configurada en una dirección de multiprocessing.connection:
+    'unix:/ruta/al/socket' para un socket Unix o 'host:puerto' para TCP local.
+
+    Los mensajes del protocolo son objetos pickle, así que solo se acepta TCP en la
+    interfaz de loopback; para otros hosts no hay forma segura de exponerlo.
+    """
+    if address.startswith('unix:'):
+        return address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    host = host or '127.0.0.1'
+    if not _is_loopback(host):
+        raise ImproperlyConfigured(
+            f"IA_INFERENCE_SERVER_ADDRESS solo admite 'unix:/ruta' o TCP en loopback "
+            f"(127.0.0.1 / localhost), no '{host}'."
+        )
+    try:
+        return (host, int(port))
+    except ValueError:
+        raise ImproperlyConfigured(f"Puerto no válido en IA_INFERENCE_SERVER_ADDRESS: '{address}'")
+
+
+def _authkey(address) -> bytes:
+    """
+    Clave de autenticación del protocolo. Con TCP cualquier proceso local puede conectar,
+    así que IA_INFERENCE_SERVER_AUTHKEY es obligatoria; con un socket Unix (accesible
+    solo para su usuario) se deriva de SECRET_KEY si no se configura.
+    """
+    configured = getattr(settings, 'IA_INFERENCE_SERVER_AUTHKEY', None)
+    if configured:
+        return configured.encode('utf-8')
+    if not isinstance(address, str):
+        raise ImproperlyConfigured(
+            "El servidor de inferencia por TCP requiere IA_INFERENCE_SERVER_AUTHKEY; "
+            "usa una dirección 'unix:/ruta' o configura la clave."
+        )
+    return hashlib.sha256(f"pulsoft-inference:{settings.SECRET_KEY}".encode('utf-8')).digest()
+
+
+def validate_address(address):
+    """Comprueba la dirección y la clave antes de arrancar; lanza ImproperlyConfigured."""
+    _authkey(parse_address(address))
+
+
+class InferenceClient:
+    """Cliente ligero: una conexión por llamada al servidor de inferencia local."""
+
+    def __init__(self, address, timeout=None):
+        self.address = parse_address(address)
+        self.authkey = _authkey(self.address)
+        self.timeout = timeout
+
+    def _connect(self):
+        try:
+            return Client(self.address, authkey=self.authkey)
+        except AuthenticationError as e:
+            raise InferenceServerError(f"El servidor de inferencia rechazó la clave de autenticación: {e}") from e
+        except (OSError, EOFError) as e:
+            raise InferenceServerError(f"No se pudo conectar con el servidor de inferencia: {e}") from e
+
+    def _receive(self, conn):
+        if not conn.poll(self.timeout):
+            raise InferenceServerError(f"El servidor de inferencia no respondió en {self.timeout} segundos")
+        try:
+            response = conn.recv()
+        except EOFError as e:
+            raise InferenceServerError("El servidor de inferencia cerró la conexión") from e
+        if not response.get('ok'):
+            raise InferenceServerError(response.get('error', 'Error desconocido en el servidor de inferencia'))
+        return response
+
+    def call(self, op, **payload):
+        conn = self._connect()
+        try:
+            conn.send({'op': op, **payload})
+            return self._receive(conn)['result']
+        finally:
+            conn.close()
+
+    def stream(self, note, usage=None):
+        conn = self._connect()
+        try:
+            conn.send({'op': OP_STREAM, 'note': note, 'usage': usage is not None})
+            while True:
+                response = self._receive(conn)
+                if response.get('done'):
+                    if usage is not None:
+                        usage['generated_tokens'] = response.get('generated_tokens', 0)
+                    return
+                yield response['chunk']
+        finally:
+            conn.close()
+
+
+def _handle_request(request):
+    from . import ia_logic
+
+    op = request.get('op')
+    if op == OP_ANALYZE:
+        result = ia_logic.analyze_note_with_usage(
+            request['note'], assisted=request.get('assisted'), use_cache=request.get('use_cache', True)
+        )
+        return result if request.get('usage') else result[:2]
+    if op == OP_STATUS:
+        return ia_logic.model_lifecycle.status()
+    if op == OP_STATS:
+        stats = ia_logic.get_inference_stats()
+        stats['server'] = {'pid': os.getpid()}
+        return stats
+    raise ValueError(f"Operación desconocida: {op}")
+
+
+def _handle_connection(conn):
+    from . import ia_logic
+
+    close_old_connections()
+    try:
+        request = conn.recv()
+        if request.get('op') == OP_STREAM:
+            usage = {} if request.get('usage') else None
+            for chunk in ia_logic.stream_diagnosis_and_suggestions(request['note'], usage=usage):
+                conn.send({'ok': True, 'chunk': chunk})
+            conn.send({'ok': True, 'done': True, **(usage or {})})
+        else:
+            conn.send({'ok': True, 'result': _handle_request(request)})
+    except (EOFError, OSError):
+        pass
+    except Exception as e:
+        print(f"ERROR: Servidor de inferencia (pid {os.getpid()}): {e}")
+        try:
+            conn.send({'ok': False, 'error': str(e)})
+        except (EOFError, OSError):
+            pass
+    finally:
+        conn.close()
+        close_old_connections()
+
+
+def worker_main(listener, torch_threads):
+    """
+    Bucle de un proceso worker. Hereda del padre (fork) el modelo ya cargado y el
+    socket de escucha; cada conexión se atiende en un hilo para que el micro-batching
+    del worker pueda agrupar solicitudes concurrentes.
+    """
+    import torch
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    torch.set_num_threads(torch_threads)
+    print(f"DEBUG: Worker de inferencia {os.getpid()} listo ({torch_threads} hilos de torch).")
+
+    while True:
+        try:
+            conn = listener.accept()
+        except (AuthenticationError, OSError, EOFError) as e:
+            # Fallo de autenticación o conexión abortada: se ignora esa conexión.
+            print(f"ERROR: Worker de inferencia {os.getpid()}: conexión rechazada: {e}")
+            continue
+        threading.Thread(target=_handle_connection, args=(conn,), daemon=True).start()
+
+
+def create_listener(address):
+    parsed = parse_address(address)
+    authkey = _authkey(parsed)
+    if isinstance(parsed, str) and os.path.exists(parsed):
+        os.unlink(parsed)
+    listener = Listener(parsed, authkey=authkey)
+    if isinstance(parsed, str):
+        # Solo el usuario del servidor puede conectar al socket.
+        os.chmod(parsed, 0o600)
+    return listener
@@ -0,0 +1,236 @@
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.utils import timezone
+
+from .models import NoteLease
+
+logger = logging.getLogger(__name__)
+
+
+def worker_id():
+    """Identificador del proceso actual (se recalcula para que sea distinto tras un fork)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def note_path(patient_uid, note_id):
+    return f"users/{patient_uid}/notes/{note_id}"
+
+
+class NoteLeases:
+    """
+    Leases por nota con expiración sobre la tabla NoteLease. `acquire` es un único
+    INSERT ... ON CONFLICT que solo sobrescribe leases expirados y no completados, así
+    que dos procesos nunca obtienen a la vez la misma nota y los leases de un proceso
+    caído se reclaman solos al expirar.
+
+    `release` no borra la fila: la deja expirada para que `failed_note_paths` la
+    encuentre y el barrido reintente la nota aunque el descubrimiento ya la dejó atrás.
+    """
+
+    def __init__(self, ttl_seconds=300, owner=None):
+        self.ttl_seconds = ttl_seconds
+        self.owner = owner
+
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.conflicts = 0
+        self.completed = 0
+        self.released = 0
+        self.errors = 0
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def acquire(self, path):
+        """Devuelve True si este proceso obtuvo (o reclamó) el lease de la nota."""
+        table = connection.ops.quote_name(NoteLease._meta.db_table)
+        now = timezone.now()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} (note_path, owner, acquired_at, expires_at, completed_at, attempts) "
+                    f"VALUES (%s, %s, %s, %s, NULL, 1) "
+                    f"ON CONFLICT (note_path) DO UPDATE SET "
+                    f"owner = EXCLUDED.owner, acquired_at = EXCLUDED.acquired_at, expires_at = EXCLUDED.expires_at, "
+                    f"attempts = {table}.attempts + 1 "
+                    f"WHERE {table}.completed_at IS NULL AND {table}.expires_at < EXCLUDED.acquired_at "
+                    f"RETURNING id",
+                    [path, self.owner or worker_id(), now, now + timedelta(seconds=self.ttl_seconds)],
+                )
+                acquired = cursor.fetchone() is not None
+        except Exception as e:
+            # Sin base de datos no hay forma de coordinarse: la nota queda para más tarde.
+            self._count('errors')
+            logger.error(f"NoteLeases: Error al obtener el lease de {path}. Detalles: {e}")
+            return False
+
+        self._count('acquired' if acquired else 'conflicts')
+        return acquired
+
+    def complete(self, paths):
+        """Marca como completadas las notas ya escritas; su lease no volverá a concederse."""
+        try:
+            updated = NoteLease.objects.filter(
+                note_path__in=list(paths), owner=self.owner or worker_id()
+            ).update(completed_at=timezone.now())
+            self._count('completed', updated)
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"NoteLeases: Error al completar {len(paths)} leases. Detalles: {e}")
+
+    def release(self, path):
+        """
+        Libera el lease de una nota que no se pudo procesar: lo deja expirado (cualquiera
+        puede volver a obtenerlo) y pendiente de reintento (`failed_note_paths`).
+        """
+        try:
+            released = NoteLease.objects.filter(
+                note_path=path, owner=self.owner or worker_id(), completed_at__isnull=True
+            ).update(expires_at=timezone.now())
+            self._count('released', released)
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"NoteLeases: Error al liberar el lease de {path}. Detalles: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'acquired': self.acquired,
+                'conflicts': self.conflicts,
+                'completed': self.completed,
+                'released': self.released,
+                'errors': self.errors,
+            }
+
+
+def failed_note_paths(limit=200, max_attempts=5):
+    """
+    Rutas de notas con lease expirado y sin completar, las que llevan más tiempo esperando
+    primero: su análisis o su escritura falló, o el proceso que tenía el lease murió.
+    Las que ya gastaron `max_attempts` intentos no se devuelven.
+    """
+    return list(
+        NoteLease.objects.filter(completed_at__isnull=True, expires_at__lt=timezone.now(), attempts__lt=max_attempts)
+        .order_by('expires_at')
+        .values_list('note_path', flat=True)[:limit]
+    )
+
+
+def forget_leases(paths):
+    """Borra los leases sin completar de notas que ya no hay que analizar."""
+    return NoteLease.objects.filter(note_path__in=list(paths), completed_at__isnull=True).delete()[0]
+
+
+def purge_leases(retention_seconds):
+    """Borra los leases completados o expirados hace más de `retention_seconds`."""
+    cutoff = timezone.now() - timedelta(seconds=retention_seconds)
+    done = NoteLease.objects.filter(completed_at__lt=cutoff).delete()[0]
+    expired = NoteLease.objects.filter(completed_at__isnull=True, expires_at__lt=cutoff).delete()[0]
+    return done + expired
+
+
+class LeaderElection:
+    """
+    Elección de líder con un advisory lock de sesión de Postgres (`pg_try_advisory_lock`).
+
+    El lock se toma en una conexión propia que se mantiene abierta mientras el proceso
+    sea líder; si el proceso muere o pierde la conexión, Postgres libera el lock y otro
+    proceso lo obtiene en su siguiente intento (cada `check_seconds`). `on_elected` y
+    `on_demoted` se llaman desde el hilo de la elección al cambiar de rol.
+
+    Con otro motor de base de datos no hay advisory locks: el proceso se considera líder.
+    """
+
+    def __init__(self, lock_key, check_seconds=10, on_elected=None, on_demoted=None, name='scheduler'):
+        self.lock_key = lock_key
+        self.check_seconds = check_seconds
+        self.name = name
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+
+        self._conn = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.is_leader = False
+        self.elected_at = None
+        self.elections = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name=f'{self.name}-election', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.check_seconds + 5)
+
+    def status(self):
+        return {
+            'name': self.name,
+            'leader': self.is_leader,
+            'worker': worker_id(),
+            'elected_at': self.elected_at,
+            'elections': self.elections,
+        }
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self._conn is None:
+                    self._conn = connections.create_connection(DEFAULT_DB_ALIAS)
+                if not self.is_leader:
+                    if self._try_lock():
+                        self._set_leader(True)
+                else:
+                    # Comprueba que la conexión (y con ella el lock) sigue viva.
+                    with self._conn.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+            except Exception as e:
+                logger.error(f"LeaderElection[{self.name}]: Conexión perdida. Detalles: {e}")
+                self._close()
+                if self.is_leader:
+                    self._set_leader(False)
+            self._stop.wait(self.check_seconds)
+
+        if self.is_leader:
+            self._set_leader(False)
+        # La conexión solo se usa desde este hilo (Django no permite compartirla).
+        self._close()
+
+    def _try_lock(self):
+        if self._conn.vendor != 'postgresql':
+            return True
+        with self._conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [self.lock_key])
+            return bool(cursor.fetchone()[0])
+
+    def _set_leader(self, is_leader):
+        self.is_leader = is_leader
+        if is_leader:
+            self.elected_at = timezone.now().isoformat()
+            self.elections += 1
+            logger.info(f"LeaderElection[{self.name}]: {worker_id()} es el líder.")
+        else:
+            logger.warning(f"LeaderElection[{self.name}]: {worker_id()} deja de ser el líder.")
+        callback = self._on_elected if is_leader else self._on_demoted
+        if callback is not None:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"LeaderElection[{self.name}]: Error en el cambio de rol. Detalles: {e}", exc_info=True)
+
+    def _close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                # Cerrar la conexión libera el advisory lock de sesión.
+                conn.close()
+            except Exception:
+                pass
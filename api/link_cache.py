@@ -0,0 +1,106 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .links import linked_patient_uids
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'links:caregiver:'
+
+
+class LinkCache:
+    """
+    Caché de los vínculos cuidador-paciente sobre el framework de caché de Django
+    (local-memory o Redis según CACHES). Cada entrada guarda la lista completa de
+    pacientes de un cuidador, así que "pacientes del cuidador" y "¿está vinculado?"
+    se resuelven con una sola lectura.
+
+    La fuente es CaregiverPatientLink en Postgres (Firestore solo se reconcilia aparte,
+    api/links.py). Las vistas que crean o eliminan vínculos llaman a `invalidate` después
+    de escribir; el TTL solo cubre cambios hechos por fuera de esas vistas.
+    """
+
+    def __init__(self, alias='default', ttl_seconds=300):
+        self.alias = alias
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    @property
+    def _cache(self):
+        return caches[self.alias]
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def _load(self, caregiver_uid):
+        return linked_patient_uids(caregiver_uid)
+
+    def patients_of(self, caregiver_uid):
+        """UIDs de los pacientes vinculados al cuidador (lista ordenada)."""
+        return self.patients_of_many([caregiver_uid])[caregiver_uid]
+
+    def patients_of_many(self, caregiver_uids):
+        """Pacientes de varios cuidadores: una sola lectura de caché para todos y Postgres para los que falten."""
+        keys = {KEY_PREFIX + uid: uid for uid in caregiver_uids}
+        try:
+            found = self._cache.get_many(list(keys))
+        except Exception as e:
+            # Si el backend de caché falla se consulta Postgres directamente.
+            self._count('errors')
+            logger.error(f"LinkCache: Error al leer la caché. Detalles: {e}")
+            found = {}
+
+        result = {keys[key]: patients for key, patients in found.items()}
+        self._count('hits', len(result))
+        missing = {}
+        for key, uid in keys.items():
+            if uid not in result:
+                result[uid] = missing[key] = self._load(uid)
+        if missing:
+            self._count('misses', len(missing))
+            try:
+                self._cache.set_many(missing, timeout=self.ttl_seconds)
+            except Exception as e:
+                self._count('errors')
+                logger.error(f"LinkCache: Error al guardar en la caché. Detalles: {e}")
+        return result
+
+    def is_linked(self, caregiver_uid, patient_uid):
+        return patient_uid in self.patients_of(caregiver_uid)
+
+    def invalidate(self, caregiver_uid):
+        """Descarta la entrada del cuidador; se llama tras crear o eliminar un vínculo."""
+        try:
+            self._cache.delete(KEY_PREFIX + caregiver_uid)
+            self._count('invalidations')
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"LinkCache: Error al invalidar los vínculos de {caregiver_uid}. Detalles: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': settings.CACHES[self.alias]['BACKEND'].rsplit('.', 1)[-1],
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'invalidations': self.invalidations,
+                'errors': self.errors,
+            }
+
+
+link_cache = LinkCache(
+    alias=getattr(settings, 'IA_LINK_CACHE_ALIAS', 'default'),
+    ttl_seconds=getattr(settings, 'IA_LINK_CACHE_TTL_SECONDS', 300),
+)
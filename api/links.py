@@ -0,0 +1,214 @@
+import logging
+
+from .models import CaregiverPatientLink, FirebaseUser
+
+logger = logging.getLogger(__name__)
+
+LINKS_COLLECTION = 'caregiverPatientLinks'
+# Límite de operaciones de un WriteBatch de Firestore.
+FIRESTORE_BATCH_LIMIT = 500
+
+
+def _authorized_link_query(caregiver_uid, patient_uid):
+    return CaregiverPatientLink.objects.select_related('caregiver', 'patient').filter(
+        caregiver__uid=caregiver_uid,
+        caregiver__user_type='caregiver',
+        patient__uid=patient_uid,
+        patient__user_type='patient',
+    )
+
+
+def authorized_link(caregiver_uid, patient_uid):
+    """
+    Autoriza a un cuidador a leer las notas de un paciente con una sola consulta indexada:
+    el join comprueba a la vez el vínculo y el tipo de ambos usuarios. Devuelve el vínculo
+    (con `patient` y `caregiver` ya cargados) o None.
+    """
+    return _authorized_link_query(caregiver_uid, patient_uid).first()
+
+
+async def aauthorized_link(caregiver_uid, patient_uid):
+    return await _authorized_link_query(caregiver_uid, patient_uid).afirst()
+
+
+def _user_types_query(caregiver_uid, patient_uid):
+    return FirebaseUser.objects.filter(uid__in=[caregiver_uid, patient_uid]).values_list('uid', 'user_type')
+
+
+def _denial(types, caregiver_uid, patient_uid):
+    if types.get(patient_uid) != 'patient':
+        return 'Paciente no encontrado', 404
+    if types.get(caregiver_uid) != 'caregiver':
+        return 'Cuidador no encontrado', 404
+    return 'No existe vínculo entre el cuidador y el paciente', 403
+
+
+def link_denial(caregiver_uid, patient_uid):
+    """
+    Motivo por el que `authorized_link` no encontró el vínculo, como (mensaje, código HTTP).
+    Solo se consulta en el camino de error, así que no añade viajes a las lecturas válidas.
+    """
+    return _denial(dict(_user_types_query(caregiver_uid, patient_uid)), caregiver_uid, patient_uid)
+
+
+async def alink_denial(caregiver_uid, patient_uid):
+    types = {uid: user_type async for uid, user_type in _user_types_query(caregiver_uid, patient_uid)}
+    return _denial(types, caregiver_uid, patient_uid)
+
+
+def _authorized_patients_query(caregiver_uid, patient_uids):
+    links = CaregiverPatientLink.objects.select_related('patient').filter(
+        caregiver__uid=caregiver_uid,
+        caregiver__user_type='caregiver',
+        patient__user_type='patient',
+    )
+    if patient_uids is not None:
+        links = links.filter(patient__uid__in=list(patient_uids))
+    return links.order_by('patient__uid')
+
+
+def authorized_patients(caregiver_uid, patient_uids=None):
+    """
+    Pacientes (FirebaseUser) vinculados al cuidador, en una sola consulta; si se indica
+    `patient_uids`, solo los de esa lista. Los que falten respecto a la lista no están
+    autorizados (o no existen).
+    """
+    return [link.patient for link in _authorized_patients_query(caregiver_uid, patient_uids)]
+
+
+async def aauthorized_patients(caregiver_uid, patient_uids=None):
+    return [link.patient async for link in _authorized_patients_query(caregiver_uid, patient_uids)]
+
+
+def linked_patient_uids(caregiver_uid):
+    return list(
+        CaregiverPatientLink.objects.filter(caregiver__uid=caregiver_uid, patient__user_type='patient')
+        .order_by('patient__uid')
+        .values_list('patient__uid', flat=True)
+    )
+
+
+def reconcile_links(db, apply=False, missing_in_postgres='report'):
+    """
+    Reconcilia `caregiverPatientLinks` de Firestore con CaregiverPatientLink, que es la
+    fuente de verdad para la autorización:
+
+    - Vínculos de Postgres sin documento en Firestore: se crea el documento.
+    - Documentos repetidos para una misma pareja: se conserva uno.
+    - Vínculos solo en Firestore (p. ej. de un desvinculado cuyo borrado en Firestore
+      falló, o anteriores a la réplica en Postgres) según `missing_in_postgres`:
+      'report' solo los cuenta, 'import' los crea en Postgres si ambos usuarios existen
+      con el tipo correcto y 'prune' borra el documento.
+
+    Con `apply=False` no escribe nada y solo devuelve el informe.
+    """
+    if missing_in_postgres not in ('report', 'import', 'prune'):
+        raise ValueError(f"Modo desconocido para vínculos solo en Firestore: {missing_in_postgres}")
+
+    report = {
+        'firestore_docs': 0,
+        'postgres_links': 0,
+        'invalid_docs': 0,
+        'created_in_firestore': 0,
+        'duplicate_docs': 0,
+        'only_in_firestore': 0,
+        'imported': 0,
+        'pruned': 0,
+        'unresolved': 0,
+        'applied': apply,
+        'caregivers': set(),
+    }
+
+    firestore_pairs = {}
+    for doc in db.collection(LINKS_COLLECTION).stream():
+        report['firestore_docs'] += 1
+        data = doc.to_dict() or {}
+        pair = (data.get('caregiverUid'), data.get('patientUid'))
+        if not all(pair):
+            report['invalid_docs'] += 1
+            continue
+        firestore_pairs.setdefault(pair, []).append(doc)
+
+    postgres_links = {
+        (link.caregiver.uid, link.patient.uid): link
+        for link in CaregiverPatientLink.objects.select_related('caregiver', 'patient')
+    }
+    report['postgres_links'] = len(postgres_links)
+
+    writes = []  # (operación, referencia, datos) para Firestore
+    for pair, link in postgres_links.items():
+        if pair not in firestore_pairs:
+            report['created_in_firestore'] += 1
+            report['caregivers'].add(pair[0])
+            writes.append(('set', db.collection(LINKS_COLLECTION).document(), {
+                'caregiverUid': pair[0],
+                'patientUid': pair[1],
+                'linkedAt': link.linked_at.isoformat(),
+                'caregiverEmail': link.caregiver.email,
+                'patientEmail': link.patient.email,
+            }))
+
+    only_in_firestore = []
+    for pair, docs in firestore_pairs.items():
+        for extra in docs[1:]:
+            report['duplicate_docs'] += 1
+            writes.append(('delete', extra.reference, None))
+        if pair not in postgres_links:
+            report['only_in_firestore'] += 1
+            only_in_firestore.append((pair, docs[0]))
+
+    to_import = []
+    if only_in_firestore and missing_in_postgres == 'import':
+        uids = {uid for pair, _ in only_in_firestore for uid in pair}
+        users = {user.uid: user for user in FirebaseUser.objects.filter(uid__in=uids)}
+        for (caregiver_uid, patient_uid), _ in only_in_firestore:
+            caregiver, patient = users.get(caregiver_uid), users.get(patient_uid)
+            if caregiver is None or caregiver.user_type != 'caregiver' or patient is None or patient.user_type != 'patient':
+                report['unresolved'] += 1
+                continue
+            to_import.append(CaregiverPatientLink(caregiver=caregiver, patient=patient))
+            report['caregivers'].add(caregiver_uid)
+        report['imported'] = len(to_import)
+    elif only_in_firestore and missing_in_postgres == 'prune':
+        for pair, doc in only_in_firestore:
+            writes.append(('delete', doc.reference, None))
+            report['caregivers'].add(pair[0])
+        report['pruned'] = len(only_in_firestore)
+    else:
+        report['unresolved'] = len(only_in_firestore)
+
+    if apply:
+        if to_import:
+            CaregiverPatientLink.objects.bulk_create(to_import, ignore_conflicts=True)
+        for start in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+            batch = db.batch()
+            for operation, reference, data in writes[start:start + FIRESTORE_BATCH_LIMIT]:
+                if operation == 'set':
+                    batch.set(reference, data)
+                else:
+                    batch.delete(reference)
+            batch.commit()
+
+        from .link_cache import link_cache
+        for caregiver_uid in report['caregivers']:
+            link_cache.invalidate(caregiver_uid)
+
+    report['caregivers'] = len(report['caregivers'])
+    return report
+
+
+def run_scheduled_reconciliation():
+    """Reconciliación periódica del scheduler: repara Firestore y solo informa de lo demás."""
+    from firebase_config import db
+
+    try:
+        report = reconcile_links(db, apply=True)
+    except Exception as e:
+        logger.error(f"reconcile_links: Error al reconciliar los vínculos. Detalles: {e}", exc_info=True)
+        return None
+    if report['unresolved']:
+        logger.warning(
+            f"reconcile_links: {report['unresolved']} vínculos existen solo en Firestore; "
+            f"revísalos con `manage.py reconcile_links`."
+        )
+    return report
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from api.note_pages import backfill_created_at
+from firebase_config import db
+
+
+class Command(BaseCommand):
+    help = (
+        "Asigna createdAt (instante de creación del documento) a las notas que no lo tienen, "
+        "para que aparezcan en las listas paginadas y en el análisis. Sin --apply solo informa."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apply', action='store_true', help="Escribe createdAt (por defecto, solo informe)")
+
+    def handle(self, *args, **options):
+        report = backfill_created_at(db, apply=options['apply'])
+
+        self.stdout.write(f"Notas recorridas: {report['scanned']}. Sin createdAt: {report['missing']}.")
+        if report['applied']:
+            self.stdout.write(self.style.SUCCESS(
+                f"createdAt asignado a {report['updated']} notas de {report['patients']} pacientes."
+            ))
+        else:
+            self.stdout.write(self.style.WARNING("Solo informe: usa --apply para escribir createdAt."))
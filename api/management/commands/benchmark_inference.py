@@ -0,0 +1,200 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import ia_logic
+from api.benchmarking import (
+    DEFAULT_DATASET_PATH,
+    generate_synthetic_notes,
+    load_dataset_notes,
+    peak_rss_mb,
+    percentile,
+)
+
+MODE_GENERATE = 'generate'
+MODE_STREAM = 'stream'
+
+# Ajustes que se guardan junto a los resultados para comparar ejecuciones.
+RECORDED_SETTINGS = (
+    'IA_INFERENCE_BACKEND',
+    'IA_PREFIX_KV_CACHE',
+    'IA_BATCH_MAX_SIZE',
+    'IA_BATCH_MAX_WAIT_MS',
+    'IA_DETERMINISTIC_GENERATION',
+    'IA_PROMPT_LOOKUP_NUM_TOKENS',
+    'IA_PROMPT_LOOKUP_MAX_NGRAM',
+    'IA_INFERENCE_SERVER_ADDRESS',
+)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _summarize(values):
+    if not values:
+        return None
+    return {
+        'mean': statistics.mean(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Reproduce notas de notes_dataset.jsonl (o un conjunto sintético mayor) contra la lógica de IA "
+        "con concurrencia configurable y reporta latencias p50/p95/p99, TTFT, tokens/s, RSS y throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', default=DEFAULT_DATASET_PATH, help="Ruta a notes_dataset.jsonl")
+        parser.add_argument('--notes', type=int, default=50, help="Número de notas a enviar")
+        parser.add_argument(
+            '--synthetic',
+            action='store_true',
+            help="Genera las notas con generate_dataset.generate_note_data en lugar de leer el dataset",
+        )
+        parser.add_argument('--seed', type=int, default=42, help="Semilla para las notas sintéticas")
+        parser.add_argument('--concurrency', type=int, default=4, help="Solicitudes simultáneas")
+        parser.add_argument(
+            '--mode',
+            choices=[MODE_GENERATE, MODE_STREAM],
+            default=MODE_GENERATE,
+            help="'generate' usa el camino con micro-batching; 'stream' mide además el tiempo hasta el primer token",
+        )
+        parser.add_argument(
+            '--assisted',
+            action='store_true',
+            help="Usa decodificación asistida por n-gramas del prompt (solo en modo 'generate')",
+        )
+        parser.add_argument('--use-cache', action='store_true', help="No desactivar la caché de análisis")
+        parser.add_argument('--output', help="Archivo JSON donde guardar los resultados")
+        parser.add_argument('--label', default='', help="Etiqueta libre para identificar la ejecución")
+
+    def handle(self, *args, **options):
+        if options['synthetic']:
+            notes = generate_synthetic_notes(options['notes'], seed=options['seed'])
+        else:
+            notes = load_dataset_notes(options['dataset'], limit=options['notes'])
+        if not notes:
+            raise CommandError("No hay notas para el benchmark.")
+
+        cache_enabled = options['use_cache'] and getattr(settings, 'IA_CACHE_ENABLED', True)
+        # Calentamiento fuera de la medición.
+        self._run_one(notes[0], options['mode'], options['assisted'], cache_enabled)
+        records, wall_seconds = self._replay(notes, options, cache_enabled)
+
+        errors = [r for r in records if r['error']]
+        ok = [r for r in records if not r['error']]
+        generated_tokens = sum(r['tokens'] for r in ok)
+        results = {
+            'label': options['label'],
+            'timestamp': timezone.now().isoformat(),
+            'git_commit': _git_commit(),
+            'host': {'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+            'settings': {name: getattr(settings, name, None) for name in RECORDED_SETTINGS},
+            'params': {
+                'mode': options['mode'],
+                'concurrency': options['concurrency'],
+                'notes': len(notes),
+                'synthetic': options['synthetic'],
+                'assisted': options['assisted'],
+                'cache_enabled': cache_enabled,
+            },
+            'requests': len(records),
+            'errors': len(errors),
+            'wall_seconds': wall_seconds,
+            'throughput_rps': len(ok) / wall_seconds if wall_seconds else 0.0,
+            'generated_tokens': generated_tokens,
+            'tokens_per_second': generated_tokens / wall_seconds if wall_seconds else 0.0,
+            'latency_ms': _summarize([r['latency_ms'] for r in ok]),
+            'ttft_ms': _summarize([r['ttft_ms'] for r in ok if r['ttft_ms'] is not None]),
+            'peak_rss_mb': peak_rss_mb(),
+            'inference_stats': ia_logic.get_inference_stats(),
+        }
+
+        self._report(results)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2, default=str)
+            self.stdout.write(f"Resultados guardados en {options['output']}")
+
+    def _run_one(self, note, mode, assisted=False, use_cache=False):
+        """
+        Una solicitud medida. Los tokens son los que produjo `generate` (contados sobre sus
+        ids en el proceso que ejecuta el modelo), no una re-tokenización del texto final.
+        """
+        started_at = time.perf_counter()
+        ttft_ms = None
+        if mode == MODE_STREAM:
+            usage = {}
+            chunks = []
+            for chunk in ia_logic.stream_diagnosis_and_suggestions(note, usage=usage):
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started_at) * 1000.0
+                chunks.append(chunk)
+            text = ''.join(chunks)
+            generated_tokens = usage.get('generated_tokens', 0)
+        else:
+            text, _, generated_tokens = ia_logic.analyze_note_with_usage(note, assisted=assisted, use_cache=use_cache)
+        latency_ms = (time.perf_counter() - started_at) * 1000.0
+
+        error = text.startswith("Error")
+        return {
+            'latency_ms': latency_ms,
+            'ttft_ms': ttft_ms,
+            'tokens': 0 if error else generated_tokens,
+            'error': error,
+        }
+
+    def _replay(self, notes, options, use_cache):
+        records = []
+        lock = threading.Lock()
+
+        def _task(note):
+            try:
+                record = self._run_one(note, options['mode'], options['assisted'], use_cache)
+            except Exception as e:
+                self.stderr.write(f"Error en una solicitud del benchmark: {e}")
+                record = {'latency_ms': None, 'ttft_ms': None, 'tokens': 0, 'error': True}
+            with lock:
+                records.append(record)
+
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(options['concurrency'], 1)) as executor:
+            list(executor.map(_task, notes))
+        return records, time.perf_counter() - started_at
+
+    def _report(self, results):
+        self.stdout.write(self.style.SUCCESS(
+            f"{results['requests']} solicitudes ({results['errors']} errores) en {results['wall_seconds']:.2f}s "
+            f"con concurrencia {results['params']['concurrency']}"
+        ))
+        self.stdout.write(f"  throughput        {results['throughput_rps']:.3f} req/s")
+        self.stdout.write(f"  tokens/s          {results['tokens_per_second']:.2f}")
+        for name in ('latency_ms', 'ttft_ms'):
+            summary = results[name]
+            if summary:
+                self.stdout.write(
+                    f"  {name:17s} p50={summary['p50']:.1f}  p95={summary['p95']:.1f}  "
+                    f"p99={summary['p99']:.1f}  media={summary['mean']:.1f}"
+                )
+        if results['peak_rss_mb'] is not None:
+            self.stdout.write(f"  RSS máximo        {results['peak_rss_mb']:.1f} MB")
@@ -0,0 +1,49 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.benchmarking import DEFAULT_DATASET_PATH, load_dataset_notes, percentile
+from api.ia_logic import _run_generate, model_lifecycle
+
+
+class Command(BaseCommand):
+    help = "Compara el tiempo hasta el primer token con y sin la KV-cache precalculada del prefijo del prompt."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', default=DEFAULT_DATASET_PATH, help="Ruta a notes_dataset.jsonl")
+        parser.add_argument('--notes', type=int, default=50, help="Número de notas a medir")
+        parser.add_argument('--batch-size', type=int, default=1, help="Notas por llamada a generate")
+
+    def handle(self, *args, **options):
+        loaded = model_lifecycle.ensure_loaded()
+        if loaded.prefix_cache is None:
+            self.stderr.write("La KV-cache del prefijo está desactivada (IA_PREFIX_KV_CACHE = False).")
+            return
+
+        notes = load_dataset_notes(options['dataset'], limit=options['notes'])
+        batch_size = max(options['batch_size'], 1)
+        batches = [notes[i:i + batch_size] for i in range(0, len(notes), batch_size)]
+
+        results = {}
+        for label, use_prefix_cache in (('sin_cache', False), ('con_cache', True)):
+            # Una llamada previa para que ambas variantes partan con los kernels inicializados.
+            _run_generate(loaded, batches[0], use_prefix_cache=use_prefix_cache, max_new_tokens=1)
+            timings = []
+            for batch in batches:
+                started_at = time.perf_counter()
+                _run_generate(loaded, batch, use_prefix_cache=use_prefix_cache, max_new_tokens=1)
+                timings.append((time.perf_counter() - started_at) * 1000.0)
+            results[label] = timings
+
+        self.stdout.write(f"Tiempo hasta el primer token ({len(batches)} llamadas, lote de {batch_size}):")
+        for label, timings in results.items():
+            self.stdout.write(
+                f"  {label:10s} media={statistics.mean(timings):8.2f} ms  "
+                f"p50={percentile(timings, 50):8.2f} ms  p95={percentile(timings, 95):8.2f} ms"
+            )
+
+        baseline = statistics.mean(results['sin_cache'])
+        cached = statistics.mean(results['con_cache'])
+        saving = (baseline - cached) / baseline * 100.0 if baseline else 0.0
+        self.stdout.write(self.style.SUCCESS(f"Ahorro medio en TTFT: {baseline - cached:.2f} ms ({saving:.1f}%)"))
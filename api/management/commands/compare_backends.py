@@ -0,0 +1,133 @@
+import multiprocessing
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarking import DEFAULT_DATASET_PATH, current_rss_mb, load_dataset_notes, peak_rss_mb, percentile
+from api.ia_logic import DETERMINISTIC_GENERATION_KWARGS, _load_model, _run_generate
+from api.inference_backends import BACKEND_TORCH, BACKENDS
+
+
+def _measure_backend(backend, notes, generation_kwargs):
+    """
+    Carga `backend` y mide la generación de `notes`. Se ejecuta en un proceso propio por
+    backend, así que el RSS máximo (ru_maxrss) es solo el de este backend y no arrastra
+    el pico de los que se midieron antes.
+    """
+    rss_before = current_rss_mb()
+    started_at = time.perf_counter()
+    loaded = _load_model(backend=backend, prefix_kv_cache=False)
+    load_seconds = time.perf_counter() - started_at
+    rss_after_load = current_rss_mb()
+
+    # Primera llamada fuera de la medición.
+    _run_generate(loaded, notes[:1], use_prefix_cache=False, generation_kwargs=generation_kwargs)
+
+    latencies = []
+    generated_tokens = 0
+    outputs = []
+    for note in notes:
+        started_at = time.perf_counter()
+        output_ids, input_length = _run_generate(
+            loaded, [note], use_prefix_cache=False, generation_kwargs=generation_kwargs
+        )
+        latencies.append((time.perf_counter() - started_at) * 1000.0)
+        new_tokens = output_ids[0, input_length:].tolist()
+        generated_tokens += len(new_tokens)
+        outputs.append(new_tokens)
+
+    total_seconds = sum(latencies) / 1000.0
+    result = {
+        'load_seconds': load_seconds,
+        'latency_ms_mean': statistics.mean(latencies),
+        'latency_ms_p50': percentile(latencies, 50),
+        'latency_ms_p95': percentile(latencies, 95),
+        'tokens_per_second': generated_tokens / total_seconds if total_seconds else 0.0,
+        'rss_model_mb': (rss_after_load - rss_before) if rss_before is not None and rss_after_load is not None else None,
+        'rss_peak_mb': peak_rss_mb(),
+    }
+    return result, outputs
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara los backends de inferencia (torch float32, int8, onnx) sobre notes_dataset.jsonl: "
+        "latencia, tokens/s, memoria RSS y coincidencia de la salida con el baseline float32. "
+        "Cada backend se mide en un proceso propio."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', default=DEFAULT_DATASET_PATH, help="Ruta a notes_dataset.jsonl")
+        parser.add_argument('--notes', type=int, default=20, help="Número de notas a generar por backend")
+        parser.add_argument('--max-new-tokens', type=int, default=64, help="Tokens nuevos por nota")
+        parser.add_argument(
+            '--backends',
+            default=','.join(BACKENDS),
+            help="Backends a comparar, separados por comas (el baseline torch se ejecuta siempre)",
+        )
+
+    def handle(self, *args, **options):
+        backends = [b.strip() for b in options['backends'].split(',') if b.strip()]
+        unknown = set(backends) - set(BACKENDS)
+        if unknown:
+            raise CommandError(f"Backends desconocidos: {', '.join(sorted(unknown))}")
+        if BACKEND_TORCH in backends:
+            backends.remove(BACKEND_TORCH)
+        backends.insert(0, BACKEND_TORCH)
+
+        notes = load_dataset_notes(options['dataset'], limit=options['notes'])
+        # Decodificación greedy para que la comparación de salidas sea determinista.
+        generation_kwargs = {**DETERMINISTIC_GENERATION_KWARGS, 'max_new_tokens': options['max_new_tokens']}
+
+        # Un proceso nuevo (spawn) por backend: ni la memoria ni los hilos de torch de uno
+        # afectan a la medición del siguiente.
+        context = multiprocessing.get_context('spawn')
+        baseline_outputs = None
+        for backend in backends:
+            try:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=django.setup) as executor:
+                    result, outputs = executor.submit(_measure_backend, backend, notes, generation_kwargs).result()
+            except Exception as e:
+                self.stderr.write(f"[{backend}] No se pudo ejecutar: {e}")
+                continue
+
+            if backend == BACKEND_TORCH:
+                baseline_outputs = outputs
+            elif baseline_outputs is not None:
+                result.update(self._agreement(baseline_outputs, outputs))
+            self._report(backend, result)
+
+    def _agreement(self, baseline_outputs, outputs):
+        exact = 0
+        matching_tokens = 0
+        compared_tokens = 0
+        for expected, actual in zip(baseline_outputs, outputs):
+            if expected == actual:
+                exact += 1
+            # Prefijo común: a partir del primer token distinto la generación diverge.
+            common = 0
+            for a, b in zip(expected, actual):
+                if a != b:
+                    break
+                common += 1
+            matching_tokens += common
+            compared_tokens += max(len(expected), 1)
+        return {
+            'exact_match_rate': exact / len(outputs) if outputs else 0.0,
+            'common_prefix_ratio': matching_tokens / compared_tokens if compared_tokens else 0.0,
+        }
+
+    def _report(self, backend, result):
+        self.stdout.write(self.style.SUCCESS(f"[{backend}]"))
+        for key, value in result.items():
+            if value is None:
+                formatted = "n/d"
+            elif isinstance(value, float):
+                formatted = f"{value:.3f}"
+            else:
+                formatted = str(value)
+            self.stdout.write(f"  {key:22s} {formatted}")
+
@@ -0,0 +1,105 @@
+import asyncio
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarking import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga que compara despliegues del mismo servidor, p. ej. WSGI "
+        "(gunicorn core.wsgi --threads N) frente a ASGI (uvicorn core.asgi:application), "
+        "sobre un endpoint con lecturas de Firestore: throughput, latencia y errores por "
+        "nivel de concurrencia. Los servidores deben estar ya en marcha. core.wsgi sirve las "
+        "vistas síncronas de notas (IA_ASYNC_NOTE_VIEWS=0) y core.asgi las asíncronas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target',
+            action='append',
+            required=True,
+            help="Despliegue a medir como NOMBRE=URL_BASE (repetible), p. ej. wsgi=http://127.0.0.1:8000",
+        )
+        parser.add_argument(
+            '--path',
+            required=True,
+            help="Ruta y consulta a pedir, p. ej. '/api/patient-notes/?caregiver_uid=...&patient_uid=...'",
+        )
+        parser.add_argument('--concurrency', default='1,10,50', help="Solicitudes simultáneas, separadas por comas")
+        parser.add_argument('--requests', type=int, default=200, help="Solicitudes por nivel de concurrencia")
+        parser.add_argument('--warmup', type=int, default=5, help="Solicitudes previas sin medir por despliegue")
+        parser.add_argument('--timeout', type=float, default=30.0, help="Timeout por solicitud (s)")
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['target']:
+            name, sep, base_url = target.partition('=')
+            if not sep or not name or not base_url:
+                raise CommandError(f"--target debe tener la forma NOMBRE=URL_BASE: {target}")
+            targets.append((name, base_url.rstrip('/')))
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',') if level.strip()]
+        except ValueError:
+            raise CommandError("--concurrency debe ser una lista de enteros")
+
+        for name, base_url in targets:
+            url = base_url + options['path']
+            for concurrency in levels:
+                result = asyncio.run(self._run(url, concurrency, options))
+                self._report(f"{name} c={concurrency}", result)
+
+    async def _run(self, url, concurrency, options):
+        import httpx
+
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=options['timeout']) as client:
+            for _ in range(options['warmup']):
+                try:
+                    await client.get(url)
+                except httpx.HTTPError:
+                    pass
+
+            semaphore = asyncio.Semaphore(concurrency)
+            latencies = []
+            statuses = {}
+            errors = 0
+
+            async def one():
+                nonlocal errors
+                async with semaphore:
+                    started_at = time.perf_counter()
+                    try:
+                        response = await client.get(url)
+                    except httpx.HTTPError:
+                        errors += 1
+                        return
+                    latencies.append((time.perf_counter() - started_at) * 1000.0)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            started_at = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(options['requests'])))
+            wall_seconds = time.perf_counter() - started_at
+
+        return {
+            'requests_per_second': len(latencies) / wall_seconds if wall_seconds else 0.0,
+            'latency_ms_mean': statistics.mean(latencies) if latencies else None,
+            'latency_ms_p50': percentile(latencies, 50),
+            'latency_ms_p95': percentile(latencies, 95),
+            'latency_ms_p99': percentile(latencies, 99),
+            'status_codes': ', '.join(f"{code}: {count}" for code, count in sorted(statuses.items())) or '-',
+            'connection_errors': errors,
+        }
+
+    def _report(self, label, result):
+        self.stdout.write(self.style.SUCCESS(f"[{label}]"))
+        for key, value in result.items():
+            if value is None:
+                formatted = "n/d"
+            elif isinstance(value, float):
+                formatted = f"{value:.3f}"
+            else:
+                formatted = str(value)
+            self.stdout.write(f"  {key:22s} {formatted}")
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import model_registry
+from api.analysis_cache import AnalysisCache
+
+
+class Command(BaseCommand):
+    help = (
+        "Gestiona el registro de versiones del modelo de IA: lista, registra y activa versiones, "
+        "e invalida los análisis cacheados de una versión. Los procesos en ejecución detectan "
+        "el cambio de versión activa y la cargan en segundo plano."
+    )
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+
+        subparsers.add_parser('list', help="Lista las versiones registradas")
+
+        register = subparsers.add_parser('register', help="Registra un directorio de modelo entrenado")
+        register.add_argument('path', help="Directorio generado por finetune_model.py")
+        register.add_argument('--version', help="Nombre de la versión (por defecto, fecha y hora)")
+        register.add_argument('--description', default='', help="Descripción libre de la versión")
+        register.add_argument('--activate', action='store_true', help="Activa la versión tras registrarla")
+
+        activate = subparsers.add_parser('activate', help="Cambia la versión activa")
+        activate.add_argument('version')
+
+        invalidate = subparsers.add_parser(
+            'invalidate-cache', help="Borra de la caché persistente los análisis de una versión"
+        )
+        invalidate.add_argument('version')
+
+    def handle(self, *args, **options):
+        try:
+            getattr(self, '_' + options['action'].replace('-', '_'))(options)
+        except model_registry.ModelRegistryError as e:
+            raise CommandError(str(e))
+
+    def _list(self, options):
+        active = model_registry.get_active_version()
+        versions = model_registry.list_versions()
+        if not versions:
+            version, path = model_registry.resolve_active()
+            self.stdout.write(f"No hay versiones registradas; se sirve '{version}' desde {path}.")
+            return
+        for meta in versions:
+            marker = '*' if meta.get('version') == active else ' '
+            self.stdout.write(
+                f"{marker} {meta.get('version')}  {meta.get('registered_at', '-')}  {meta.get('description', '')}"
+            )
+
+    def _register(self, options):
+        meta = model_registry.register_version(
+            options['path'], version=options['version'], description=options['description']
+        )
+        self.stdout.write(self.style.SUCCESS(f"Versión '{meta['version']}' registrada."))
+        if options['activate']:
+            self._activate({'version': meta['version']})
+
+    def _activate(self, options):
+        model_registry.set_active_version(options['version'])
+        self.stdout.write(self.style.SUCCESS(f"Versión activa: '{options['version']}'."))
+
+    def _invalidate_cache(self, options):
+        # Solo el nivel persistente: la memoria de cada proceso expira con su TTL y,
+        # al cambiar de versión, sus claves dejan de coincidir.
+        deleted = AnalysisCache().invalidate_version(options['version'])
+        self.stdout.write(self.style.SUCCESS(f"{deleted} análisis cacheados de '{options['version']}' eliminados."))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from api.links import reconcile_links
+from firebase_config import db
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconcilia los vínculos cuidador-paciente de Firestore (caregiverPatientLinks) con "
+        "Postgres, que es la fuente de verdad para la autorización. Sin --apply solo informa."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apply', action='store_true', help="Aplica los cambios (por defecto, solo informe)")
+        parser.add_argument(
+            '--missing-in-postgres',
+            choices=['report', 'import', 'prune'],
+            default='report',
+            help=(
+                "Qué hacer con los vínculos que solo están en Firestore: informar, importarlos a "
+                "Postgres o borrar el documento de Firestore"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        report = reconcile_links(db, apply=options['apply'], missing_in_postgres=options['missing_in_postgres'])
+
+        self.stdout.write(
+            f"Firestore: {report['firestore_docs']} documentos ({report['invalid_docs']} inválidos). "
+            f"Postgres: {report['postgres_links']} vínculos."
+        )
+        self.stdout.write(f"Documentos a crear en Firestore: {report['created_in_firestore']}")
+        self.stdout.write(f"Documentos duplicados a borrar: {report['duplicate_docs']}")
+        self.stdout.write(
+            f"Vínculos solo en Firestore: {report['only_in_firestore']} "
+            f"(importados {report['imported']}, borrados {report['pruned']}, sin resolver {report['unresolved']})"
+        )
+        if report['applied']:
+            self.stdout.write(self.style.SUCCESS(f"Cambios aplicados ({report['caregivers']} cuidadores afectados)."))
+        else:
+            self.stdout.write(self.style.WARNING("Solo informe: usa --apply para aplicar los cambios."))
@@ -0,0 +1,76 @@
+import os
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import ia_logic, scheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Ejecuta el worker de análisis en un proceso propio, separado del tier web: barrido "
+        "periódico, listener de notas nuevas y pipeline de análisis con inferencia en el mismo "
+        "proceso. Se detiene de forma ordenada con SIGTERM/SIGINT. En el tier web conviene "
+        "IA_SCHEDULER_ENABLED=0 para que no compita por CPU."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=None,
+            help="Hilos de la etapa de análisis del pipeline (IA_PIPELINE_ANALYSIS_WORKERS)",
+        )
+        parser.add_argument(
+            '--torch-threads',
+            type=int,
+            default=None,
+            help="Hilos intra-op de torch para la inferencia local (por defecto: los de torch)",
+        )
+        parser.add_argument(
+            '--sweep-interval',
+            type=int,
+            default=None,
+            help="Minutos entre barridos de respaldo (IA_SWEEPER_INTERVAL_MINUTES)",
+        )
+        parser.add_argument('--no-listener', action='store_true', help="Solo barridos periódicos, sin on_snapshot")
+
+    def handle(self, *args, **options):
+        analysis_workers = options['concurrency'] or getattr(settings, 'IA_PIPELINE_ANALYSIS_WORKERS', 8)
+        sweep_minutes = options['sweep_interval'] or getattr(settings, 'IA_SWEEPER_INTERVAL_MINUTES', 5)
+        listener = not options['no_listener'] and getattr(settings, 'IA_NOTE_LISTENER_ENABLED', True)
+
+        if not ia_logic.uses_inference_server():
+            if options['torch_threads']:
+                import torch
+                torch.set_num_threads(options['torch_threads'])
+            # Se carga ya el modelo: el primer barrido no paga la carga.
+            ia_logic.model_lifecycle.start_background_load()
+
+        stopping = threading.Event()
+
+        def _stop(signum, frame):
+            if stopping.is_set():
+                self.stderr.write("Segunda señal recibida: salida inmediata.")
+                os._exit(1)
+            stopping.set()
+
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+
+        scheduler.start_scheduling(analysis_workers=analysis_workers, sweep_minutes=sweep_minutes, listener=listener)
+        self.stdout.write(self.style.SUCCESS(
+            f"Worker de análisis iniciado (pid {os.getpid()}, "
+            f"{analysis_workers} hilos de análisis, "
+            f"barrido cada {sweep_minutes} min, "
+            f"listener {'activo' if listener else 'desactivado'})."
+        ))
+        try:
+            while not stopping.wait(1):
+                pass
+        finally:
+            self.stdout.write("Deteniendo el worker de análisis: terminando el trabajo en curso...")
+            scheduler.stop_scheduling()
+            self.stdout.write(self.style.SUCCESS("Worker de análisis detenido."))
@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+import signal
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api import ia_logic
+from api.inference_backends import supports_prefix_cache
+from api.inference_server import create_listener, validate_address, worker_main
+
+
+def _worker_entry(listener, torch_threads, loaded):
+    # El modelo llega ya cargado por fork (copy-on-write); solo se calienta en este proceso.
+    ia_logic.model_lifecycle.install(loaded, warmup=True)
+    worker_main(listener, torch_threads)
+
+
+class Command(BaseCommand):
+    help = (
+        "Ejecuta el servidor local de inferencia: carga el modelo una sola vez y lo comparte "
+        "en solo lectura con varios procesos worker por fork. Los procesos web lo usan como "
+        "cliente cuando IA_INFERENCE_SERVER_ADDRESS está configurado."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--address',
+            default=getattr(settings, 'IA_INFERENCE_SERVER_ADDRESS', None) or 'unix:/tmp/pulsoft-inference.sock',
+            help="Dirección de escucha: 'unix:/ruta' o 'host:puerto' en loopback (requiere IA_INFERENCE_SERVER_AUTHKEY)",
+        )
+        parser.add_argument('--workers', type=int, default=2, help="Procesos worker")
+        parser.add_argument(
+            '--threads-per-worker',
+            type=int,
+            default=None,
+            help="Hilos intra-op de torch por worker (por defecto: núcleos / workers)",
+        )
+
+    def handle(self, *args, **options):
+        if not hasattr(os, 'fork'):
+            raise CommandError("El servidor de inferencia necesita fork() (Linux/macOS) para compartir los pesos.")
+        try:
+            validate_address(options['address'])
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+
+        import torch
+
+        workers = max(options['workers'], 1)
+        threads = options['threads_per_worker'] or max((os.cpu_count() or 1) // workers, 1)
+
+        # En el padre se trabaja con un solo hilo: así la carga no arranca el pool de
+        # OpenMP, que no sobrevive correctamente a un fork.
+        torch.set_num_threads(1)
+        ia_logic.force_local_inference()
+        loaded = ia_logic._load_model()
+        if supports_prefix_cache(loaded.backend):
+            # Pesos en memoria compartida: los workers los leen sin copiarlos.
+            loaded.model.share_memory()
+
+        # Las conexiones a la base de datos no deben heredarse entre procesos.
+        connections.close_all()
+
+        listener = create_listener(options['address'])
+        context = multiprocessing.get_context('fork')
+        processes = []
+        for _ in range(workers):
+            process = context.Process(target=_worker_entry, args=(listener, threads, loaded), daemon=True)
+            process.start()
+            processes.append(process)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Servidor de inferencia escuchando en {options['address']} "
+            f"({workers} workers x {threads} hilos, backend {loaded.backend})."
+        ))
+
+        stopping = False
+
+        def _stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+
+        try:
+            while not stopping:
+                for index, process in enumerate(processes):
+                    if not process.is_alive():
+                        self.stderr.write(f"Worker {process.pid} terminó (código {process.exitcode}); reiniciando.")
+                        processes[index] = context.Process(
+                            target=_worker_entry, args=(listener, threads, loaded), daemon=True
+                        )
+                        processes[index].start()
+                time.sleep(1)
+        finally:
+            self.stdout.write("Deteniendo el servidor de inferencia...")
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join(timeout=10)
+            listener.close()
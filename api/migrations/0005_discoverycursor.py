@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_analysisjob_model_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscoveryCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('created_at_watermark', models.CharField(blank=True, default='', max_length=64)),
+                ('last_note_path', models.CharField(blank=True, default='', max_length=300)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
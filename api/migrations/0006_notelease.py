@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_discoverycursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('note_path', models.CharField(max_length=300, unique=True)),
+                ('owner', models.CharField(max_length=200)),
+                ('acquired_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('completed_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_notelease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('running', 'En curso'), ('done', 'Completada'), ('failed', 'Fallida'), ('abandoned', 'Abandonada')], default='running', max_length=20)),
+                ('worker', models.CharField(blank=True, default='', max_length=200)),
+                ('scanned', models.PositiveIntegerField(default=0)),
+                ('queued', models.PositiveIntegerField(default=0)),
+                ('already_analyzed', models.PositiveIntegerField(default=0)),
+                ('empty', models.PositiveIntegerField(default=0)),
+                ('analyzed', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('skipped', models.PositiveIntegerField(default=0)),
+                ('written', models.PositiveIntegerField(default=0)),
+                ('write_errors', models.PositiveIntegerField(default=0)),
+                ('hit_limit', models.BooleanField(default=False)),
+                ('duration_seconds', models.FloatField(blank=True, null=True)),
+                ('fetch_seconds', models.FloatField(default=0)),
+                ('analysis_seconds', models.FloatField(default=0)),
+                ('write_seconds', models.FloatField(default=0)),
+                ('latency_histogram', models.JSONField(blank=True, default=dict)),
+                ('error_classes', models.JSONField(blank=True, default=dict)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+def remove_duplicate_links(apps, schema_editor):
+    """Conserva el vínculo más antiguo de cada pareja cuidador-paciente y borra el resto."""
+    CaregiverPatientLink = apps.get_model('api', 'CaregiverPatientLink')
+    duplicates = (
+        CaregiverPatientLink.objects.values('caregiver_id', 'patient_id')
+        .annotate(first_id=models.Min('id'), total=models.Count('id'))
+        .filter(total__gt=1)
+    )
+    for pair in duplicates:
+        CaregiverPatientLink.objects.filter(
+            caregiver_id=pair['caregiver_id'], patient_id=pair['patient_id']
+        ).exclude(id=pair['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_analysisrun'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_links, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='caregiverpatientlink',
+            constraint=models.UniqueConstraint(fields=('caregiver', 'patient'), name='api_link_caregiver_patient_uniq'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_caregiverpatientlink_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientNotesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('patient_uid', models.CharField(max_length=100, unique=True)),
+                ('note_count', models.PositiveIntegerField(default=0)),
+                ('newest_created_at', models.CharField(blank=True, default='', max_length=64)),
+                ('last_modified', models.DateTimeField(blank=True, null=True)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('dirty', models.BooleanField(default=True)),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
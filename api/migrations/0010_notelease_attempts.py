@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_patientnotessummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notelease',
+            name='attempts',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
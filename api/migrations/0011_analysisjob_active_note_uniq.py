@@ -0,0 +1,39 @@
+from django.db import migrations, models
+from django.utils import timezone
+
+ACTIVE = ['pending', 'running']
+
+
+def fail_duplicate_active_jobs(apps, schema_editor):
+    """Deja activo solo el trabajo más reciente de cada nota; el resto se marca como fallido."""
+    AnalysisJob = apps.get_model('api', 'AnalysisJob')
+    duplicates = (
+        AnalysisJob.objects.filter(status__in=ACTIVE).exclude(patient_uid='').exclude(note_id='')
+        .values('patient_uid', 'note_id')
+        .annotate(total=models.Count('id'))
+        .filter(total__gt=1)
+    )
+    for pair in duplicates:
+        jobs = AnalysisJob.objects.filter(status__in=ACTIVE, **pair).order_by('-created_at')
+        AnalysisJob.objects.filter(pk__in=[job.pk for job in jobs[1:]]).update(
+            status='failed', error='Trabajo duplicado de la misma nota.', finished_at=timezone.now()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_notelease_attempts'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='analysisjob',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(status__in=['pending', 'running']) & ~models.Q(patient_uid='') & ~models.Q(note_id=''),
+                fields=('patient_uid', 'note_id'),
+                name='api_job_active_note_uniq',
+            ),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_analysisjob_active_note_uniq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientnotessummary',
+            name='max_update_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
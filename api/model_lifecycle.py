@@ -0,0 +1,227 @@
+import threading
+import time
+
+
+class ModelState:
+    NOT_LOADED = 'not_loaded'
+    LOADING = 'loading'
+    WARMING_UP = 'warming_up'
+    READY = 'ready'
+    FAILED = 'failed'
+
+
+class ModelNotReadyError(Exception):
+    """El modelo todavía no está listo o su carga falló."""
+
+    def __init__(self, state, detail=None):
+        self.state = state
+        self.detail = detail
+        message = f"El modelo de IA no está listo (estado: {state})"
+        if detail:
+            message += f": {detail}"
+        super().__init__(message)
+
+
+class ModelLifecycle:
+    """
+    Gestiona la carga perezosa (o en segundo plano) de un modelo.
+
+    `loader()` devuelve el objeto cargado y `warmup(loaded)` ejecuta una
+    generación corta para que la primera solicitud real no pague el coste
+    de inicialización. El estado se expone con `status()` para el endpoint
+    de readiness.
+
+    `swap(loader)` carga y calienta otra versión en segundo plano mientras la
+    actual sigue atendiendo, y después reemplaza `loaded` en una sola asignación:
+    quien ya tomó la referencia anterior termina con ella.
+
+    Un fallo de carga no es definitivo: pasados `retry_seconds` desde el fallo, la
+    siguiente solicitud o consulta de readiness vuelve a intentarlo (`reload`).
+    """
+
+    def __init__(self, loader, warmup=None, name='modelo', retry_seconds=None):
+        self._loader = loader
+        self._warmup = warmup
+        self.name = name
+        self.retry_seconds = retry_seconds
+
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+
+        self.state = ModelState.NOT_LOADED
+        self.loaded = None
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.ready_since = None
+        self.failed_at = None
+        self.load_attempts = 0
+
+        self._swap_thread = None
+        self.swap_target = None
+        self.swap_error = None
+        self.swaps = 0
+
+    def start_background_load(self):
+        """Inicia la carga en un hilo de fondo si aún no se ha iniciado."""
+        with self._lock:
+            if self.state != ModelState.NOT_LOADED:
+                return False
+            self.state = ModelState.LOADING
+            self.load_attempts += 1
+            self._done.clear()
+            self._thread = threading.Thread(target=self._load, name=f'{self.name}-loader', daemon=True)
+            self._thread.start()
+            return True
+
+    def install(self, loaded, warmup=True):
+        """
+        Marca como listo un modelo cargado fuera del ciclo de vida (por ejemplo, heredado
+        del proceso padre tras un fork), ejecutando opcionalmente el warm-up en este proceso.
+        """
+        with self._lock:
+            self.state = ModelState.WARMING_UP if warmup and self._warmup is not None else ModelState.LOADING
+        try:
+            if warmup and self._warmup is not None:
+                started_at = time.monotonic()
+                self._warmup(loaded)
+                self.warmup_seconds = round(time.monotonic() - started_at, 3)
+            self.loaded = loaded
+            self.error = None
+            self.ready_since = time.time()
+            self.state = ModelState.READY
+        except Exception as e:
+            self.error = str(e)
+            self.failed_at = time.monotonic()
+            self.state = ModelState.FAILED
+            raise
+        finally:
+            self._done.set()
+
+    def _retry_due(self):
+        return (
+            self.retry_seconds is not None
+            and self.failed_at is not None
+            and time.monotonic() - self.failed_at >= self.retry_seconds
+        )
+
+    def reload(self, force=False):
+        """
+        Reintenta la carga después de un fallo. Sin `force` solo lo hace si ya pasaron
+        `retry_seconds` desde el fallo, para no relanzar una carga rota en cada solicitud.
+        """
+        with self._lock:
+            if self.state != ModelState.FAILED:
+                return False
+            if not force and not self._retry_due():
+                return False
+            self.state = ModelState.NOT_LOADED
+            self.error = None
+        return self.start_background_load()
+
+    def swap(self, loader, label=None):
+        """
+        Carga con `loader()` una nueva versión en un hilo de fondo y la instala cuando
+        está calentada. Solo hay un intercambio en curso a la vez; si el modelo aún no
+        está listo no hace nada (la carga normal ya tomará la versión nueva).
+        """
+        with self._lock:
+            if self.state != ModelState.READY:
+                return False
+            if self._swap_thread is not None and self._swap_thread.is_alive():
+                return False
+            self.swap_target = label
+            self.swap_error = None
+            self._swap_thread = threading.Thread(
+                target=self._swap, args=(loader, label), name=f'{self.name}-swap', daemon=True
+            )
+            self._swap_thread.start()
+            return True
+
+    def _swap(self, loader, label):
+        try:
+            started_at = time.monotonic()
+            loaded = loader()
+            load_seconds = round(time.monotonic() - started_at, 3)
+            if self._warmup is not None:
+                started_at = time.monotonic()
+                self._warmup(loaded)
+                self.warmup_seconds = round(time.monotonic() - started_at, 3)
+
+            self.loaded = loaded
+            self.load_seconds = load_seconds
+            self.ready_since = time.time()
+            self.swaps += 1
+            print(f"DEBUG: {self.name} cambiado a {label} (carga {load_seconds}s, warm-up {self.warmup_seconds}s).")
+        except Exception as e:
+            # La versión anterior sigue atendiendo.
+            self.swap_error = str(e)
+            print(f"ERROR: No se pudo cambiar {self.name} a {label}. Detalles: {e}")
+        finally:
+            self.swap_target = None
+
+    def ensure_loaded(self, timeout=None):
+        """
+        Devuelve el modelo cargado, iniciando la carga si hace falta y esperando a que termine.
+        Lanza ModelNotReadyError si la carga falló o no terminó dentro de `timeout` segundos.
+        """
+        if self.state == ModelState.READY:
+            return self.loaded
+        if self.state == ModelState.FAILED:
+            self.reload()
+        self.start_background_load()
+        if not self._done.wait(timeout):
+            raise ModelNotReadyError(self.state, f"la carga no terminó en {timeout} segundos")
+        if self.state != ModelState.READY:
+            raise ModelNotReadyError(self.state, self.error)
+        return self.loaded
+
+    def is_ready(self):
+        return self.state == ModelState.READY
+
+    def status(self):
+        return {
+            'model': self.name,
+            'state': self.state,
+            'ready': self.is_ready(),
+            'error': self.error,
+            'load_attempts': self.load_attempts,
+            'retry_in_seconds': self._retry_in_seconds(),
+            'load_seconds': self.load_seconds,
+            'warmup_seconds': self.warmup_seconds,
+            'ready_since': self.ready_since,
+            'version': getattr(self.loaded, 'version', None),
+            'swap_target': self.swap_target,
+            'swap_error': self.swap_error,
+            'swaps': self.swaps,
+        }
+
+    def _retry_in_seconds(self):
+        if self.state != ModelState.FAILED or self.retry_seconds is None or self.failed_at is None:
+            return None
+        return round(max(self.retry_seconds - (time.monotonic() - self.failed_at), 0.0), 1)
+
+    def _load(self):
+        try:
+            started_at = time.monotonic()
+            loaded = self._loader()
+            self.load_seconds = round(time.monotonic() - started_at, 3)
+
+            if self._warmup is not None:
+                self.state = ModelState.WARMING_UP
+                started_at = time.monotonic()
+                self._warmup(loaded)
+                self.warmup_seconds = round(time.monotonic() - started_at, 3)
+
+            self.loaded = loaded
+            self.ready_since = time.time()
+            self.state = ModelState.READY
+            print(f"DEBUG: {self.name} listo (carga {self.load_seconds}s, warm-up {self.warmup_seconds}s).")
+        except Exception as e:
+            self.error = str(e)
+            self.failed_at = time.monotonic()
+            self.state = ModelState.FAILED
+            print(f"ERROR: No se pudo cargar {self.name}. Detalles: {e}")
+        finally:
+            self._done.set()
@@ -0,0 +1,125 @@
+import json
+import os
+import re
+import shutil
+
+from django.conf import settings
+from django.utils import timezone
+
+METADATA_FILE = 'metadata.json'
+ACTIVE_FILE = 'ACTIVE'
+VERSIONS_DIR = 'versions'
+
+_VERSION_PATTERN = re.compile(r'^[A-Za-z0-9._-]+$')
+
+
+class ModelRegistryError(Exception):
+    """Error al registrar, listar o activar versiones del modelo."""
+
+
+def registry_dir():
+    return str(getattr(settings, 'IA_MODEL_REGISTRY_DIR', os.path.join(settings.BASE_DIR, 'model_registry')))
+
+
+def legacy_model_path():
+    """Ruta del modelo sin registro (la que genera finetune_model.py), relativa a BASE_DIR y no al cwd."""
+    return str(getattr(settings, 'IA_MODEL_PATH', os.path.join(settings.BASE_DIR, 'fine_tuned_distilgpt2_model')))
+
+
+def _versions_root():
+    return os.path.join(registry_dir(), VERSIONS_DIR)
+
+
+def _active_file():
+    return os.path.join(registry_dir(), ACTIVE_FILE)
+
+
+def is_valid_version(version):
+    """Nombre utilizable como directorio dentro del registro ('.' y '..' no lo son)."""
+    return bool(version) and bool(_VERSION_PATTERN.match(version)) and version not in ('.', '..')
+
+
+def version_path(version):
+    if not is_valid_version(version):
+        raise ModelRegistryError(f"Nombre de versión no válido: '{version}'")
+    return os.path.join(_versions_root(), version)
+
+
+def read_metadata(version):
+    path = os.path.join(version_path(version), METADATA_FILE)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'version': version}
+
+
+def list_versions():
+    """Versiones registradas con sus metadatos, de la más antigua a la más reciente."""
+    root = _versions_root()
+    if not os.path.isdir(root):
+        return []
+    versions = [read_metadata(name) for name in os.listdir(root) if os.path.isdir(os.path.join(root, name))]
+    return sorted(versions, key=lambda meta: meta.get('registered_at', ''))
+
+
+def get_active_version():
+    try:
+        with open(_active_file(), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def active_marker_mtime():
+    """Fecha de modificación del puntero ACTIVE; sirve para detectar cambios sin leerlo."""
+    try:
+        return os.stat(_active_file()).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def set_active_version(version):
+    """Cambia la versión activa de forma atómica (escritura en temporal + os.replace)."""
+    if not os.path.isdir(version_path(version)):
+        raise ModelRegistryError(f"La versión '{version}' no está registrada")
+    os.makedirs(registry_dir(), exist_ok=True)
+    tmp_path = _active_file() + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(tmp_path, _active_file())
+
+
+def register_version(source_path, version=None, description='', base_model='distilgpt2'):
+    """Copia un directorio de modelo entrenado al registro como una nueva versión inmutable."""
+    if not os.path.isdir(source_path):
+        raise ModelRegistryError(f"No existe el directorio del modelo: {source_path}")
+    version = version or timezone.now().strftime('v%Y%m%d-%H%M%S')
+    target = version_path(version)
+    if os.path.exists(target):
+        raise ModelRegistryError(f"La versión '{version}' ya existe")
+
+    os.makedirs(_versions_root(), exist_ok=True)
+    shutil.copytree(source_path, target, ignore=shutil.ignore_patterns('checkpoint-*', 'runs'))
+    metadata = {
+        'version': version,
+        'registered_at': timezone.now().isoformat(),
+        'source': os.path.abspath(source_path),
+        'base_model': base_model,
+        'description': description,
+    }
+    with open(os.path.join(target, METADATA_FILE), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    return metadata
+
+
+def resolve_active():
+    """
+    Devuelve `(version, ruta)` del modelo a servir: la versión activa del registro o,
+    si no hay ninguna, el directorio del modelo sin registrar.
+    """
+    version = get_active_version()
+    if is_valid_version(version) and os.path.isdir(version_path(version)):
+        return version, version_path(version)
+    path = legacy_model_path()
+    return getattr(settings, 'IA_MODEL_VERSION', None) or os.path.basename(os.path.normpath(path)), path
@@ -1,3 +1,4 @@
+import uuid
 from django.db import models
 
 class FirebaseUser(models.Model):
@@ -13,5 +14,160 @@ class CaregiverPatientLink(models.Model):
     patient = models.ForeignKey(FirebaseUser, on_delete=models.CASCADE, related_name='cuidadores')
     linked_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # Un vínculo por pareja; el índice (caregiver, patient) sirve la autorización
+            # de lectura de notas y la lista de pacientes de un cuidador.
+            models.UniqueConstraint(fields=['caregiver', 'patient'], name='api_link_caregiver_patient_uniq'),
+        ]
+
     def __str__(self):
         return f"{self.caregiver.email} cuida a {self.patient.email}"
+
+class AnalysisCacheEntry(models.Model):
+    """Nivel persistente de la caché de análisis de IA (api/analysis_cache.py)."""
+    key = models.CharField(max_length=64, unique=True)
+    model_version = models.CharField(max_length=100, db_index=True)
+    result = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    last_accessed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    hits = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key[:12]}… ({self.model_version})"
+
+class AnalysisJob(models.Model):
+    """Trabajo de análisis de IA encolado por la API asíncrona (api/analysis_jobs.py)."""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pendiente'),
+        (STATUS_RUNNING, 'En proceso'),
+        (STATUS_DONE, 'Completado'),
+        (STATUS_FAILED, 'Fallido'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    note = models.TextField()
+    result = models.TextField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    # Versión del modelo (api/model_registry.py) que generó `result`.
+    model_version = models.CharField(max_length=100, blank=True, default='')
+    # Si se indican, el resultado se escribe directamente en users/{patient_uid}/notes/{note_id}.
+    patient_uid = models.CharField(max_length=100, blank=True, default='')
+    note_id = models.CharField(max_length=200, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['patient_uid', 'note_id', 'status'], name='api_job_patient_note_idx'),
+        ]
+        constraints = [
+            # Un solo trabajo pendiente o en curso por nota de Firestore (api/analysis_jobs.py:submit_job).
+            models.UniqueConstraint(
+                fields=['patient_uid', 'note_id'],
+                condition=models.Q(status__in=['pending', 'running']) & ~models.Q(patient_uid='') & ~models.Q(note_id=''),
+                name='api_job_active_note_uniq',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} ({self.status})"
+
+class DiscoveryCursor(models.Model):
+    """
+    Posición persistida del descubrimiento incremental de notas (api/note_discovery.py):
+    el último `createdAt` procesado y la ruta de esa nota para desempatar.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    created_at_watermark = models.CharField(max_length=64, blank=True, default='')
+    last_note_path = models.CharField(max_length=300, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.created_at_watermark or 'inicio'}"
+
+class NoteLease(models.Model):
+    """
+    Lease de análisis de una nota (api/leases.py). Solo quien tiene el lease vigente la
+    analiza; si su proceso muere, el lease expira y otro lo reclama. Al guardar el
+    análisis se marca `completed_at` para que ninguna copia atrasada la repita.
+
+    Un lease expirado sin completar (análisis o escritura fallidos, o dueño caído) marca
+    una nota que el barrido vuelve a intentar, hasta IA_NOTE_MAX_ATTEMPTS veces.
+    """
+    note_path = models.CharField(max_length=300, unique=True)
+    owner = models.CharField(max_length=200)
+    acquired_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+    completed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Veces que se obtuvo el lease, es decir, intentos de análisis de la nota.
+    attempts = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.note_path} ({self.owner})"
+
+class AnalysisRun(models.Model):
+    """Estadísticas de una ejecución del barrido de análisis (api/analysis_metrics.py)."""
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_ABANDONED = 'abandoned'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'En curso'),
+        (STATUS_DONE, 'Completada'),
+        (STATUS_FAILED, 'Fallida'),
+        (STATUS_ABANDONED, 'Abandonada'),
+    ]
+
+    started_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    worker = models.CharField(max_length=200, blank=True, default='')
+    # Notas recorridas por el descubrimiento y su destino.
+    scanned = models.PositiveIntegerField(default=0)
+    queued = models.PositiveIntegerField(default=0)
+    already_analyzed = models.PositiveIntegerField(default=0)
+    empty = models.PositiveIntegerField(default=0)
+    analyzed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    written = models.PositiveIntegerField(default=0)
+    write_errors = models.PositiveIntegerField(default=0)
+    # True si se alcanzó IA_DISCOVERY_MAX_NOTES_PER_RUN: quedan notas para la siguiente.
+    hit_limit = models.BooleanField(default=False)
+    # Duración total y tiempo acumulado por fase (las de análisis y escritura suman hilos).
+    duration_seconds = models.FloatField(null=True, blank=True)
+    fetch_seconds = models.FloatField(default=0)
+    analysis_seconds = models.FloatField(default=0)
+    write_seconds = models.FloatField(default=0)
+    latency_histogram = models.JSONField(default=dict, blank=True)
+    error_classes = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return f"Run {self.pk} ({self.status}, {self.analyzed} analizadas)"
+
+class PatientNotesSummary(models.Model):
+    """
+    Resumen de las notas de un paciente (api/note_summary.py) con el que se calculan el
+    ETag y el Last-Modified de sus listados sin leer la colección de notas. `version`
+    sube con cada cambio observado; `dirty` pide recalcular el resumen en la siguiente lectura.
+    """
+    patient_uid = models.CharField(max_length=100, unique=True)
+    note_count = models.PositiveIntegerField(default=0)
+    newest_created_at = models.CharField(max_length=64, blank=True, default='')
+    # update_time más reciente de las notas: cambia también al editar una nota antigua.
+    max_update_time = models.DateTimeField(null=True, blank=True)
+    last_modified = models.DateTimeField(null=True, blank=True)
+    version = models.PositiveBigIntegerField(default=0)
+    dirty = models.BooleanField(default=True)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.patient_uid} v{self.version} ({self.note_count} notas)"
@@ -0,0 +1,146 @@
+import logging
+import time
+
+from django.conf import settings
+
+from .models import DiscoveryCursor
+from .note_pages import decode_created_at, encode_created_at
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_CURSOR = 'analysis_scheduler'
+
+
+def patient_uid_of(note_snapshot):
+    """UID del paciente dueño de una nota `users/{uid}/notes/{id}`."""
+    return note_snapshot.reference.parent.parent.id
+
+
+def _is_patient_note(note_snapshot):
+    # La consulta collection group devuelve cualquier subcolección llamada 'notes'.
+    owner = note_snapshot.reference.parent.parent
+    return owner is not None and owner.parent.id == 'users'
+
+
+def _page_query(db, cursor, limit):
+    """
+    Notas de todos los usuarios ordenadas por (createdAt, ruta del documento), a partir
+    de la posición guardada. La ruta desempata notas creadas en el mismo instante.
+    """
+    from google.cloud.firestore_v1.field_path import FieldPath
+
+    query = (
+        db.collection_group('notes')
+        .order_by('createdAt')
+        .order_by(FieldPath.document_id())
+        .limit(limit)
+    )
+    watermark = decode_created_at(cursor.created_at_watermark)
+    if watermark is not None and cursor.last_note_path:
+        query = query.start_after({
+            'createdAt': watermark,
+            FieldPath.document_id(): db.document(cursor.last_note_path),
+        })
+    elif watermark is not None:
+        query = query.start_after({'createdAt': watermark})
+    return query
+
+
+def _save(cursor, before_save):
+    if before_save is not None:
+        before_save()
+    cursor.save()
+
+
+def discover_new_notes(db, handle_note, page_size=None, max_notes=None, cursor_name=SCHEDULER_CURSOR,
+                       before_save=None):
+    """
+    Recorre las notas creadas después de la última posición guardada y llama a
+    `handle_note(snapshot)` para cada una, en orden de `createdAt`.
+
+    `handle_note` devuelve True si la nota quedó atendida (encolada, ya analizada o
+    descartable) y False si debe reintentarse: en ese caso la ejecución se detiene y
+    la posición no avanza más allá de la última nota atendida, así que la próxima
+    ejecución empieza por ella. La posición se guarda al final de cada página, después
+    de llamar a `before_save()` (p. ej. para esperar a que el pipeline termine esas notas).
+    Una nota encolada cuyo análisis falla después queda atrás de la posición: de esas
+    se encarga `retry_failed_notes`.
+
+    Las notas sin `createdAt` no aparecen en la consulta ordenada (ver
+    `manage.py backfill_note_created_at`). La posición conserva el tipo de `createdAt`
+    (cadena ISO 8601 de la app o Timestamp, ver `note_pages.encode_created_at`): Firestore
+    ordena todos los Timestamp antes que todas las cadenas.
+
+    Devuelve un dict con las notas atendidas (`handled`) y recorridas (`scanned`), las
+    páginas leídas, el tiempo de las consultas (`fetch_seconds`) y si se alcanzó
+    `max_notes` (`hit_limit`, quedan notas para la siguiente ejecución).
+    """
+    page_size = page_size or getattr(settings, 'IA_DISCOVERY_PAGE_SIZE', 200)
+    max_notes = max_notes or getattr(settings, 'IA_DISCOVERY_MAX_NOTES_PER_RUN', 2000)
+    cursor, _ = DiscoveryCursor.objects.get_or_create(name=cursor_name)
+
+    result = {'handled': 0, 'scanned': 0, 'pages': 0, 'fetch_seconds': 0.0, 'hit_limit': False}
+    handled = 0
+    while handled < max_notes:
+        limit = min(page_size, max_notes - handled)
+        started_at = time.monotonic()
+        page = list(_page_query(db, cursor, limit).stream())
+        result['fetch_seconds'] += time.monotonic() - started_at
+        result['pages'] += 1
+        result['scanned'] += len(page)
+
+        for snapshot in page:
+            if _is_patient_note(snapshot) and not handle_note(snapshot):
+                _save(cursor, before_save)
+                logger.info(f"NoteDiscovery: Detenido en {snapshot.reference.path}; se reintentará en la próxima ejecución.")
+                result['handled'] = handled
+                return result
+            cursor.created_at_watermark = encode_created_at(snapshot.get('createdAt'))
+            cursor.last_note_path = snapshot.reference.path
+            handled += 1
+
+        if page:
+            _save(cursor, before_save)
+        if len(page) < limit:
+            break
+    else:
+        result['hit_limit'] = True
+
+    result['handled'] = handled
+    return result
+
+
+def retry_failed_notes(db, handle_note, limit=None, max_attempts=None):
+    """
+    Vuelve a entregar a `handle_note` las notas que el descubrimiento ya dejó atrás sin
+    que se guardara su análisis: el análisis o la escritura fallaron, o murió el proceso
+    que tenía su lease (api/leases.py). Como la posición del descubrimiento no retrocede,
+    este es su único camino de vuelta; tras IA_NOTE_MAX_ATTEMPTS intentos se abandonan.
+
+    Las notas borradas, vacías o analizadas por otra vía dejan de reintentarse. Devuelve
+    cuántas notas se reintentaron (`retried`) y cuántas se descartaron (`resolved`).
+    """
+    from .leases import failed_note_paths, forget_leases
+
+    limit = limit or getattr(settings, 'IA_NOTE_RETRY_BATCH_SIZE', 200)
+    max_attempts = max_attempts or getattr(settings, 'IA_NOTE_MAX_ATTEMPTS', 5)
+    result = {'retried': 0, 'resolved': 0}
+    paths = failed_note_paths(limit=limit, max_attempts=max_attempts)
+    if not paths:
+        return result
+
+    resolved = []
+    for snapshot in db.get_all([db.document(path) for path in paths]):
+        data = snapshot.to_dict() if snapshot.exists else None
+        if not data or 'analisis_IA' in data or not data.get('content'):
+            resolved.append(snapshot.reference.path)
+            continue
+        handle_note(snapshot)
+        result['retried'] += 1
+
+    if resolved:
+        forget_leases(resolved)
+    result['resolved'] = len(resolved)
+    if result['retried']:
+        logger.info(f"NoteDiscovery: {result['retried']} notas fallidas o abandonadas se vuelven a analizar.")
+    return result
@@ -0,0 +1,283 @@
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .analysis_cache import LRUCache
+from .models import DiscoveryCursor
+from .note_discovery import SCHEDULER_CURSOR, patient_uid_of
+from .note_pages import decode_created_at, encode_created_at, format_created_at
+from .note_summary import touch_patients
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def _kind(created_at):
+    """Tipo de `createdAt` con posición propia en el listener, o None si no se sigue."""
+    if isinstance(created_at, datetime):
+        return 'timestamp'
+    return 'string' if isinstance(created_at, str) else None
+
+
+class NoteListener:
+    """
+    Escucha en tiempo real (on_snapshot) las notas de la collection group 'notes' y entrega
+    al pipeline de análisis las que aún no tienen `analisis_IA`, en cuanto se crean.
+
+    La suscripción se limita a las notas con `createdAt` igual o posterior a la última
+    posición conocida (la del barrido periódico o la mayor vista por el listener): el
+    primer snapshot de cada suscripción funciona así como barrido de recuperación de lo
+    ocurrido mientras no se escuchaba. Como un filtro de rango de Firestore solo devuelve
+    valores del mismo tipo, hay una posición y una consulta por tipo de `createdAt`
+    (cadena ISO 8601 de la app o Timestamp). Un hilo supervisor comprueba la suscripción cada
+    `check_seconds` y, si se cerró por un error, vuelve a suscribirse con espera exponencial.
+
+    El callback del stream solo filtra las notas y las deja en una cola de entrega
+    (`delivery_queue_size`); un hilo propio resuelve la prioridad de sus pacientes en
+    bloque (lecturas de la Realtime DB) y las ofrece al pipeline. Ninguno de los dos
+    bloquea: si la cola de entrega o el pipeline están llenos la nota se deja para el
+    barrido periódico, que sigue ejecutándose como respaldo.
+    """
+
+    def __init__(self, db, pipeline, check_seconds=30, max_backoff_seconds=300, cursor_name=SCHEDULER_CURSOR,
+                 delivery_queue_size=1000, delivery_batch_size=100):
+        self._db = db
+        self._pipeline = pipeline
+        self.check_seconds = check_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.cursor_name = cursor_name
+        self.delivery_batch_size = max(delivery_batch_size, 1)
+
+        self._watches = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._deliveries = queue.Queue(maxsize=delivery_queue_size)
+        self._delivery_thread = None
+        self._lock = threading.Lock()
+        # Notas ya entregadas: evita reenviarlas por eventos MODIFIED o por la recuperación.
+        self._seen = LRUCache(max_entries=20000, ttl_seconds=3600)
+
+        # Posición por tipo de `createdAt` ('string' / 'timestamp').
+        self.watermarks = {}
+        self.subscriptions = 0
+        self.reconnects = 0
+        self.snapshots = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.last_event_at = None
+        self.last_error = None
+
+    def start(self):
+        self._delivery_thread = threading.Thread(target=self._deliver_loop, name='note-listener-delivery', daemon=True)
+        self._delivery_thread.start()
+        self._thread = threading.Thread(target=self._supervise, name='note-listener', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Cancela la suscripción y termina las notas ya entregadas al pipeline."""
+        self._stop.set()
+        self._unsubscribe()
+        if self._delivery_thread is not None:
+            self._deliveries.put(_STOP)
+            self._delivery_thread.join()
+        self._pipeline.close()
+
+    def is_listening(self):
+        watches = self._watches
+        return bool(watches) and all(getattr(watch, 'is_active', True) for watch in watches)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'listening': self.is_listening(),
+                'watermarks': {kind: encode_created_at(value) for kind, value in self.watermarks.items()},
+                'subscriptions': self.subscriptions,
+                'reconnects': self.reconnects,
+                'snapshots': self.snapshots,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'pending_delivery': self._deliveries.qsize(),
+                'last_event_at': self.last_event_at,
+                'last_error': self.last_error,
+                'pipeline': self._pipeline.stats(),
+            }
+
+    def _starting_watermarks(self):
+        stored = decode_created_at(
+            DiscoveryCursor.objects.filter(name=self.cursor_name)
+            .values_list('created_at_watermark', flat=True)
+            .first()
+        )
+        close_old_connections()
+        # Sin posición previa de un tipo el listener empieza en "ahora"; el histórico lo recorre el barrido.
+        now = datetime.now(timezone.utc)
+        watermarks = {}
+        for kind, default in (('string', format_created_at(now)), ('timestamp', now)):
+            known = [value for value in (stored, self.watermarks.get(kind)) if _kind(value) == kind]
+            watermarks[kind] = max(known) if known else default
+        return watermarks
+
+    def _subscribe(self):
+        from google.cloud.firestore_v1.base_query import FieldFilter
+
+        self.watermarks = self._starting_watermarks()
+        try:
+            for watermark in self.watermarks.values():
+                query = self._db.collection_group('notes').where(filter=FieldFilter('createdAt', '>=', watermark))
+                self._watches.append(query.on_snapshot(self._on_snapshot))
+        except Exception:
+            self._unsubscribe()
+            raise
+        with self._lock:
+            self.subscriptions += 1
+        logger.info(f"NoteListener: Suscrito a las notas desde {self.watermarks['string']} / {self.watermarks['timestamp']}.")
+
+    def _unsubscribe(self):
+        watches, self._watches = self._watches, []
+        for watch in watches:
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                logger.warning(f"NoteListener: Error al cerrar la suscripción: {e}")
+
+    def _supervise(self):
+        backoff = 1
+        while not self._stop.is_set():
+            if not self.is_listening():
+                if self._watches:
+                    with self._lock:
+                        self.reconnects += 1
+                    self._unsubscribe()
+                try:
+                    self._subscribe()
+                    backoff = 1
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error(f"NoteListener: No se pudo suscribir; reintento en {backoff}s. Detalles: {e}")
+                    self._stop.wait(backoff)
+                    backoff = min(backoff * 2, self.max_backoff_seconds)
+                    continue
+            self._stop.wait(self.check_seconds)
+
+    def _on_snapshot(self, snapshots, changes, read_time):
+        with self._lock:
+            self.snapshots += 1
+            self.last_event_at = time.time()
+        changed_patients = set()
+        for change in changes:
+            owner = change.document.reference.parent.parent
+            if owner is not None and owner.parent.id == 'users':
+                changed_patients.add(owner.id)
+            if change.type.name not in ('ADDED', 'MODIFIED'):
+                continue
+            try:
+                self._handle(change.document)
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"NoteListener: Error al procesar {change.document.reference.path}: {e}")
+        # Cualquier alta, cambio o borrado invalida el ETag de las notas del paciente.
+        touch_patients(changed_patients)
+        close_old_connections()
+
+    def _handle(self, note_snapshot):
+        owner = note_snapshot.reference.parent.parent
+        if owner is None or owner.parent.id != 'users':
+            return
+        data = note_snapshot.to_dict() or {}
+        created_at = data.get('createdAt')
+        kind = _kind(created_at)
+        if kind is not None:
+            watermark = self.watermarks.get(kind)
+            if watermark is None or created_at > watermark:
+                self.watermarks[kind] = created_at
+
+        path = note_snapshot.reference.path
+        content = data.get('content')
+        if 'analisis_IA' in data or not content or self._seen.get(path):
+            return
+
+        try:
+            self._deliveries.put_nowait((path, patient_uid_of(note_snapshot), note_snapshot.id, content, created_at))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return
+        self._seen.set(path, True)
+
+    def _deliver_loop(self):
+        while True:
+            batch = [self._deliveries.get()]
+            while len(batch) < self.delivery_batch_size:
+                try:
+                    batch.append(self._deliveries.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = _STOP in batch
+            notes = [note for note in batch if note is not _STOP]
+            if notes:
+                try:
+                    self._deliver(notes)
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error(f"NoteListener: Error al entregar {len(notes)} notas al pipeline: {e}")
+            if stopping:
+                return
+
+    def _deliver(self, notes):
+        priorities = self._pipeline.priorities_of({patient_uid for _, patient_uid, _, _, _ in notes})
+        for path, patient_uid, note_id, content, created_at in notes:
+            if self._pipeline.offer(patient_uid, note_id, content, created_at=created_at,
+                                    priority=priorities.get(patient_uid)):
+                with self._lock:
+                    self.delivered += 1
+            else:
+                # Puede volver a entregarse en otro evento; si no, la recoge el barrido.
+                self._seen.set(path, False)
+                with self._lock:
+                    self.dropped += 1
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def start_listener(analysis_workers=None):
+    """
+    Arranca (una vez por proceso) el listener con su propio pipeline de larga duración;
+    `analysis_workers` sustituye a IA_PIPELINE_ANALYSIS_WORKERS.
+    """
+    global _listener
+    from firebase_config import db
+
+    from .analysis_pipeline import AnalysisPipeline
+    from .ia_logic import analyze_note
+
+    with _listener_lock:
+        if _listener is None:
+            pipeline = AnalysisPipeline.from_settings(db, analyze_note, analysis_workers=analysis_workers).start()
+            _listener = NoteListener(
+                db,
+                pipeline,
+                check_seconds=getattr(settings, 'IA_NOTE_LISTENER_CHECK_SECONDS', 30),
+                max_backoff_seconds=getattr(settings, 'IA_NOTE_LISTENER_MAX_BACKOFF_SECONDS', 300),
+            ).start()
+    return _listener
+
+
+def stop_listener():
+    global _listener
+    with _listener_lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def get_listener():
+    return _listener
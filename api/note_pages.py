@@ -0,0 +1,333 @@
+import asyncio
+import base64
+import heapq
+import itertools
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+# Campos que necesitan las vistas de lista; excluyen el texto completo del análisis.
+NOTE_SUMMARY_FIELDS = ('content', 'createdAt', 'analizadoEn', 'analisis_IA_version')
+MAX_PROJECTION_FIELDS = 20
+_FIELD_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+# str() de un Timestamp de Firestore, como se guardaban antes las posiciones.
+_STR_TIMESTAMP = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(\.\d+)?\+00:00$')
+
+
+class InvalidPageRequest(ValueError):
+    """Parámetros de paginación o proyección no válidos (se responde 400)."""
+
+
+def page_size_from(value, default=None):
+    """Tamaño de página pedido por el cliente, acotado a IA_NOTES_MAX_PAGE_SIZE."""
+    default = default or getattr(settings, 'IA_NOTES_PAGE_SIZE', 50)
+    maximum = getattr(settings, 'IA_NOTES_MAX_PAGE_SIZE', 200)
+    if value in (None, ''):
+        return min(default, maximum)
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        raise InvalidPageRequest('El parámetro page_size debe ser un entero')
+    if size < 1:
+        raise InvalidPageRequest('El parámetro page_size debe ser mayor que 0')
+    return min(size, maximum)
+
+
+def fields_from(value):
+    """
+    Proyección pedida como lista separada por comas (`fields=content,createdAt`);
+    'summary' equivale a NOTE_SUMMARY_FIELDS. None = documento completo.
+    """
+    if not value:
+        return None
+    if value == 'summary':
+        return list(NOTE_SUMMARY_FIELDS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    if len(fields) > MAX_PROJECTION_FIELDS or not all(_FIELD_NAME.match(field) for field in fields):
+        raise InvalidPageRequest('El parámetro fields no es válido')
+    return fields
+
+
+def format_created_at(value):
+    """Instante con el formato ISO 8601 que escribe la app en `createdAt` (UTC, milisegundos)."""
+    value = value.astimezone(timezone.utc)
+    return value.strftime('%Y-%m-%dT%H:%M:%S.') + f'{value.microsecond // 1000:03d}Z'
+
+
+def _cursor_value(created_at):
+    # Los Timestamp de Firestore llegan como DatetimeWithNanoseconds (no serializable en
+    # JSON): se guardan aparte para restaurar el tipo, que Firestore ordena antes que las cadenas.
+    if isinstance(created_at, datetime):
+        return {'ts': created_at.isoformat()}
+    return created_at
+
+
+def _created_at_from(value):
+    if isinstance(value, dict):
+        try:
+            return datetime.fromisoformat(value['ts'])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidPageRequest('El parámetro cursor no es válido')
+    return value
+
+
+def encode_created_at(created_at):
+    """
+    `createdAt` como texto para guardarlo en base de datos (posición del descubrimiento y
+    del listener, resumen de notas) sin perder su tipo: las cadenas de la app se guardan
+    tal cual y los Timestamp con la misma codificación que los cursores de página.
+    """
+    if created_at is None:
+        return ''
+    value = _cursor_value(created_at)
+    return json.dumps(value, separators=(',', ':')) if isinstance(value, dict) else str(value)
+
+
+def decode_created_at(text):
+    """Inversa de `encode_created_at`: el valor con el que comparar o consultar Firestore (None si no hay)."""
+    if not text:
+        return None
+    if text.startswith('{'):
+        try:
+            return _created_at_from(json.loads(text))
+        except (ValueError, InvalidPageRequest):
+            return text
+    if _STR_TIMESTAMP.match(text):
+        return datetime.fromisoformat(text)
+    return text
+
+
+def sort_key(created_at):
+    """Clave de `createdAt` con el orden de Firestore: sin valor, Timestamp y después cadenas."""
+    if created_at is None:
+        return (0, '')
+    if isinstance(created_at, datetime):
+        return (1, created_at.astimezone(timezone.utc).isoformat())
+    return (2, str(created_at))
+
+
+def encode_cursor(created_at, note_id):
+    raw = json.dumps([_cursor_value(created_at), note_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode(token):
+    try:
+        return json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise InvalidPageRequest('El parámetro cursor no es válido')
+
+
+def decode_cursor(token):
+    try:
+        created_at, note_id = _decode(token)
+    except (ValueError, TypeError):
+        raise InvalidPageRequest('El parámetro cursor no es válido')
+    if not isinstance(note_id, str) or not note_id:
+        raise InvalidPageRequest('El parámetro cursor no es válido')
+    return _created_at_from(created_at), note_id
+
+
+def _page_query(db, patient_uid, page_size, cursor, fields):
+    from google.cloud import firestore
+    from google.cloud.firestore_v1.field_path import FieldPath
+
+    notes_ref = db.collection('users').document(patient_uid).collection('notes')
+    query = (
+        notes_ref.order_by('createdAt', direction=firestore.Query.DESCENDING)
+        .order_by(FieldPath.document_id(), direction=firestore.Query.DESCENDING)
+        .limit(page_size + 1)
+    )
+    if fields:
+        # createdAt siempre se proyecta: hace falta para el cursor.
+        query = query.select(list(dict.fromkeys(list(fields) + ['createdAt'])))
+    if cursor:
+        created_at, note_id = decode_cursor(cursor)
+        query = query.start_after({
+            'createdAt': created_at,
+            FieldPath.document_id(): notes_ref.document(note_id),
+        })
+    return query
+
+
+def _page_from(snapshots, page_size):
+    has_more = len(snapshots) > page_size
+    snapshots = snapshots[:page_size]
+
+    notes = []
+    for doc in snapshots:
+        note_data = doc.to_dict() or {}
+        note_data['note_id'] = doc.id
+        notes.append(note_data)
+
+    next_cursor = None
+    if has_more and snapshots:
+        last = snapshots[-1]
+        next_cursor = encode_cursor(last.get('createdAt'), last.id)
+    return notes, next_cursor
+
+
+def fetch_notes_page(db, patient_uid, page_size, cursor=None, fields=None):
+    """
+    Una página de notas de `users/{patient_uid}/notes`, de la más reciente a la más
+    antigua, ordenadas por (createdAt, id) para que el cursor sea estable aunque dos
+    notas compartan instante. Se pide una nota de más para saber si hay otra página.
+    `db` es el cliente síncrono de Firestore (vistas síncronas, despliegue WSGI).
+
+    `fields` proyecta los documentos en el servidor de Firestore (solo viajan esos
+    campos). Devuelve `(notas, next_cursor)`; `next_cursor` es None en la última página.
+    Las notas sin `createdAt` no aparecen en la consulta ordenada: `backfill_created_at`
+    (`manage.py backfill_note_created_at`) se lo asigna a las notas antiguas.
+    """
+    snapshots = list(_page_query(db, patient_uid, page_size, cursor, fields).stream())
+    return _page_from(snapshots, page_size)
+
+
+async def afetch_notes_page(db, patient_uid, page_size, cursor=None, fields=None):
+    """Como `fetch_notes_page`, con el AsyncClient de Firestore (firebase_config.get_async_db)."""
+    snapshots = [doc async for doc in _page_query(db, patient_uid, page_size, cursor, fields).stream()]
+    return _page_from(snapshots, page_size)
+
+
+_fetch_executor = None
+_fetch_executor_lock = threading.Lock()
+
+
+def _get_fetch_executor():
+    """Pool compartido del proceso: acota las lecturas de Firestore simultáneas de todas las solicitudes."""
+    global _fetch_executor
+    if _fetch_executor is None:
+        with _fetch_executor_lock:
+            if _fetch_executor is None:
+                _fetch_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'IA_BATCH_NOTES_CONCURRENCY', 8),
+                    thread_name_prefix='notes-fetch',
+                )
+    return _fetch_executor
+
+
+def encode_merged_cursor(positions):
+    raw = json.dumps(positions, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_merged_cursor(token, patient_uids):
+    positions = _decode(token)
+    if not isinstance(positions, dict) or not set(positions) <= set(patient_uids):
+        raise InvalidPageRequest('El parámetro cursor no es válido')
+    return positions
+
+
+def _merged_positions(cursor, patient_uids):
+    positions = decode_merged_cursor(cursor, patient_uids) if cursor else {}
+    return positions, [uid for uid in patient_uids if positions.get(uid) is not False]
+
+
+def _merge_pages(patient_uids, positions, pending, pages, page_size):
+    def stream(uid):
+        for note in pages[uid][0]:
+            note['patient_uid'] = uid
+            yield (sort_key(note.get('createdAt')), note['note_id'], uid), note
+
+    merged = heapq.merge(*(stream(uid) for uid in pending), key=lambda entry: entry[0], reverse=True)
+    notes = [note for _, note in itertools.islice(merged, page_size)]
+
+    taken = {}
+    for note in notes:
+        taken[note['patient_uid']] = taken.get(note['patient_uid'], 0) + 1
+
+    next_positions = dict(positions)
+    for uid in pending:
+        uid_notes, uid_next = pages[uid]
+        count = taken.get(uid, 0)
+        if count < len(uid_notes):
+            if count:
+                last = uid_notes[count - 1]
+                next_positions[uid] = encode_cursor(last.get('createdAt'), last['note_id'])
+        elif uid_next is None:
+            next_positions[uid] = False
+        else:
+            next_positions[uid] = uid_next
+
+    has_more = any(next_positions.get(uid) is not False for uid in patient_uids)
+    return notes, encode_merged_cursor(next_positions) if has_more else None
+
+
+def fetch_merged_notes_page(db, patient_uids, page_size, cursor=None, fields=None):
+    """
+    Una página de notas de varios pacientes mezcladas de la más reciente a la más antigua.
+
+    Se pide en paralelo (hasta IA_BATCH_NOTES_CONCURRENCY lecturas a la vez en el pool del
+    proceso) una página de cada paciente y se mezclan con heapq.merge; solo las `page_size`
+    primeras forman la página. El cursor guarda la posición de cada paciente (el cursor
+    de su última nota devuelta, o False si ya no le quedan notas), así que cada paciente
+    continúa después exactamente donde se quedó. Cada nota incluye `patient_uid`.
+
+    Devuelve `(notas, next_cursor)`; `next_cursor` es None en la última página.
+    """
+    positions, pending = _merged_positions(cursor, patient_uids)
+    executor = _get_fetch_executor()
+    futures = {
+        uid: executor.submit(fetch_notes_page, db, uid, page_size, positions.get(uid), fields)
+        for uid in pending
+    }
+    pages = {uid: future.result() for uid, future in futures.items()}
+    return _merge_pages(patient_uids, positions, pending, pages, page_size)
+
+
+async def afetch_merged_notes_page(db, patient_uids, page_size, cursor=None, fields=None):
+    """
+    Como `fetch_merged_notes_page`, con el AsyncClient: las páginas de todos los pacientes
+    se piden a la vez, con como mucho IA_BATCH_NOTES_CONCURRENCY consultas en vuelo por
+    solicitud.
+    """
+    positions, pending = _merged_positions(cursor, patient_uids)
+    limit = asyncio.Semaphore(getattr(settings, 'IA_BATCH_NOTES_CONCURRENCY', 8))
+
+    async def fetch(uid):
+        async with limit:
+            return await afetch_notes_page(db, uid, page_size, positions.get(uid), fields)
+
+    results = await asyncio.gather(*(fetch(uid) for uid in pending))
+    return _merge_pages(patient_uids, positions, pending, dict(zip(pending, results)), page_size)
+
+
+def backfill_created_at(db, apply=False, batch_size=400):
+    """
+    Asigna `createdAt` a las notas de pacientes que no lo tienen, a partir del instante de
+    creación del documento en Firestore. Sin ese campo la nota no aparece en las listas
+    paginadas, en el descubrimiento del análisis ni en el resumen (ETag) del paciente.
+    Recorre todas las notas (proyectadas a `createdAt`); sin `apply` solo cuenta.
+    """
+    from .note_summary import touch_patients
+
+    report = {'scanned': 0, 'missing': 0, 'updated': 0, 'applied': apply}
+    patients = set()
+    batch, pending = db.batch(), 0
+    for snapshot in db.collection_group('notes').select(['createdAt']).stream():
+        owner = snapshot.reference.parent.parent
+        if owner is None or owner.parent.id != 'users':
+            continue
+        report['scanned'] += 1
+        if (snapshot.to_dict() or {}).get('createdAt') is not None:
+            continue
+        report['missing'] += 1
+        if not apply or snapshot.create_time is None:
+            continue
+        batch.update(snapshot.reference, {'createdAt': format_created_at(snapshot.create_time)})
+        patients.add(owner.id)
+        pending += 1
+        if pending >= batch_size:
+            batch.commit()
+            report['updated'] += pending
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+        report['updated'] += pending
+    touch_patients(patients)
+    report['patients'] = len(patients)
+    return report
@@ -0,0 +1,182 @@
+import hashlib
+import logging
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import PatientNotesSummary
+from .note_pages import decode_created_at, encode_created_at, sort_key
+
+logger = logging.getLogger(__name__)
+
+
+def touch_patients(patient_uids, changed_at=None):
+    """
+    Registra que las notas de estos pacientes cambiaron: sube `version` y marca el
+    resumen para recalcularlo. Lo llaman el listener de notas y la escritura de análisis;
+    un fallo solo se registra, porque el resumen se recalcula igualmente al caducar.
+    """
+    patient_uids = sorted(set(patient_uids))
+    if not patient_uids:
+        return
+    table = connection.ops.quote_name(PatientNotesSummary._meta.db_table)
+    changed_at = changed_at or timezone.now()
+    try:
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {table} (patient_uid, note_count, newest_created_at, last_modified, version, dirty, refreshed_at) "
+                f"VALUES (%s, 0, '', %s, 1, TRUE, NULL) "
+                f"ON CONFLICT (patient_uid) DO UPDATE SET "
+                f"version = {table}.version + 1, dirty = TRUE, "
+                f"last_modified = GREATEST({table}.last_modified, EXCLUDED.last_modified)",
+                [(uid, changed_at) for uid in patient_uids],
+            )
+    except Exception as e:
+        logger.error(f"touch_patients: No se pudo marcar el resumen de {len(patient_uids)} pacientes. Detalles: {e}")
+
+
+def _parse_created_at(value):
+    created_at = decode_created_at(value)
+    if isinstance(created_at, datetime):
+        return created_at
+    try:
+        parsed = datetime.fromisoformat(str(created_at).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, dt_timezone.utc)
+
+
+def _summary_query(db, patient_uid):
+    # Proyección a `createdAt`: cada documento trae además su update_time.
+    return db.collection('users').document(patient_uid).collection('notes').select(['createdAt'])
+
+
+def _refreshed_fields(summary, snapshots, now):
+    created = [(snapshot.to_dict() or {}).get('createdAt') for snapshot in snapshots]
+    newest = max((value for value in created if value is not None), key=sort_key, default=None)
+    newest_created_at = encode_created_at(newest)
+    max_update_time = max((snapshot.update_time for snapshot in snapshots if snapshot.update_time), default=None)
+    note_count = len(snapshots)
+    changed = (
+        note_count != summary.note_count
+        or newest_created_at != summary.newest_created_at
+        or max_update_time != summary.max_update_time
+    )
+    last_modified = summary.last_modified
+    if changed or last_modified is None:
+        candidates = [
+            value for value in (last_modified, _parse_created_at(newest_created_at), max_update_time)
+            if value is not None
+        ]
+        advanced = max(candidates) if candidates else None
+        # Un borrado no avanza el máximo: se usa el instante actual.
+        last_modified = advanced if advanced is not None and advanced != summary.last_modified else now
+    return {
+        'note_count': note_count,
+        'newest_created_at': newest_created_at,
+        'max_update_time': max_update_time,
+        'last_modified': last_modified,
+        'version': F('version') + (1 if changed else 0),
+        'dirty': False,
+        'refreshed_at': now,
+    }
+
+
+def _refresh(db, patient_uid, summary):
+    """
+    Recalcula el resumen con una consulta proyectada a `createdAt`: número de notas, la
+    más reciente y el update_time máximo, que cambia también al editar o analizar una
+    nota antigua aunque este servidor no lo haya observado. Cuesta una lectura por nota,
+    como mucho una vez cada IA_NOTES_SUMMARY_MAX_AGE_SECONDS por paciente. La actualización
+    es condicional a la `version` leída: si otro proceso marcó cambios mientras tanto, el
+    resumen sigue sucio.
+    """
+    snapshots = list(_summary_query(db, patient_uid).stream())
+
+    if summary is None:
+        summary, _ = PatientNotesSummary.objects.get_or_create(patient_uid=patient_uid)
+    fields = _refreshed_fields(summary, snapshots, timezone.now())
+    PatientNotesSummary.objects.filter(pk=summary.pk, version=summary.version).update(**fields)
+    summary.refresh_from_db()
+    return summary
+
+
+async def _arefresh(db, patient_uid, summary):
+    """Como `_refresh`, con el AsyncClient de Firestore y el ORM asíncrono."""
+    snapshots = [doc async for doc in _summary_query(db, patient_uid).stream()]
+
+    if summary is None:
+        summary, _ = await PatientNotesSummary.objects.aget_or_create(patient_uid=patient_uid)
+    fields = _refreshed_fields(summary, snapshots, timezone.now())
+    await PatientNotesSummary.objects.filter(pk=summary.pk, version=summary.version).aupdate(**fields)
+    await summary.arefresh_from_db()
+    return summary
+
+
+def _needs_refresh(summary):
+    max_age = getattr(settings, 'IA_NOTES_SUMMARY_MAX_AGE_SECONDS', 300)
+    return (
+        summary is None
+        or summary.dirty
+        or summary.refreshed_at is None
+        or (timezone.now() - summary.refreshed_at).total_seconds() > max_age
+    )
+
+
+def get_summary(db, patient_uid):
+    """
+    Resumen vigente de las notas del paciente (`db` es el cliente síncrono de Firestore).
+    Se recalcula si no existe, si está marcado o si tiene más de
+    IA_NOTES_SUMMARY_MAX_AGE_SECONDS (cubre cambios que este servidor no observó, p. ej.
+    con el listener parado).
+    """
+    summary = PatientNotesSummary.objects.filter(patient_uid=patient_uid).first()
+    if _needs_refresh(summary):
+        summary = _refresh(db, patient_uid, summary)
+    return summary
+
+
+async def aget_summary(db, patient_uid):
+    """Como `get_summary`, con el AsyncClient de Firestore (vistas asíncronas)."""
+    summary = await PatientNotesSummary.objects.filter(patient_uid=patient_uid).afirst()
+    if _needs_refresh(summary):
+        summary = await _arefresh(db, patient_uid, summary)
+    return summary
+
+
+def etag_for(token, request):
+    """ETag de una representación: el token de versión más los parámetros de la consulta."""
+    query = '&'.join(sorted(f"{key}={value}" for key, value in request.GET.items()))
+    digest = hashlib.sha1(f"{token}|{query}".encode('utf-8')).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def notes_etag(summary, request):
+    return etag_for(f"{summary.patient_uid}:{summary.version}:{summary.note_count}", request)
+
+
+def not_modified(request, etag, last_modified=None):
+    """
+    Respuesta 304 si If-None-Match / If-Modified-Since coinciden con la versión actual,
+    o None si hay que generar la respuesta completa.
+    """
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None
+    )
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # El cliente puede guardar la respuesta, pero debe revalidarla en cada petición.
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -1,14 +1,122 @@
-import os
+from datetime import datetime
+from functools import partial
 from apscheduler.schedulers.background import BackgroundScheduler
+from django.conf import settings
 from analizar_notas import analizar_y_guardar_analisis_ia
 
+SWEEP_JOB_ID = 'analysis_sweep'
+LINK_RECONCILE_JOB_ID = 'link_reconcile'
+
+_scheduler = None
+_election = None
+
+
+def is_leader():
+    """True si este proceso debe ejecutar el análisis programado (o no hay elección)."""
+    return _election is None or _election.is_leader
+
+
+def get_election():
+    return _election
+
+
+def _run_sweep(analysis_workers=None):
+    # Todos los procesos tienen el job programado, pero solo el líder lo ejecuta.
+    if not is_leader():
+        return
+    analizar_y_guardar_analisis_ia(analysis_workers=analysis_workers)
+
+
+def _run_link_reconciliation():
+    if not is_leader():
+        return
+    from .links import run_scheduled_reconciliation
+    run_scheduled_reconciliation()
+
+
+def _on_elected(listener=True, analysis_workers=None):
+    if _scheduler is not None:
+        # Barrido inmediato al asumir el liderazgo: recoge lo pendiente del líder anterior.
+        _scheduler.modify_job(SWEEP_JOB_ID, next_run_time=datetime.now())
+    if listener:
+        from .note_listener import start_listener
+        start_listener(analysis_workers=analysis_workers)
+        print("👂 Listener de notas iniciado: las notas nuevas se analizan al crearse.")
+
+
+def _on_demoted():
+    from .note_listener import stop_listener
+    stop_listener()
+
 
 def start():
-    # Evita que se ejecute dos veces por el auto-reload de Django runserver
-    if os.environ.get('RUN_MAIN') != 'true':
+    """
+    Arranque automático desde ApiConfig.ready(); el tier web puede desactivarlo con
+    IA_SCHEDULER_ENABLED. Arranca solo en procesos servidor (`apps.is_server_process`:
+    cada worker de gunicorn, uvicorn, daphne o hypercorn, el hijo de runserver o
+    IA_SERVER_PROCESS=1), no en comandos, tests ni scripts. Con varios workers, la
+    elección de líder decide cuál barre y escucha.
+    """
+    from .apps import is_server_process
+
+    if not getattr(settings, 'IA_SCHEDULER_ENABLED', True) or not is_server_process():
+        return
+    if _scheduler is not None:
         return
+    start_scheduling()
+
+
+def start_scheduling(analysis_workers=None, sweep_minutes=None, listener=None):
+    """
+    Programa el barrido y arranca la elección de líder (y con ella el listener). Los
+    argumentos sustituyen a IA_PIPELINE_ANALYSIS_WORKERS, IA_SWEEPER_INTERVAL_MINUTES e
+    IA_NOTE_LISTENER_ENABLED (los usa run_analysis_worker).
+    """
+    global _scheduler, _election
+
+    if listener is None:
+        listener = getattr(settings, 'IA_NOTE_LISTENER_ENABLED', True)
+    on_elected = partial(_on_elected, listener=listener, analysis_workers=analysis_workers)
+
+    # El barrido periódico queda como respaldo del listener: recoge lo que este no
+    # pudo entregar (pipeline lleno, desconexiones largas) y el histórico inicial.
+    minutes = sweep_minutes or getattr(settings, 'IA_SWEEPER_INTERVAL_MINUTES', 5)
+    _scheduler = BackgroundScheduler()
+    _scheduler.add_job(
+        _run_sweep, 'interval', minutes=minutes, id=SWEEP_JOB_ID, kwargs={'analysis_workers': analysis_workers}
+    )
+    # Réplica de vínculos en Firestore: Postgres autoriza, Firestore solo se repara aquí.
+    reconcile_minutes = getattr(settings, 'IA_LINK_RECONCILE_INTERVAL_MINUTES', 60)
+    if reconcile_minutes:
+        _scheduler.add_job(
+            _run_link_reconciliation, 'interval', minutes=reconcile_minutes, id=LINK_RECONCILE_JOB_ID
+        )
+    _scheduler.start()
+    print(f"⏰ Scheduler iniciado: ejecutando análisis cada {minutes} minutos.")
+
+    if getattr(settings, 'IA_SCHEDULER_LEADER_ELECTION', True):
+        # Con varios procesos o hosts, solo el que tiene el advisory lock barre y escucha.
+        from .leases import LeaderElection
+        _election = LeaderElection(
+            getattr(settings, 'IA_SCHEDULER_LOCK_KEY', 0x50554C53),
+            check_seconds=getattr(settings, 'IA_SCHEDULER_LEADER_CHECK_SECONDS', 10),
+            on_elected=on_elected,
+            on_demoted=_on_demoted,
+        ).start()
+    else:
+        on_elected()
+
 
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(analizar_y_guardar_analisis_ia, 'interval', minutes=5)
-    scheduler.start()
-    print("⏰ Scheduler iniciado: ejecutando análisis cada 5 minutos.")
+def stop_scheduling():
+    """
+    Parada ordenada: espera al barrido en curso, vacía el pipeline del listener y
+    libera el liderazgo para que otro proceso lo tome de inmediato.
+    """
+    global _scheduler, _election
+    if _scheduler is not None:
+        _scheduler.shutdown(wait=True)
+        _scheduler = None
+    if _election is not None:
+        _election.stop()
+        _election = None
+    _on_demoted()
@@ -1,3 +1,1413 @@
-from django.test import TestCase
+import importlib.util
+import threading
+import time
+from datetime import datetime, timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.exceptions import ImproperlyConfigured
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from . import ia_logic, scheduler
+from .analysis_cache import AnalysisCache, LRUCache, make_cache_key, normalize_note
+from .analysis_pipeline import AnalysisPipeline
+from .analysis_priority import (
+    PRIORITY_ALERT, PRIORITY_NORMAL, PRIORITY_PANIC, PatientPriority, PriorityNoteQueue,
+)
+from .apps import is_server_process
+from .inference_batcher import MicroBatcher
+from .inference_server import InferenceClient, parse_address, validate_address
+from .leases import NoteLeases
+from .model_lifecycle import ModelLifecycle, ModelNotReadyError, ModelState
+from .note_discovery import retry_failed_notes
+from .note_listener import NoteListener
+from .note_summary import etag_for, not_modified, notes_etag, set_validators
+from .note_pages import (
+    NOTE_SUMMARY_FIELDS, InvalidPageRequest, afetch_merged_notes_page, backfill_created_at, decode_cursor,
+    decode_created_at, decode_merged_cursor, encode_created_at, encode_cursor, fetch_merged_notes_page, fields_from,
+    page_size_from, sort_key,
+)
+
+
+def _submit_concurrently(batcher, items):
+    """Envía `items` desde un hilo cada uno y devuelve {item: resultado o excepción}."""
+    outcomes = {}
+    start = threading.Barrier(len(items))
+
+    def worker(item):
+        start.wait()
+        try:
+            outcomes[item] = batcher.submit(item, timeout=5)
+        except Exception as e:
+            outcomes[item] = e
+
+    threads = [threading.Thread(target=worker, args=(item,)) for item in items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return outcomes
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def test_concurrent_requests_share_one_batch(self):
+        batches = []
+
+        def process(items):
+            batches.append(list(items))
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(process, max_batch_size=4, max_wait_ms=2000)
+        outcomes = _submit_concurrently(batcher, [1, 2, 3, 4])
+
+        self.assertEqual(outcomes, {1: 2, 2: 4, 3: 6, 4: 8})
+        self.assertEqual(len(batches), 1)
+        self.assertCountEqual(batches[0], [1, 2, 3, 4])
+        stats = batcher.stats()
+        self.assertEqual(stats['batches'], 1)
+        self.assertEqual(stats['batch_size_histogram'], {4: 1})
+
+    def test_batch_never_exceeds_max_size(self):
+        batches = []
+
+        def process(items):
+            batches.append(len(items))
+            return list(items)
+
+        batcher = MicroBatcher(process, max_batch_size=2, max_wait_ms=200)
+        outcomes = _submit_concurrently(batcher, list(range(5)))
+
+        self.assertEqual(outcomes, {item: item for item in range(5)})
+        self.assertEqual(sum(batches), 5)
+        self.assertTrue(all(size <= 2 for size in batches))
+
+    def test_partial_batch_is_flushed_after_max_wait(self):
+        batcher = MicroBatcher(lambda items: [item.upper() for item in items], max_batch_size=8, max_wait_ms=20)
+
+        started_at = time.monotonic()
+        result = batcher.submit('nota', timeout=5)
+
+        self.assertEqual(result, 'NOTA')
+        self.assertLess(time.monotonic() - started_at, 1.0)
+        self.assertEqual(batcher.stats()['batch_size_histogram'], {1: 1})
+
+    def test_batch_error_reaches_every_waiter(self):
+        def process(items):
+            raise ValueError('fallo del modelo')
+
+        batcher = MicroBatcher(process, max_batch_size=3, max_wait_ms=2000)
+        outcomes = _submit_concurrently(batcher, ['a', 'b', 'c'])
+
+        self.assertEqual(set(outcomes), {'a', 'b', 'c'})
+        for error in outcomes.values():
+            self.assertIsInstance(error, ValueError)
+            self.assertEqual(str(error), 'fallo del modelo')
+        self.assertEqual(batcher.stats()['failed_batches'], 1)
+
+    def test_result_count_mismatch_fails_the_whole_batch(self):
+        batcher = MicroBatcher(lambda items: list(items)[:1], max_batch_size=2, max_wait_ms=2000)
+        outcomes = _submit_concurrently(batcher, ['a', 'b'])
+
+        for error in outcomes.values():
+            self.assertIsInstance(error, RuntimeError)
+
+    def test_worker_survives_a_failed_batch(self):
+        calls = []
+
+        def process(items):
+            calls.append(list(items))
+            if len(calls) == 1:
+                raise ValueError('primer lote')
+            return list(items)
+
+        batcher = MicroBatcher(process, max_batch_size=1, max_wait_ms=0)
+        with self.assertRaises(ValueError):
+            batcher.submit('a', timeout=5)
+        self.assertEqual(batcher.submit('b', timeout=5), 'b')
+
+    def test_invalid_batch_size(self):
+        with self.assertRaises(ValueError):
+            MicroBatcher(lambda items: items, max_batch_size=0)
+
+
+class ModelLifecycleTests(SimpleTestCase):
+    def _flaky_loader(self, failures):
+        attempts = []
+
+        def loader():
+            attempts.append(1)
+            if len(attempts) <= failures:
+                raise OSError('pesos no encontrados')
+            return 'modelo'
+
+        return loader, attempts
+
+    def test_failed_load_is_retried_after_retry_seconds(self):
+        loader, attempts = self._flaky_loader(failures=1)
+        lifecycle = ModelLifecycle(loader, retry_seconds=0)
+
+        with self.assertRaises(ModelNotReadyError):
+            lifecycle.ensure_loaded(timeout=5)
+        self.assertEqual(lifecycle.state, ModelState.FAILED)
+
+        self.assertEqual(lifecycle.ensure_loaded(timeout=5), 'modelo')
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(lifecycle.status()['load_attempts'], 2)
+
+    def test_failure_is_not_retried_before_retry_seconds(self):
+        loader, attempts = self._flaky_loader(failures=1)
+        lifecycle = ModelLifecycle(loader, retry_seconds=3600)
+
+        for _ in range(3):
+            with self.assertRaises(ModelNotReadyError):
+                lifecycle.ensure_loaded(timeout=5)
+        self.assertEqual(len(attempts), 1)
+        self.assertGreater(lifecycle.status()['retry_in_seconds'], 0)
+
+        self.assertTrue(lifecycle.reload(force=True))
+        self.assertEqual(lifecycle.ensure_loaded(timeout=5), 'modelo')
+
+
+class ServerProcessTests(SimpleTestCase):
+    def _check(self, argv, run_main=None):
+        environ = {'RUN_MAIN': run_main} if run_main else {}
+        with mock.patch('sys.argv', argv), mock.patch.dict('os.environ', environ, clear=True):
+            return is_server_process()
+
+    def test_servers(self):
+        self.assertTrue(self._check(['/usr/bin/gunicorn', 'core.wsgi']))
+        self.assertTrue(self._check(['/usr/bin/uvicorn', 'core.asgi:application']))
+        self.assertTrue(self._check(['/venv/lib/python3.11/site-packages/uvicorn/__main__.py', 'core.asgi:application']))
+        self.assertTrue(self._check(['/usr/bin/daphne', 'core.asgi:application']))
+        self.assertTrue(self._check(['manage.py', 'runserver', '--noreload']))
+        self.assertTrue(self._check(['manage.py', 'runserver'], run_main='true'))
+
+    def test_management_commands_and_reloader_parent(self):
+        self.assertFalse(self._check(['manage.py', 'migrate']))
+        self.assertFalse(self._check(['manage.py', 'shell']))
+        self.assertFalse(self._check(['./manage.py', 'runserver']))
+
+    def test_other_programs_are_not_servers_unless_declared(self):
+        for argv in (['/usr/bin/pytest'], ['scripts/run_tests.py'], ['celery', 'worker'], ['-c'], ['']):
+            with self.subTest(argv=argv):
+                self.assertFalse(self._check(argv))
+        with override_settings(IA_SERVER_PROCESS=True):
+            self.assertTrue(self._check(['mod_wsgi']))
+
+
+class SchedulerStartTests(SimpleTestCase):
+    @mock.patch('api.scheduler.start_scheduling')
+    def test_starts_in_every_server_worker(self, start_scheduling):
+        # gunicorn/uvicorn no definen RUN_MAIN: basta con que sea un proceso servidor.
+        with mock.patch('sys.argv', ['gunicorn', 'core.wsgi']), mock.patch.dict('os.environ', clear=True):
+            scheduler.start()
+        start_scheduling.assert_called_once_with()
+
+    @mock.patch('api.scheduler.start_scheduling')
+    def test_skips_management_commands_and_reloader_parent(self, start_scheduling):
+        with mock.patch('sys.argv', ['manage.py', 'migrate']):
+            scheduler.start()
+        with mock.patch('sys.argv', ['manage.py', 'runserver']), mock.patch.dict('os.environ', clear=True):
+            scheduler.start()
+        start_scheduling.assert_not_called()
+
+    @mock.patch('api.scheduler.start_scheduling')
+    def test_respects_scheduler_disabled(self, start_scheduling):
+        with override_settings(IA_SCHEDULER_ENABLED=False), mock.patch('sys.argv', ['gunicorn', 'core.wsgi']):
+            scheduler.start()
+        start_scheduling.assert_not_called()
+
+
+class StopSequenceFilterTests(SimpleTestCase):
+    def _stream(self, chunks):
+        stop_filter = ia_logic._StopSequenceFilter()
+        return ''.join(stop_filter.feed(chunk) for chunk in chunks) + stop_filter.flush(), stop_filter
+
+    def test_stops_at_stop_sequence_split_across_chunks(self):
+        text, stop_filter = self._stream(['  Diagnóstico: ansiedad. ', 'No', 'ta', ': otra nota', ' más texto'])
+        self.assertEqual(text, 'Diagnóstico: ansiedad.')
+        self.assertTrue(stop_filter.stopped)
+
+    def test_partial_prefix_that_is_not_the_stop_is_released(self):
+        stop_filter = ia_logic._StopSequenceFilter()
+        self.assertEqual(stop_filter.feed('Tomar agua. No'), 'Tomar agua.')
+        self.assertEqual(stop_filter.feed('che tranquila'), ' Noche tranquila')
+        self.assertEqual(stop_filter.flush(), '')
+
+    def test_matches_extract_response_for_any_chunking(self):
+        generated = '\n  Causa: estrés laboral.\nSugerencias: pausas activas.  \nNota: el paciente...'
+        expected = ia_logic._extract_response(generated)
+        for size in range(1, 12):
+            chunks = [generated[start:start + size] for start in range(0, len(generated), size)]
+            self.assertEqual(self._stream(chunks)[0], expected, f"trozos de {size}")
+
+    def test_without_stop_sequence_flush_returns_the_tail(self):
+        text, stop_filter = self._stream(['Sin parada', ' al final   '])
+        self.assertEqual(text, 'Sin parada al final')
+        self.assertFalse(stop_filter.stopped)
+
+    def test_nothing_is_emitted_after_stopping(self):
+        stop_filter = ia_logic._StopSequenceFilter()
+        stop_filter.feed('Fin. Nota:')
+        self.assertEqual(stop_filter.feed('más'), '')
+        self.assertEqual(stop_filter.flush(), '')
+
+
+class PromptSplitTests(SimpleTestCase):
+    def test_prompt_is_fixed_prefix_plus_note_suffix(self):
+        note = 'Me mareé en el metro.'
+        self.assertEqual(ia_logic._build_prompt(note), ia_logic.PROMPT_PREFIX + ia_logic._build_prompt_suffix(note))
+        self.assertTrue(ia_logic._build_prompt(note).startswith(ia_logic.PROMPT_PREFIX))
+
+    def test_note_only_appears_in_the_suffix(self):
+        note = 'Palpitaciones al subir escaleras'
+        self.assertNotIn(note, ia_logic.PROMPT_PREFIX)
+        suffix = ia_logic._build_prompt_suffix(note)
+        self.assertIn(note, suffix)
+        self.assertTrue(suffix.startswith(ia_logic.STOP_SEQUENCE))
+
+    @skipUnless(importlib.util.find_spec('torch'), 'requiere torch')
+    def test_encoded_batch_reuses_prefix_ids_and_cache(self):
+        import torch
+
+        class FakeEncoding(dict):
+            def to(self, device):
+                return self
+
+        class FakeTokenizer:
+            def __call__(self, texts, return_tensors=None, padding=False):
+                self.texts = list(texts)
+                # Relleno a la izquierda: la segunda nota es más corta.
+                return FakeEncoding(
+                    input_ids=torch.tensor([[7, 8, 9], [0, 8, 9]]),
+                    attention_mask=torch.tensor([[1, 1, 1], [0, 1, 1]]),
+                )
+
+        class FakeCache:
+            def __init__(self):
+                self.repeats = None
+
+            def batch_repeat_interleave(self, repeats):
+                self.repeats = repeats
+
+        tokenizer = FakeTokenizer()
+        prefix_cache = FakeCache()
+        loaded = ia_logic.LoadedModel(
+            tokenizer, None, 'cpu', prefix_ids=torch.tensor([[1, 2]]), prefix_cache=prefix_cache
+        )
+
+        inputs = ia_logic._encode_notes(loaded, ['nota uno', 'dos'])
+
+        self.assertEqual(tokenizer.texts, [ia_logic._build_prompt_suffix('nota uno'), ia_logic._build_prompt_suffix('dos')])
+        self.assertEqual(inputs['input_ids'].tolist(), [[1, 2, 7, 8, 9], [1, 2, 0, 8, 9]])
+        self.assertEqual(inputs['attention_mask'].tolist(), [[1, 1, 1, 1, 1], [1, 1, 0, 1, 1]])
+        # La caché del prefijo se copia por lote: la del modelo no se modifica.
+        self.assertIsNot(inputs['past_key_values'], prefix_cache)
+        self.assertEqual(inputs['past_key_values'].repeats, 2)
+        self.assertIsNone(prefix_cache.repeats)
+
+    @skipUnless(importlib.util.find_spec('torch'), 'requiere torch')
+    def test_without_prefix_cache_full_prompts_are_encoded(self):
+        class FakeTokenizer:
+            def __call__(self, texts, return_tensors=None, padding=False):
+                self.texts = list(texts)
+
+                class Encoding(dict):
+                    def to(self, device):
+                        return self
+
+                return Encoding(input_ids=None)
+
+        tokenizer = FakeTokenizer()
+        loaded = ia_logic.LoadedModel(tokenizer, None, 'cpu')
+        ia_logic._encode_notes(loaded, ['nota'])
+        self.assertEqual(tokenizer.texts, [ia_logic._build_prompt('nota')])
+
+
+class CacheKeyTests(SimpleTestCase):
+    PARAMS = {'max_new_tokens': 500, 'do_sample': False}
+
+    def test_whitespace_and_case_variants_share_a_key(self):
+        key = make_cache_key('Me duele  la cabeza\n', 'v1', self.PARAMS)
+        self.assertEqual(make_cache_key('  me DUELE la\tcabeza', 'v1', self.PARAMS), key)
+        self.assertEqual(normalize_note('  Me DUELE\n la  cabeza '), 'me duele la cabeza')
+
+    def test_different_content_version_or_params_change_the_key(self):
+        key = make_cache_key('Me duele la cabeza', 'v1', self.PARAMS)
+        self.assertNotEqual(make_cache_key('Me duele la espalda', 'v1', self.PARAMS), key)
+        self.assertNotEqual(make_cache_key('Me duele la cabeza', 'v2', self.PARAMS), key)
+        self.assertNotEqual(make_cache_key('Me duele la cabeza', 'v1', {**self.PARAMS, 'do_sample': True}), key)
+
+    def test_param_order_does_not_matter(self):
+        self.assertEqual(
+            make_cache_key('nota', 'v1', {'a': 1, 'b': 2}),
+            make_cache_key('nota', 'v1', {'b': 2, 'a': 1}),
+        )
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(len(cache), 2)
+
+    def test_overwriting_refreshes_recency(self):
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('a', 10)
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 10)
+        self.assertIsNone(cache.get('b'))
+
+    def test_expired_entries_are_dropped(self):
+        cache = LRUCache(max_entries=2, ttl_seconds=60)
+        with mock.patch('api.analysis_cache.time.monotonic', return_value=1000.0):
+            cache.set('a', 1)
+        with mock.patch('api.analysis_cache.time.monotonic', return_value=1030.0):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('api.analysis_cache.time.monotonic', return_value=1061.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+
+class AnalysisCacheTests(SimpleTestCase):
+    def test_invalidate_version_clears_memory_and_deletes_that_version(self):
+        cache = AnalysisCache(memory_max_entries=4)
+        cache.memory.set('k1', 'análisis v1')
+        cache.memory.set('k2', 'análisis v2')
+
+        with mock.patch('api.models.AnalysisCacheEntry.objects') as objects:
+            objects.filter.return_value.delete.return_value = (3, {})
+            deleted = cache.invalidate_version('v1')
+
+        objects.filter.assert_called_once_with(model_version='v1')
+        self.assertEqual(deleted, 3)
+        self.assertEqual(len(cache.memory), 0)
+        self.assertEqual(cache.stats()['db_evictions'], 3)
+
+    def test_invalidate_version_survives_database_errors(self):
+        cache = AnalysisCache()
+        cache.memory.set('k1', 'análisis')
+
+        with mock.patch('api.models.AnalysisCacheEntry.objects') as objects:
+            objects.filter.side_effect = RuntimeError('sin conexión')
+            with self.assertLogs('api.analysis_cache', 'ERROR'):
+                self.assertEqual(cache.invalidate_version('v1'), 0)
+
+        self.assertEqual(len(cache.memory), 0)
+        self.assertEqual(cache.stats()['db_errors'], 1)
+
+    def test_memory_tier_answers_before_the_database(self):
+        cache = AnalysisCache()
+        with mock.patch.object(cache, '_db_get') as db_get, mock.patch.object(cache, '_db_set'):
+            cache.set('k', 'análisis', 'v1')
+            self.assertEqual(cache.get('k'), 'análisis')
+            db_get.assert_not_called()
+
+            db_get.return_value = None
+            self.assertIsNone(cache.get('otra'))
+        self.assertEqual(cache.stats()['memory_hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+
+class AnalysisJobTests(SimpleTestCase):
+    now = datetime(2026, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+    @override_settings(IA_JOB_STALE_SECONDS=600)
+    def test_stale_running_job_is_marked_failed(self):
+        from django.db.models import Q
+
+        from .analysis_jobs import STALE_JOB_ERROR, fail_stale_jobs
+        from .models import AnalysisJob
+
+        with mock.patch('api.analysis_jobs.AnalysisJob.objects') as objects, \
+                mock.patch('api.analysis_jobs.timezone.now', return_value=self.now):
+            objects.filter.return_value.filter.return_value.update.return_value = 1
+            self.assertEqual(fail_stale_jobs(patient_uid='p1', note_id='n1'), 1)
+
+        cutoff = datetime(2026, 1, 1, 11, 50, tzinfo=timezone.utc)
+        objects.filter.assert_called_once_with(
+            Q(status=AnalysisJob.STATUS_PENDING, created_at__lt=cutoff)
+            | Q(status=AnalysisJob.STATUS_RUNNING, started_at__lt=cutoff)
+        )
+        objects.filter.return_value.filter.assert_called_once_with(patient_uid='p1', note_id='n1')
+        objects.filter.return_value.filter.return_value.update.assert_called_once_with(
+            status=AnalysisJob.STATUS_FAILED, error=STALE_JOB_ERROR, finished_at=self.now
+        )
+
+    def test_submit_does_not_dedupe_into_a_stale_job(self):
+        from .analysis_jobs import _run_job, submit_job
+
+        stale = mock.Mock(status='running')
+        created = mock.Mock(id='nuevo')
+
+        def fail_stale(**filters):
+            stale.status = 'failed'
+            return 1
+
+        with mock.patch('api.analysis_jobs.fail_stale_jobs', side_effect=fail_stale) as fail, \
+                mock.patch('api.analysis_jobs.AnalysisJob.objects') as objects, \
+                mock.patch('api.analysis_jobs.transaction'), \
+                mock.patch('api.analysis_jobs._get_pool') as pool:
+            objects.filter.return_value.first.side_effect = lambda: stale if stale.status == 'running' else None
+            objects.create.return_value = created
+            job = submit_job('Nota', patient_uid='p1', note_id='n1')
+
+        fail.assert_called_once_with(patient_uid='p1', note_id='n1')
+        self.assertIs(job, created)
+        pool.return_value.submit.assert_called_once_with(_run_job, 'nuevo')
+
+    def test_concurrent_submit_returns_the_job_that_won(self):
+        from django.db import IntegrityError
+
+        from .analysis_jobs import submit_job
+
+        winner = mock.Mock()
+        with mock.patch('api.analysis_jobs.fail_stale_jobs'), \
+                mock.patch('api.analysis_jobs.AnalysisJob.objects') as objects, \
+                mock.patch('api.analysis_jobs.transaction'), \
+                mock.patch('api.analysis_jobs._get_pool') as pool:
+            objects.filter.return_value.first.side_effect = [None, winner]
+            objects.create.side_effect = IntegrityError('api_job_active_note_uniq')
+            self.assertIs(submit_job('Nota', patient_uid='p1', note_id='n1'), winner)
+        pool.return_value.submit.assert_not_called()
+
+
+class ModelRegistryActivateTests(SimpleTestCase):
+    def test_activate_rejects_versions_outside_the_registry(self):
+        import os
+        import tempfile
+
+        from django.core.management import CommandError, call_command
+
+        with tempfile.TemporaryDirectory() as directory:
+            registry = os.path.join(directory, 'registry')
+            os.makedirs(os.path.join(registry, 'versions', 'v1'))
+            os.makedirs(os.path.join(directory, 'x'))
+            with override_settings(IA_MODEL_REGISTRY_DIR=registry):
+                for version in ('../../x', '..', 'v1/../../x'):
+                    with self.subTest(version=version), self.assertRaises(CommandError):
+                        call_command('model_registry', 'activate', version, stdout=mock.Mock())
+                self.assertFalse(os.path.exists(os.path.join(registry, 'ACTIVE')))
+
+                call_command('model_registry', 'activate', 'v1', stdout=mock.Mock())
+                with open(os.path.join(registry, 'ACTIVE'), encoding='utf-8') as f:
+                    self.assertEqual(f.read(), 'v1')
+
+
+class InferenceServerAddressTests(SimpleTestCase):
+    def test_unix_and_loopback_addresses(self):
+        self.assertEqual(parse_address('unix:/tmp/pulsoft.sock'), '/tmp/pulsoft.sock')
+        self.assertEqual(parse_address('127.0.0.1:7000'), ('127.0.0.1', 7000))
+        self.assertEqual(parse_address('localhost:7000'), ('localhost', 7000))
+        self.assertEqual(parse_address(':7000'), ('127.0.0.1', 7000))
+
+    def test_non_loopback_tcp_is_rejected(self):
+        for address in ('0.0.0.0:7000', '10.0.0.5:7000', 'inference.internal:7000'):
+            with self.assertRaises(ImproperlyConfigured, msg=address):
+                parse_address(address)
+
+    @override_settings(IA_INFERENCE_SERVER_AUTHKEY=None)
+    def test_tcp_requires_an_explicit_authkey(self):
+        with self.assertRaises(ImproperlyConfigured):
+            validate_address('127.0.0.1:7000')
+        with self.assertRaises(ImproperlyConfigured):
+            InferenceClient('127.0.0.1:7000')
+        validate_address('unix:/tmp/pulsoft.sock')
+
+    @override_settings(IA_INFERENCE_SERVER_AUTHKEY='clave-compartida')
+    def test_tcp_with_authkey(self):
+        validate_address('127.0.0.1:7000')
+        self.assertEqual(InferenceClient('127.0.0.1:7000').authkey, b'clave-compartida')
+
+
+class GeneratedTokenCountTests(SimpleTestCase):
+    def test_benchmark_reports_generated_token_counts(self):
+        from api.management.commands.benchmark_inference import MODE_GENERATE, MODE_STREAM, Command
+
+        def stream(note, usage=None):
+            yield 'Diagnóstico'
+            yield ' breve'
+            usage['generated_tokens'] = 7
+
+        command = Command()
+        with mock.patch.object(ia_logic, 'analyze_note_with_usage', return_value=('Diagnóstico breve', 'v1', 42)):
+            self.assertEqual(command._run_one('Nota', MODE_GENERATE)['tokens'], 42)
+        with mock.patch.object(ia_logic, 'stream_diagnosis_and_suggestions', side_effect=stream):
+            record = command._run_one('Nota', MODE_STREAM)
+        self.assertEqual(record['tokens'], 7)
+        self.assertIsNotNone(record['ttft_ms'])
+        with mock.patch.object(ia_logic, 'analyze_note_with_usage', return_value=('Error: sin modelo', None, 0)):
+            record = command._run_one('Nota', MODE_GENERATE)
+        self.assertTrue(record['error'])
+        self.assertEqual(record['tokens'], 0)
+
+    def test_inference_server_returns_usage_only_on_request(self):
+        from .inference_server import OP_ANALYZE, _handle_request
+
+        with mock.patch.object(ia_logic, 'analyze_note_with_usage', return_value=('Texto', 'v1', 12)) as analyze:
+            self.assertEqual(_handle_request({'op': OP_ANALYZE, 'note': 'Nota'}), ('Texto', 'v1'))
+            self.assertEqual(_handle_request({'op': OP_ANALYZE, 'note': 'Nota', 'usage': True}), ('Texto', 'v1', 12))
+        analyze.assert_called_with('Nota', assisted=None, use_cache=True)
+
+
+class InferenceServerAuthTests(SimpleTestCase):
+    def test_wrong_authkey_is_an_inference_server_error(self):
+        import tempfile
+        from multiprocessing.connection import Listener
+
+        from .inference_server import InferenceServerError
+
+        with tempfile.TemporaryDirectory() as directory:
+            address = f'{directory}/pulsoft.sock'
+            listener = Listener(address, authkey=b'otra-clave')
+            server = threading.Thread(target=lambda: self.assertRaises(Exception, listener.accept), daemon=True)
+            server.start()
+            try:
+                with self.assertRaises(InferenceServerError):
+                    InferenceClient(f'unix:{address}').call('status')
+            finally:
+                server.join(5)
+                listener.close()
+
+    def test_worker_keeps_accepting_after_a_failed_handshake(self):
+        from multiprocessing import AuthenticationError
+
+        from .inference_server import worker_main
+
+        conn = mock.Mock()
+        listener = mock.Mock()
+        listener.accept.side_effect = [AuthenticationError('digest received was wrong'), conn, KeyboardInterrupt]
+        with mock.patch('api.inference_server.signal.signal'), mock.patch('torch.set_num_threads'), \
+                mock.patch('api.inference_server.threading.Thread') as thread:
+            with self.assertRaises(KeyboardInterrupt):
+                worker_main(listener, torch_threads=1)
+        self.assertEqual(listener.accept.call_count, 3)
+        thread.assert_called_once()
+        self.assertEqual(thread.call_args.kwargs['args'], (conn,))
+
+
+class _FakeSnapshot:
+    def __init__(self, path, data=None):
+        self.reference = mock.Mock(path=path)
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+
+class RetryFailedNotesTests(SimpleTestCase):
+    def test_failed_notes_are_handed_back_and_resolved_ones_forgotten(self):
+        snapshots = [
+            _FakeSnapshot('users/p1/notes/a', {'content': 'Mareo al despertar'}),
+            _FakeSnapshot('users/p1/notes/b', {'content': 'Ya analizada', 'analisis_IA': '...'}),
+            _FakeSnapshot('users/p2/notes/c'),
+            _FakeSnapshot('users/p2/notes/d', {'content': ''}),
+        ]
+        db = mock.Mock()
+        db.get_all.return_value = snapshots
+        handled = []
+
+        with mock.patch('api.leases.failed_note_paths', return_value=[s.reference.path for s in snapshots]) as paths, \
+                mock.patch('api.leases.forget_leases') as forget:
+            result = retry_failed_notes(db, handled.append, limit=10, max_attempts=3)
+
+        paths.assert_called_once_with(limit=10, max_attempts=3)
+        self.assertEqual(handled, [snapshots[0]])
+        forget.assert_called_once_with(['users/p1/notes/b', 'users/p2/notes/c', 'users/p2/notes/d'])
+        self.assertEqual(result, {'retried': 1, 'resolved': 3})
+
+    def test_nothing_to_retry_skips_firestore(self):
+        db = mock.Mock()
+        with mock.patch('api.leases.failed_note_paths', return_value=[]):
+            self.assertEqual(retry_failed_notes(db, lambda snapshot: True), {'retried': 0, 'resolved': 0})
+        db.get_all.assert_not_called()
+
+
+class NoteLeasesTests(SimpleTestCase):
+    def _acquire(self, returned_row):
+        cursor = mock.MagicMock()
+        cursor.fetchone.return_value = returned_row
+        with mock.patch('api.leases.connection') as connection:
+            connection.ops.quote_name.side_effect = lambda name: f'"{name}"'
+            connection.cursor.return_value.__enter__.return_value = cursor
+            leases = NoteLeases(ttl_seconds=60, owner='worker-a')
+            acquired = leases.acquire('users/p1/notes/n1')
+        sql, params = cursor.execute.call_args[0]
+        return leases, acquired, sql, params
+
+    def test_acquire_is_a_single_conditional_upsert(self):
+        leases, acquired, sql, params = self._acquire((1,))
+
+        self.assertTrue(acquired)
+        self.assertIn('INSERT INTO "api_notelease"', sql)
+        self.assertIn('ON CONFLICT (note_path) DO UPDATE', sql)
+        # Solo se reclaman leases expirados y sin completar, y cada reclamo cuenta un intento.
+        self.assertIn('WHERE "api_notelease".completed_at IS NULL AND "api_notelease".expires_at < EXCLUDED.acquired_at', sql)
+        self.assertIn('attempts = "api_notelease".attempts + 1', sql)
+        self.assertIn('RETURNING id', sql)
+        path, owner, acquired_at, expires_at = params
+        self.assertEqual((path, owner), ('users/p1/notes/n1', 'worker-a'))
+        self.assertEqual((expires_at - acquired_at).total_seconds(), 60)
+        self.assertEqual(leases.stats()['acquired'], 1)
+
+    def test_acquire_conflict_when_no_row_is_returned(self):
+        leases, acquired, _, _ = self._acquire(None)
+        self.assertFalse(acquired)
+        self.assertEqual(leases.stats()['conflicts'], 1)
+
+    def test_acquire_database_error_gives_up_the_note(self):
+        with mock.patch('api.leases.connection') as connection:
+            connection.cursor.side_effect = RuntimeError('sin conexión')
+            leases = NoteLeases(owner='worker-a')
+            self.assertFalse(leases.acquire('users/p1/notes/n1'))
+        self.assertEqual(leases.stats()['errors'], 1)
+
+    def test_complete_marks_only_own_leases(self):
+        with mock.patch('api.leases.NoteLease.objects') as objects:
+            objects.filter.return_value.update.return_value = 2
+            leases = NoteLeases(owner='worker-a')
+            leases.complete(['users/p1/notes/n1', 'users/p1/notes/n2'])
+
+        objects.filter.assert_called_once_with(
+            note_path__in=['users/p1/notes/n1', 'users/p1/notes/n2'], owner='worker-a'
+        )
+        self.assertIn('completed_at', objects.filter.return_value.update.call_args.kwargs)
+        self.assertEqual(leases.stats()['completed'], 2)
+
+    def test_release_expires_the_lease_instead_of_deleting_it(self):
+        with mock.patch('api.leases.NoteLease.objects') as objects:
+            objects.filter.return_value.update.return_value = 1
+            leases = NoteLeases(owner='worker-a')
+            leases.release('users/p1/notes/n1')
+
+        objects.filter.assert_called_once_with(
+            note_path='users/p1/notes/n1', owner='worker-a', completed_at__isnull=True
+        )
+        self.assertIn('expires_at', objects.filter.return_value.update.call_args.kwargs)
+        objects.filter.return_value.delete.assert_not_called()
+        self.assertEqual(leases.stats()['released'], 1)
+
+
+class _FakeLeases:
+    def __init__(self):
+        self.acquired, self.completed, self.released = [], [], []
+
+    def acquire(self, path):
+        self.acquired.append(path)
+        return True
+
+    def complete(self, paths):
+        self.completed.extend(paths)
+
+    def release(self, path):
+        self.released.append(path)
+
+    def stats(self):
+        return {}
+
+
+@mock.patch('api.analysis_pipeline.touch_patients')
+class PipelineLeaseReleaseTests(SimpleTestCase):
+    def _run(self, analyze, db=None):
+        leases = _FakeLeases()
+        pipeline = AnalysisPipeline(db or mock.Mock(), analyze, analysis_workers=1, leases=leases).start()
+        pipeline.put('p1', 'n1', 'Dolor de cabeza')
+        return pipeline.close(), leases
+
+    def test_analysis_exception_releases_the_lease(self, touch_patients):
+        def analyze(content):
+            raise RuntimeError('modelo caído')
+
+        stats, leases = self._run(analyze)
+
+        self.assertEqual(leases.released, ['users/p1/notes/n1'])
+        self.assertEqual(leases.completed, [])
+        self.assertEqual((stats['failed'], stats['written']), (1, 0))
+        self.assertEqual(stats['error_classes'], {'RuntimeError': 1})
+
+    def test_error_result_releases_the_lease(self, touch_patients):
+        stats, leases = self._run(lambda content: ("Error: tiempo de espera agotado", None))
+
+        self.assertEqual(leases.released, ['users/p1/notes/n1'])
+        self.assertEqual(stats['failed'], 1)
+
+    def test_write_failure_releases_the_lease(self, touch_patients):
+        db = mock.Mock()
+        db.batch.return_value.commit.side_effect = RuntimeError('lote rechazado')
+        note_ref = db.collection.return_value.document.return_value.collection.return_value.document.return_value
+        note_ref.update.side_effect = RuntimeError('nota borrada')
+
+        stats, leases = self._run(lambda content: ("Análisis", 'v1'), db=db)
+
+        self.assertEqual(leases.released, ['users/p1/notes/n1'])
+        self.assertEqual(leases.completed, [])
+        self.assertEqual((stats['write_errors'], stats['written']), (1, 0))
+
+    def test_successful_write_completes_the_lease(self, touch_patients):
+        stats, leases = self._run(lambda content: ("Análisis", 'v1'))
+
+        self.assertEqual(leases.completed, ['users/p1/notes/n1'])
+        self.assertEqual(leases.released, [])
+        self.assertEqual(stats['written'], 1)
+
+
+class PriorityNoteQueueTests(SimpleTestCase):
+    def _drain(self, notes_queue, count):
+        return [notes_queue.get()[0] for _ in range(count)]
+
+    def test_serves_by_priority_then_oldest_note(self):
+        notes_queue = PriorityNoteQueue()
+        notes_queue.put('normal-nueva', PRIORITY_NORMAL, '2026-01-03')
+        notes_queue.put('normal-vieja', PRIORITY_NORMAL, '2026-01-01')
+        notes_queue.put('alerta', PRIORITY_ALERT, '2026-01-05')
+        notes_queue.put('panico-nueva', PRIORITY_PANIC, '2026-01-04')
+        notes_queue.put('panico-vieja', PRIORITY_PANIC, '2026-01-02')
+
+        self.assertEqual(
+            self._drain(notes_queue, 5),
+            ['panico-vieja', 'panico-nueva', 'alerta', 'normal-vieja', 'normal-nueva'],
+        )
+        self.assertEqual(notes_queue.promotions, 0)
+
+    def test_control_items_go_first(self):
+        notes_queue = PriorityNoteQueue()
+        notes_queue.put('nota', PRIORITY_PANIC, '2026-01-01')
+        notes_queue.put_control('stop')
+        self.assertEqual(notes_queue.get(), ('stop', None, None))
+
+    def test_starving_note_is_promoted_over_higher_priorities(self):
+        notes_queue = PriorityNoteQueue(starvation_seconds=60)
+        with mock.patch('api.analysis_priority.time.monotonic', return_value=1000.0):
+            notes_queue.put('normal', PRIORITY_NORMAL, '2026-01-01')
+        with mock.patch('api.analysis_priority.time.monotonic', return_value=1050.0):
+            notes_queue.put('alerta', PRIORITY_ALERT, '2026-01-02')
+            notes_queue.put('panico', PRIORITY_PANIC, '2026-01-03')
+        with mock.patch('api.analysis_priority.time.monotonic', return_value=1070.0):
+            # La normal lleva 70 s (> 60): se adelanta; la de alerta lleva 20 s y espera.
+            self.assertEqual(self._drain(notes_queue, 3), ['normal', 'panico', 'alerta'])
+        self.assertEqual(notes_queue.promotions, 1)
+
+    def test_put_nowait_raises_when_full(self):
+        import queue
+
+        notes_queue = PriorityNoteQueue(maxsize=1)
+        notes_queue.put_nowait('a')
+        with self.assertRaises(queue.Full):
+            notes_queue.put_nowait('b', PRIORITY_PANIC)
+        self.assertEqual(notes_queue.qsize_by_priority(), {'panic': 0, 'alert': 0, 'normal': 1})
+
+
+class PatientPriorityTests(SimpleTestCase):
+    def test_get_many_reads_only_uncached_patients(self):
+        priority = PatientPriority()
+        priority._cache.set('p1', PRIORITY_ALERT)
+        levels = {'p2': PRIORITY_PANIC, 'p3': PRIORITY_NORMAL}
+        with mock.patch.object(priority, '_read', side_effect=levels.get) as read:
+            result = priority.get_many(['p1', 'p2', 'p3', 'p2'])
+
+        self.assertEqual(result, {'p1': PRIORITY_ALERT, 'p2': PRIORITY_PANIC, 'p3': PRIORITY_NORMAL})
+        self.assertEqual(sorted(call.args[0] for call in read.call_args_list), ['p2', 'p3'])
+        self.assertEqual(priority.get('p2'), PRIORITY_PANIC)
+
+
+class _FakeChange:
+    def __init__(self, patient_uid, note_id, data):
+        self.type = mock.Mock()
+        self.type.name = 'ADDED'
+        users = mock.Mock(id='users')
+        owner = mock.Mock(id=patient_uid)
+        owner.parent = users
+        self.document = mock.Mock(id=note_id)
+        self.document.reference.parent.parent = owner
+        self.document.reference.path = f'users/{patient_uid}/notes/{note_id}'
+        self.document.to_dict.return_value = data
+
+
+@mock.patch('api.note_listener.touch_patients')
+class NoteListenerDeliveryTests(SimpleTestCase):
+    def test_snapshot_callback_does_not_read_priorities(self, touch_patients):
+        pipeline = mock.Mock()
+        callback_thread = threading.current_thread()
+        delivered = threading.Event()
+        pipeline.priorities_of.side_effect = lambda uids: (
+            self.assertIsNot(threading.current_thread(), callback_thread) or {uid: PRIORITY_PANIC for uid in uids}
+        )
+        pipeline.offer.side_effect = lambda *args, **kwargs: delivered.set() or True
+
+        listener = NoteListener(mock.Mock(), pipeline)
+        listener._on_snapshot([], [_FakeChange('p1', 'n1', {'content': 'Fiebre', 'createdAt': '2026-01-01'})], None)
+        pipeline.priorities_of.assert_not_called()
+        pipeline.offer.assert_not_called()
+
+        with mock.patch.object(NoteListener, '_supervise'):
+            listener.start()
+            self.assertTrue(delivered.wait(5))
+            listener.stop()
+
+        pipeline.offer.assert_called_once_with('p1', 'n1', 'Fiebre', created_at='2026-01-01', priority=PRIORITY_PANIC)
+        self.assertEqual(listener.stats()['delivered'], 1)
+
+    def test_full_delivery_queue_drops_to_the_sweep(self, touch_patients):
+        listener = NoteListener(mock.Mock(), mock.Mock(), delivery_queue_size=1)
+        changes = [
+            _FakeChange('p1', 'n1', {'content': 'Fiebre', 'createdAt': '2026-01-01'}),
+            _FakeChange('p1', 'n2', {'content': 'Tos', 'createdAt': '2026-01-02'}),
+        ]
+        listener._on_snapshot([], changes, None)
+        self.assertEqual(listener.dropped, 1)
+        self.assertFalse(listener._seen.get('users/p1/notes/n2'))
+
+
+class NoteListenerWatermarkTests(SimpleTestCase):
+    stored_at = datetime(2026, 1, 1, 10, 0, tzinfo=timezone.utc)
+
+    def _subscribe(self, stored, listener=None):
+        listener = listener or NoteListener(mock.Mock(), mock.Mock())
+        with mock.patch('api.note_listener.DiscoveryCursor.objects') as cursors:
+            cursors.filter.return_value.values_list.return_value.first.return_value = stored
+            listener._subscribe()
+        return listener, [call.kwargs['filter'].value for call in listener._db.collection_group.return_value.where.call_args_list]
+
+    def test_one_typed_subscription_per_created_at_type(self):
+        listener, values = self._subscribe(encode_created_at(self.stored_at))
+        self.assertEqual(len(values), 2)
+        self.assertEqual(len(listener._watches), 2)
+        # La posición Timestamp del barrido no se convierte en cadena; la de cadenas empieza en "ahora".
+        self.assertIn(self.stored_at, values)
+        self.assertTrue(any(isinstance(value, str) and value > '2026-01-01' for value in values))
+
+        listener, values = self._subscribe('2026-01-01T10:00:00.000Z')
+        self.assertIn('2026-01-01T10:00:00.000Z', values)
+        self.assertTrue(any(isinstance(value, datetime) for value in values))
+
+    @mock.patch('api.note_listener.touch_patients')
+    def test_watermarks_advance_by_type(self, touch_patients):
+        listener = NoteListener(mock.Mock(), mock.Mock())
+        later = datetime(2026, 1, 2, tzinfo=timezone.utc)
+        listener._on_snapshot([], [
+            _FakeChange('p1', 'n1', {'createdAt': '2026-01-03T00:00:00.000Z'}),
+            _FakeChange('p1', 'n2', {'createdAt': later}),
+            _FakeChange('p1', 'n3', {'createdAt': self.stored_at}),
+            _FakeChange('p1', 'n4', {'createdAt': '2026-01-02T00:00:00.000Z'}),
+        ], None)
+        self.assertEqual(listener.watermarks, {'string': '2026-01-03T00:00:00.000Z', 'timestamp': later})
+
+        # Al reconectar, la posición vista por el listener manda sobre la del barrido si es posterior.
+        _, values = self._subscribe(encode_created_at(self.stored_at), listener)
+        self.assertEqual(sorted(map(str, values)), sorted(map(str, ['2026-01-03T00:00:00.000Z', later])))
+
+
+@mock.patch('api.api_views.render_prometheus', return_value='ia_analysis_runs_total 1\n')
+class MetricsAccessTests(SimpleTestCase):
+    def _get(self, user=None, **headers):
+        from .api_views import analysis_metrics
+
+        request = RequestFactory().get('/api/metrics/', headers=headers)
+        request.user = user or AnonymousUser()
+        return analysis_metrics(request)
+
+    @override_settings(IA_METRICS_TOKEN='s3cr3t')
+    def test_anonymous_and_wrong_token_are_rejected(self, render):
+        self.assertEqual(self._get().status_code, 403)
+        self.assertEqual(self._get(Authorization='Bearer otro').status_code, 403)
+        self.assertEqual(self._get(Authorization='Basic s3cr3t').status_code, 403)
+        render.assert_not_called()
+
+    @override_settings(IA_METRICS_TOKEN='s3cr3t')
+    def test_bearer_token_is_accepted(self, render):
+        response = self._get(Authorization='Bearer s3cr3t')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'ia_analysis_runs_total 1\n')
+
+    @override_settings(IA_METRICS_TOKEN=None)
+    def test_without_token_only_staff(self, render):
+        self.assertEqual(self._get(Authorization='Bearer ').status_code, 403)
+        user = mock.Mock(is_authenticated=True, is_staff=False)
+        self.assertEqual(self._get(user).status_code, 403)
+        user.is_staff = True
+        self.assertEqual(self._get(user).status_code, 200)
+
+
+class NoteCursorTests(SimpleTestCase):
+    def test_round_trip_with_iso_string(self):
+        token = encode_cursor('2026-01-01T10:00:00.000Z', 'nota-1')
+        self.assertNotIn('=', token)
+        self.assertEqual(decode_cursor(token), ('2026-01-01T10:00:00.000Z', 'nota-1'))
+
+    def test_round_trip_with_firestore_timestamp(self):
+        from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+        created_at = DatetimeWithNanoseconds(2026, 1, 1, 10, 0, 0, 123456, tzinfo=timezone.utc)
+        decoded, note_id = decode_cursor(encode_cursor(created_at, 'nota-1'))
+        self.assertEqual(decoded, created_at)
+        self.assertIsNotNone(decoded.tzinfo)
+        self.assertEqual(note_id, 'nota-1')
+
+    def test_invalid_tokens_are_rejected(self):
+        import base64
+
+        def token(raw):
+            return base64.urlsafe_b64encode(raw).decode('ascii')
+
+        for bad in ('%%%', token(b'no es json'), token(b'["2026-01-01"]'), token(b'["2026-01-01",""]'),
+                    token(b'[{"ts":"ayer"},"nota-1"]')):
+            with self.subTest(token=bad), self.assertRaises(InvalidPageRequest):
+                decode_cursor(bad)
+
+    def test_sort_key_follows_firestore_type_order(self):
+        created = [
+            '2026-01-02T00:00:00.000Z',
+            datetime(2026, 1, 3, tzinfo=timezone.utc),
+            None,
+            '2026-01-01T00:00:00.000Z',
+        ]
+        self.assertEqual(
+            sorted(created, key=sort_key),
+            [None, created[1], '2026-01-01T00:00:00.000Z', '2026-01-02T00:00:00.000Z'],
+        )
+
+
+    def test_stored_created_at_keeps_its_type(self):
+        from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+        timestamp = DatetimeWithNanoseconds(2026, 1, 1, 10, 0, 0, 123456, tzinfo=timezone.utc)
+        for created_at in ('2026-01-01T10:00:00.000Z', timestamp, None):
+            with self.subTest(created_at=created_at):
+                stored = encode_created_at(created_at)
+                self.assertLessEqual(len(stored), 64)
+                self.assertEqual(decode_created_at(stored), created_at)
+        self.assertIsInstance(decode_created_at(encode_created_at(timestamp)), datetime)
+        # Posiciones guardadas antes como str(Timestamp).
+        self.assertEqual(decode_created_at(str(timestamp)), timestamp)
+
+
+class DiscoveryWatermarkTests(SimpleTestCase):
+    def _db(self, page):
+        db = mock.Mock()
+        query = db.collection_group.return_value.order_by.return_value.order_by.return_value.limit.return_value
+        query.stream.return_value = page
+        query.start_after.return_value = query
+        return db, query
+
+    def test_timestamp_watermark_is_saved_and_restored_typed(self):
+        from google.cloud.firestore_v1.field_path import FieldPath
+
+        from .note_discovery import discover_new_notes
+
+        created_at = datetime(2026, 1, 1, 10, 0, 0, 500000, tzinfo=timezone.utc)
+        snapshot = _FakeSnapshot('users/p1/notes/a', {'createdAt': created_at})
+        snapshot.reference.parent.parent.parent.id = 'users'
+        snapshot.get = lambda field: snapshot.to_dict()[field]
+        cursor = mock.Mock(created_at_watermark='', last_note_path='')
+        db, query = self._db([snapshot])
+        with mock.patch('api.note_discovery.DiscoveryCursor.objects') as cursors:
+            cursors.get_or_create.return_value = (cursor, False)
+            discover_new_notes(db, lambda note: True, page_size=10, max_notes=10)
+
+        query.start_after.assert_not_called()
+        cursor.save.assert_called_once()
+        self.assertEqual(cursor.created_at_watermark, encode_created_at(created_at))
+
+        db, query = self._db([])
+        with mock.patch('api.note_discovery.DiscoveryCursor.objects') as cursors:
+            cursors.get_or_create.return_value = (cursor, False)
+            discover_new_notes(db, lambda note: True, page_size=10, max_notes=10)
+        position = query.start_after.call_args.args[0]
+        self.assertEqual(position['createdAt'], created_at)
+        self.assertIsInstance(position['createdAt'], datetime)
+        self.assertEqual(position[FieldPath.document_id()], db.document.return_value)
+        db.document.assert_called_with('users/p1/notes/a')
+
+
+@override_settings(IA_NOTES_PAGE_SIZE=50, IA_NOTES_MAX_PAGE_SIZE=200)
+class PageParameterTests(SimpleTestCase):
+    def test_page_size_defaults_and_bounds(self):
+        self.assertEqual(page_size_from(None), 50)
+        self.assertEqual(page_size_from(''), 50)
+        self.assertEqual(page_size_from('1'), 1)
+        self.assertEqual(page_size_from('200'), 200)
+        self.assertEqual(page_size_from('5000'), 200)
+        with override_settings(IA_NOTES_PAGE_SIZE=500):
+            self.assertEqual(page_size_from(None), 200)
+
+    def test_page_size_rejects_invalid_values(self):
+        for value in ('0', '-3', 'diez', '1.5'):
+            with self.subTest(value=value), self.assertRaises(InvalidPageRequest):
+                page_size_from(value)
+
+    def test_fields(self):
+        self.assertIsNone(fields_from(None))
+        self.assertIsNone(fields_from(''))
+        self.assertEqual(fields_from('summary'), list(NOTE_SUMMARY_FIELDS))
+        self.assertEqual(fields_from(' content , createdAt ,'), ['content', 'createdAt'])
+        self.assertEqual(len(fields_from(','.join(f'f{i}' for i in range(20)))), 20)
+
+    def test_fields_rejects_paths_and_too_many_fields(self):
+        for value in ('content,analisis_IA.texto', 'a-b', '__name__/x', ','.join(f'f{i}' for i in range(21))):
+            with self.subTest(value=value), self.assertRaises(InvalidPageRequest):
+                fields_from(value)
+
+
+class BackfillCreatedAtTests(SimpleTestCase):
+    def _note(self, patient_uid, data, create_time):
+        snapshot = mock.Mock()
+        owner = mock.Mock(id=patient_uid)
+        owner.parent = mock.Mock(id='users')
+        snapshot.reference.parent.parent = owner
+        snapshot.to_dict.return_value = data
+        snapshot.create_time = create_time
+        return snapshot
+
+    @mock.patch('api.note_summary.touch_patients')
+    def test_assigns_document_create_time_to_notes_without_created_at(self, touch_patients):
+        created = datetime(2025, 3, 4, 5, 6, 7, 891000, tzinfo=timezone.utc)
+        notes = [
+            self._note('p1', {'createdAt': '2026-01-01T00:00:00.000Z'}, created),
+            self._note('p1', {}, created),
+            self._note('p2', {}, created),
+        ]
+        db = mock.Mock()
+        db.collection_group.return_value.select.return_value.stream.return_value = notes
+
+        report = backfill_created_at(db, apply=True)
+
+        batch = db.batch.return_value
+        batch.update.assert_any_call(notes[1].reference, {'createdAt': '2025-03-04T05:06:07.891Z'})
+        self.assertEqual(batch.update.call_count, 2)
+        batch.commit.assert_called_once_with()
+        touch_patients.assert_called_once_with({'p1', 'p2'})
+        self.assertEqual((report['scanned'], report['missing'], report['updated']), (3, 2, 2))
+
+    @mock.patch('api.note_summary.touch_patients')
+    def test_report_only_without_apply(self, touch_patients):
+        db = mock.Mock()
+        db.collection_group.return_value.select.return_value.stream.return_value = [
+            self._note('p1', {}, datetime(2025, 1, 1, tzinfo=timezone.utc)),
+        ]
+        report = backfill_created_at(db)
+        db.batch.return_value.update.assert_not_called()
+        self.assertEqual((report['missing'], report['updated'], report['applied']), (1, 0, False))
+
+
+class ConditionalResponseTests(SimpleTestCase):
+    last_modified = datetime(2026, 1, 1, 12, 0, 0, 500000, tzinfo=timezone.utc)
+
+    def _request(self, path='/api/patient-notes/?patient_uid=p1&caregiver_uid=c1', **headers):
+        return RequestFactory().get(path, headers=headers)
+
+    def test_etag_depends_on_token_and_query_not_parameter_order(self):
+        etag = etag_for('p1:3:10', self._request())
+        self.assertRegex(etag, r'^"[0-9a-f]{20}"$')
+        self.assertEqual(etag, etag_for('p1:3:10', self._request('/api/patient-notes/?caregiver_uid=c1&patient_uid=p1')))
+        self.assertNotEqual(etag, etag_for('p1:4:10', self._request()))
+        self.assertNotEqual(etag, etag_for('p1:3:10', self._request('/api/patient-notes/?patient_uid=p1&caregiver_uid=c1&cursor=x')))
+
+    def test_notes_etag_changes_with_version_and_count(self):
+        request = self._request()
+        summary = mock.Mock(patient_uid='p1', version=3, note_count=10)
+        etag = notes_etag(summary, request)
+        summary.version = 4
+        self.assertNotEqual(notes_etag(summary, request), etag)
+
+    def test_matching_if_none_match_returns_304_with_validators(self):
+        etag = etag_for('p1:3:10', self._request())
+        for header in (etag, f'W/{etag}', f'"otro", {etag}', '*'):
+            with self.subTest(header=header):
+                response = not_modified(self._request(If_None_Match=header), etag, self.last_modified)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+                self.assertEqual(response['Last-Modified'], 'Thu, 01 Jan 2026 12:00:00 GMT')
+                self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+    def test_stale_etag_needs_full_response(self):
+        etag = etag_for('p1:3:10', self._request())
+        self.assertIsNone(not_modified(self._request(If_None_Match='"anterior"'), etag, self.last_modified))
+        self.assertIsNone(not_modified(self._request(), etag, self.last_modified))
+
+    def test_if_modified_since(self):
+        etag = etag_for('p1:3:10', self._request())
+        # La fracción de segundo de last_modified no cuenta: HTTP-date tiene resolución de segundos.
+        response = not_modified(self._request(If_Modified_Since='Thu, 01 Jan 2026 12:00:00 GMT'), etag, self.last_modified)
+        self.assertEqual(response.status_code, 304)
+        self.assertIsNone(not_modified(self._request(If_Modified_Since='Thu, 01 Jan 2026 11:59:59 GMT'), etag, self.last_modified))
+        # If-None-Match manda sobre If-Modified-Since.
+        self.assertIsNone(not_modified(
+            self._request(If_None_Match='"anterior"', If_Modified_Since='Thu, 01 Jan 2026 12:00:00 GMT'),
+            etag, self.last_modified,
+        ))
+
+    @staticmethod
+    def _note(created_at, update_time):
+        return mock.Mock(update_time=update_time, to_dict=mock.Mock(return_value={'createdAt': created_at}))
+
+    def test_summary_keeps_timestamp_created_at_typed(self):
+        from .note_summary import _refreshed_fields
+
+        created_at = datetime(2026, 1, 2, 8, 30, tzinfo=timezone.utc)
+        summary = mock.Mock(note_count=1, newest_created_at='', max_update_time=None, last_modified=self.last_modified)
+        notes = [self._note(datetime(2026, 1, 1, 9, 0, tzinfo=timezone.utc), self.last_modified), self._note(created_at, created_at)]
+        fields = _refreshed_fields(summary, notes, datetime(2026, 1, 3, tzinfo=timezone.utc))
+        self.assertEqual(fields['note_count'], 2)
+        self.assertEqual(fields['newest_created_at'], encode_created_at(created_at))
+        self.assertEqual(fields['last_modified'], created_at)
+
+    def test_editing_an_older_note_changes_the_version(self):
+        from django.db.models import F
+
+        from .note_summary import _refreshed_fields
+
+        created = ['2026-01-01T08:00:00.000Z', '2026-01-01T11:00:00.000Z']
+        before = [self._note(created[0], self.last_modified), self._note(created[1], self.last_modified)]
+        now = datetime(2026, 1, 5, tzinfo=timezone.utc)
+        summary = mock.Mock(
+            note_count=2, newest_created_at=created[1], max_update_time=self.last_modified, last_modified=self.last_modified,
+        )
+        unchanged = _refreshed_fields(summary, before, now)
+        self.assertEqual(unchanged['version'], F('version') + 0)
+        self.assertEqual(unchanged['last_modified'], self.last_modified)
+
+        # Misma cantidad y misma nota más reciente: solo cambia el update_time de la antigua.
+        edited_at = datetime(2026, 1, 4, 15, 0, tzinfo=timezone.utc)
+        after = [self._note(created[0], edited_at), before[1]]
+        fields = _refreshed_fields(summary, after, now)
+        self.assertEqual(fields['version'], F('version') + 1)
+        self.assertEqual(fields['max_update_time'], edited_at)
+        self.assertEqual(fields['last_modified'], edited_at)
+
+        request = self._request()
+        summary.version = 3
+        old_etag = notes_etag(summary, request)
+        summary.version = 4
+        self.assertNotEqual(notes_etag(summary, request), old_etag)
+
+    def test_set_validators_without_last_modified(self):
+        from django.http import HttpResponse
+
+        response = set_validators(HttpResponse(), '"abc"')
+        self.assertEqual(response['ETag'], '"abc"')
+        self.assertFalse(response.has_header('Last-Modified'))
+
+
+class PatientNotesConditionalTests(SimpleTestCase):
+    def _get(self, **headers):
+        from asgiref.sync import async_to_sync
+
+        from . import api_views
+
+        summary = mock.Mock(patient_uid='p1', version=3, note_count=1, last_modified=ConditionalResponseTests.last_modified)
+        link = mock.Mock()
+        link.patient.email = 'paciente@example.com'
+        request = RequestFactory().get('/api/patient-notes/?patient_uid=p1&caregiver_uid=c1', headers=headers)
+        with mock.patch.object(api_views, 'aauthorized_link', mock.AsyncMock(return_value=link)), \
+                mock.patch.object(api_views, 'aget_summary', mock.AsyncMock(return_value=summary)), \
+                mock.patch.object(api_views, 'get_async_db'), \
+                mock.patch.object(api_views, 'afetch_notes_page',
+                                  mock.AsyncMock(return_value=([{'note_id': 'n1'}], None))) as fetch:
+            response = async_to_sync(api_views.patient_notes)(request)
+        return response, fetch
+
+    def test_revalidation_with_current_etag_skips_firestore(self):
+        first, _ = self._get()
+        self.assertEqual(first.status_code, 200)
+
+        response, fetch = self._get(If_None_Match=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], first['ETag'])
+        fetch.assert_not_called()
+
+    def test_sync_view_returns_the_same_response(self):
+        from . import api_views
+
+        first, _ = self._get()
+        summary = mock.Mock(patient_uid='p1', version=3, note_count=1, last_modified=ConditionalResponseTests.last_modified)
+        link = mock.Mock()
+        link.patient.email = 'paciente@example.com'
+        request = RequestFactory().get('/api/patient-notes/?patient_uid=p1&caregiver_uid=c1')
+        with mock.patch.object(api_views, 'authorized_link', return_value=link), \
+                mock.patch.object(api_views, 'get_summary', return_value=summary), \
+                mock.patch.object(api_views, 'fetch_notes_page', return_value=([{'note_id': 'n1'}], None)):
+            response = api_views.patient_notes_sync(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, first.content)
+        self.assertEqual(response['ETag'], first['ETag'])
+
+
+class NotesWebViewTests(SimpleTestCase):
+    def test_caregiver_page_shows_the_total_and_keeps_page_size(self):
+        from asgiref.sync import async_to_sync
+
+        from . import views_web
+
+        session = {'uid': 'c1', 'user_type': 'caregiver', 'selected_patient_uid': 'p1'}
+        request = RequestFactory().get('/caregiver/notes/?page_size=2')
+        request.session = mock.Mock()
+        request.session.aget = mock.AsyncMock(side_effect=lambda key, default=None: session.get(key, default))
+        notes = [{'analisis_IA': 'Análisis 1'}, {'analisis_IA': 'Análisis 2'}]
+        with mock.patch.object(views_web.FirebaseUser.objects, 'aget', mock.AsyncMock(return_value=mock.Mock(email='p@example.com'))), \
+                mock.patch.object(views_web, 'get_async_db'), \
+                mock.patch.object(views_web, 'afetch_notes_page', mock.AsyncMock(return_value=(notes, 'abc'))), \
+                mock.patch.object(views_web, 'aget_summary', mock.AsyncMock(return_value=mock.Mock(note_count=17))), \
+                mock.patch('firebase_config.aclose_async_db', new_callable=mock.AsyncMock):
+            response = async_to_sync(views_web.caregiver_notes_view)(request)
+
+        content = response.content.decode('utf-8')
+        self.assertIn('Notas Registradas (17)', content)
+        self.assertIn('Mostrando 2 en esta página', content)
+        self.assertIn('?cursor=abc&amp;page_size=2', content)
+
+
+    def test_sync_caregiver_page_matches_the_async_one(self):
+        from . import views_web
+
+        request = RequestFactory().get('/caregiver/notes/?page_size=2')
+        request.session = {'uid': 'c1', 'user_type': 'caregiver', 'selected_patient_uid': 'p1'}
+        notes = [{'analisis_IA': 'Análisis 1'}, {'analisis_IA': 'Análisis 2'}]
+        with mock.patch.object(views_web.FirebaseUser.objects, 'get', return_value=mock.Mock(email='p@example.com')), \
+                mock.patch.object(views_web, 'fetch_notes_page', return_value=(notes, 'abc')) as fetch, \
+                mock.patch.object(views_web, 'get_summary', return_value=mock.Mock(note_count=17)):
+            response = views_web.caregiver_notes_view_sync(request)
+
+        fetch.assert_called_once_with(views_web.db, 'p1', 2, cursor=None, fields=views_web.CAREGIVER_NOTE_FIELDS)
+        content = response.content.decode('utf-8')
+        self.assertIn('Notas Registradas (17)', content)
+        self.assertIn('?cursor=abc&amp;page_size=2', content)
+
+
+class ClosesAsyncDbTests(SimpleTestCase):
+    def _call(self, request):
+        from asgiref.sync import async_to_sync
+
+        from .decorators import closes_async_db
+
+        view = closes_async_db(mock.AsyncMock(return_value='respuesta'))
+        with mock.patch('firebase_config.aclose_async_db', new_callable=mock.AsyncMock) as aclose:
+            self.assertEqual(async_to_sync(view)(request), 'respuesta')
+        return aclose
+
+    def test_closes_the_client_under_wsgi(self):
+        self._call(RequestFactory().get('/')).assert_awaited_once()
+
+    def test_aclose_closes_the_grpc_channel_of_the_installed_client(self):
+        import asyncio
+
+        import grpc
+        from asgiref.sync import async_to_sync
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud.firestore import AsyncClient
+
+        import firebase_config
+
+        async def scenario():
+            loop = asyncio.get_running_loop()
+            client = AsyncClient(project='pulsoft-test', credentials=AnonymousCredentials())
+            firebase_config._async_clients[loop] = client
+            channel = client._firestore_api.transport.grpc_channel
+            self.assertNotEqual(channel.get_state(), grpc.ChannelConnectivity.SHUTDOWN)
+            await firebase_config.aclose_async_db()
+            self.assertEqual(channel.get_state(), grpc.ChannelConnectivity.SHUTDOWN)
+            self.assertNotIn(loop, firebase_config._async_clients)
+
+            # Un cliente que no llegó a abrir el canal se cierra sin crearlo.
+            unused = AsyncClient(project='pulsoft-test', credentials=AnonymousCredentials())
+            firebase_config._async_clients[loop] = unused
+            await firebase_config.aclose_async_db()
+            self.assertIsNone(unused._firestore_api_internal)
+
+        async_to_sync(scenario)()
+
+    def test_keeps_the_worker_client_under_asgi(self):
+        from django.test import AsyncRequestFactory
+
+        self._call(AsyncRequestFactory().get('/')).assert_not_awaited()
+
+
+class MergedNotesPageTests(SimpleTestCase):
+    notes = {
+        'p1': ['2026-01-09', '2026-01-05', '2026-01-04', '2026-01-01'],
+        'p2': ['2026-01-08', '2026-01-07', '2026-01-05', '2026-01-02'],
+        'p3': ['2026-01-06'],
+    }
+
+    async def _fake_page(self, db, patient_uid, page_size, cursor=None, fields=None):
+        # Como afetch_notes_page: orden (createdAt, id) descendente y cursor tras la última nota.
+        rows = sorted(
+            ({'createdAt': created_at, 'note_id': f'{patient_uid}-{index}'}
+             for index, created_at in enumerate(self.notes[patient_uid])),
+            key=lambda note: (note['createdAt'], note['note_id']), reverse=True,
+        )
+        if cursor:
+            position = decode_cursor(cursor)
+            rows = [note for note in rows if (note['createdAt'], note['note_id']) < position]
+        page = [dict(note) for note in rows[:page_size]]
+        more = len(rows) > page_size
+        return page, encode_cursor(page[-1]['createdAt'], page[-1]['note_id']) if more else None
+
+    def _walk(self, page_size):
+        from asgiref.sync import async_to_sync
+
+        pages, cursor = [], None
+        with mock.patch('api.note_pages.afetch_notes_page', side_effect=self._fake_page) as fetch:
+            while True:
+                notes, cursor = async_to_sync(afetch_merged_notes_page)(None, list(self.notes), page_size, cursor)
+                pages.append([(note['createdAt'], note['patient_uid'], note['note_id']) for note in notes])
+                if cursor is None:
+                    return pages, fetch
+
+    def test_pages_are_merged_newest_first_without_gaps_or_repeats(self):
+        expected = sorted(
+            ((created_at, uid, f'{uid}-{index}') for uid, dates in self.notes.items()
+             for index, created_at in enumerate(dates)),
+            key=lambda entry: (entry[0], entry[2], entry[1]), reverse=True,
+        )
+        for page_size in (1, 2, 3, 4, 20):
+            with self.subTest(page_size=page_size):
+                pages, _ = self._walk(page_size)
+                self.assertTrue(all(len(page) <= page_size for page in pages))
+                self.assertEqual([note for page in pages for note in page], expected)
+
+    def test_first_page_and_exhausted_patients(self):
+        pages, fetch = self._walk(3)
+        self.assertEqual(pages[0], [
+            ('2026-01-09', 'p1', 'p1-0'), ('2026-01-08', 'p2', 'p2-0'), ('2026-01-07', 'p2', 'p2-1'),
+        ])
+        # p3 se agota en la segunda página: después ya no se le piden más notas.
+        asked = [call.args[1] for call in fetch.call_args_list]
+        self.assertEqual(asked.count('p3'), 2)
+
+    def test_cursor_keeps_one_position_per_patient(self):
+        from asgiref.sync import async_to_sync
+
+        with mock.patch('api.note_pages.afetch_notes_page', side_effect=self._fake_page):
+            _, cursor = async_to_sync(afetch_merged_notes_page)(None, list(self.notes), 3)
+        positions = decode_merged_cursor(cursor, list(self.notes))
+        self.assertEqual(decode_cursor(positions['p1']), ('2026-01-09', 'p1-0'))
+        self.assertEqual(decode_cursor(positions['p2']), ('2026-01-07', 'p2-1'))
+        self.assertNotIn('p3', positions)
+        with self.assertRaises(InvalidPageRequest):
+            decode_merged_cursor(cursor, ['p1'])
+
+    def test_sync_version_returns_the_same_pages(self):
+        from asgiref.sync import async_to_sync
+
+        pages, _ = self._walk(2)
+        sync_pages, cursor = [], None
+        with mock.patch('api.note_pages.fetch_notes_page', side_effect=async_to_sync(self._fake_page)):
+            while True:
+                notes, cursor = fetch_merged_notes_page(None, list(self.notes), 2, cursor)
+                sync_pages.append([(note['createdAt'], note['patient_uid'], note['note_id']) for note in notes])
+                if cursor is None:
+                    break
+        self.assertEqual(sync_pages, pages)
@@ -1,11 +1,25 @@
 # api/urls.py
+from django.conf import settings
 from django.urls import path
 from . import api_views, views_web, views
 
+# Vistas de notas asíncronas bajo ASGI (despliegue de producción) y síncronas bajo WSGI.
+if getattr(settings, 'IA_ASYNC_NOTE_VIEWS', True):
+    patient_notes, caregiver_notes = api_views.patient_notes, api_views.caregiver_notes
+else:
+    patient_notes, caregiver_notes = api_views.patient_notes_sync, api_views.caregiver_notes_sync
+
 urlpatterns = [
     path('analyze-note/', api_views.AnalyzeNoteView.as_view(), name='analyze_note_api'),
+    path('analyze-note/stream/', api_views.analyze_note_stream, name='analyze_note_stream_api'),
+    path('analysis-jobs/', api_views.AnalysisJobCreateView.as_view(), name='analysis_job_create_api'),
+    path('analysis-jobs/<uuid:job_id>/', api_views.AnalysisJobDetailView.as_view(), name='analysis_job_detail_api'),
+    path('health/ready/', api_views.ReadinessView.as_view(), name='readiness_api'),
+    path('inference-stats/', api_views.InferenceStatsView.as_view(), name='inference_stats_api'),
+    path('metrics/', api_views.analysis_metrics, name='analysis_metrics_api'),
     path('caregiver-patients/', api_views.CaregiverPatientsView.as_view(), name='caregiver_patients_api'),
-    path('patient-notes/', api_views.PatientNotesView.as_view(), name='patient_notes_api'),
+    path('patient-notes/', patient_notes, name='patient_notes_api'),
+    path('caregiver-notes/', caregiver_notes, name='caregiver_notes_api'),
     path('link-patient/', api_views.LinkPatientView.as_view(), name='link_patient_api'),
     path('unlink-patient/', api_views.UnlinkPatientView.as_view(), name='unlink_patient_api'),
     path('available-patients/', api_views.AvailablePatientsView.as_view(), name='available_patients_api'),
@@ -1,14 +1,21 @@
+from django.conf import settings
 from django.urls import path
 from . import views_web
 
+# Como en api/urls.py: páginas de notas asíncronas bajo ASGI y síncronas bajo WSGI.
+if getattr(settings, 'IA_ASYNC_NOTE_VIEWS', True):
+    patient_notes_view, caregiver_notes_view = views_web.patient_notes_view, views_web.caregiver_notes_view
+else:
+    patient_notes_view, caregiver_notes_view = views_web.patient_notes_view_sync, views_web.caregiver_notes_view_sync
+
 urlpatterns = [
     path('login/', views_web.login_view, name='login'),
     path('logout/', views_web.logout_view, name='logout'),
     path('select-patient/', views_web.select_patient, name='select_patient'),
     path('caregiver-dashboard/', views_web.caregiver_dashboard, name='caregiver_dashboard'),
     path('patient-dashboard/', views_web.patient_dashboard, name='patient_dashboard'),
-    path('patient-notes/', views_web.patient_notes_view, name='patient_notes'),
-    path('caregiver-notes/', views_web.caregiver_notes_view, name='caregiver_notes'),
+    path('patient-notes/', patient_notes_view, name='patient_notes'),
+    path('caregiver-notes/', caregiver_notes_view, name='caregiver_notes'),
     path('manage-patient-links/', views_web.manage_patient_links, name='manage_patient_links'),
     path('link-patient-ajax/', views_web.link_patient_ajax, name='link_patient_ajax'),
     path('unlink-patient-ajax/', views_web.unlink_patient_ajax, name='unlink_patient_ajax'),
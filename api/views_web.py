@@ -1,11 +1,15 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout
-from api.decorators import firebase_login_required
+from api.decorators import closes_async_db, firebase_login_required
 from firebase_admin import auth as firebase_auth
 from firebase_admin import firestore # Importa Firestore
 from api.models import FirebaseUser, CaregiverPatientLink
+from api.link_cache import link_cache
+from api.note_pages import InvalidPageRequest, afetch_notes_page, fetch_notes_page, page_size_from
+from api.note_summary import aget_summary, get_summary
 import firebase_admin
-from firebase_config import db
+from firebase_config import db, get_async_db
+from django.db import IntegrityError
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
@@ -111,9 +115,8 @@ def select_patient(request):
         return redirect('login')
     
     try:
-        # --- Obtener todos los documentos en Firestore donde el cuidador sea el actual ---
-        query = db.collection('caregiverPatientLinks').where('caregiverUid', '==', uid).stream()
-        patient_uids = [doc.to_dict().get('patientUid') for doc in query]
+        # --- Obtener los pacientes del cuidador actual (caché de vínculos sobre Postgres) ---
+        patient_uids = link_cache.patients_of(uid)
 
         # --- Buscar en PostgreSQL los datos de cada paciente por su UID ---
         linked_patients = FirebaseUser.objects.filter(uid__in=patient_uids)
@@ -165,20 +168,88 @@ def patient_dashboard(request):
     
     return render(request, 'patient_dashboard.html', {'patient': patient})
 
-def patient_notes_view(request):
+# Campos de Firestore que muestra cada plantilla de notas.
+PATIENT_NOTE_FIELDS = ['content', 'createdAt']
+CAREGIVER_NOTE_FIELDS = ['analizadoEn', 'analisis_IA', 'createdAt']
+
+@closes_async_db
+async def patient_notes_view(request):
+    # Vista asíncrona: sesión, ORM y Firestore (AsyncClient) sin bloquear un hilo.
+    uid = await request.session.aget('uid')
+    user_type = await request.session.aget('user_type')
+
+    if not uid or user_type != 'patient':
+        return redirect('login')
+
+    # Consultar una página de notas desde Firestore (solo los campos que muestra la plantilla)
+    try:
+        page_size = page_size_from(request.GET.get('page_size'))
+        notes, next_cursor = await afetch_notes_page(
+            get_async_db(), uid, page_size, cursor=request.GET.get('cursor'), fields=PATIENT_NOTE_FIELDS,
+        )
+    except InvalidPageRequest:
+        return redirect('patient_notes')
+
+    return render(request, 'patient_notes.html', {'notes': notes, 'next_cursor': next_cursor, 'page_size': page_size})
+
+def patient_notes_view_sync(request):
+    # Misma página que patient_notes_view para el despliegue WSGI (IA_ASYNC_NOTE_VIEWS=0).
     uid = request.session.get('uid')
     user_type = request.session.get('user_type')
 
     if not uid or user_type != 'patient':
         return redirect('login')
 
-    # Consultar notas desde Firestore
-    notes_ref = db.collection('users').document(uid).collection('notes')
-    notes = [doc.to_dict() for doc in notes_ref.stream()]
+    try:
+        page_size = page_size_from(request.GET.get('page_size'))
+        notes, next_cursor = fetch_notes_page(
+            db, uid, page_size, cursor=request.GET.get('cursor'), fields=PATIENT_NOTE_FIELDS,
+        )
+    except InvalidPageRequest:
+        return redirect('patient_notes')
+
+    return render(request, 'patient_notes.html', {'notes': notes, 'next_cursor': next_cursor, 'page_size': page_size})
+
+@closes_async_db
+async def caregiver_notes_view(request):
+    # Vista asíncrona: sesión, ORM y Firestore (AsyncClient) sin bloquear un hilo.
+    uid = await request.session.aget('uid')
+    user_type = await request.session.aget('user_type')
+    patient_uid = await request.session.aget('selected_patient_uid')
+
+    if not uid or user_type != 'caregiver' or not patient_uid:
+        return redirect('login')
+
+    # Obtener email del paciente desde Django (si está sincronizado)
+    try:
+        patient = await FirebaseUser.objects.aget(uid=patient_uid)
+        patient_email = patient.email
+    except FirebaseUser.DoesNotExist:
+        patient_email = "Desconocido"
+
+    # Consultar una página de notas desde Firestore (solo los campos que muestra la plantilla)
+    try:
+        page_size = page_size_from(request.GET.get('page_size'))
+        notes, next_cursor = await afetch_notes_page(
+            get_async_db(), patient_uid, page_size, cursor=request.GET.get('cursor'), fields=CAREGIVER_NOTE_FIELDS,
+        )
+    except InvalidPageRequest:
+        return redirect('caregiver_notes')
+
+    # Total de notas del paciente (la página solo trae page_size), del resumen cacheado.
+    summary = await aget_summary(get_async_db(), patient_uid)
 
-    return render(request, 'patient_notes.html', {'notes': notes})
+    return render(request, 'caregiver_notes.html', {
+        'notes': notes,
+        'next_cursor': next_cursor,
+        'page_size': page_size,
+        'total_notes': summary.note_count,
+        'patient_uid': patient_uid,
+        'patient_email': patient_email
+    })
 
-def caregiver_notes_view(request):
+def caregiver_notes_view_sync(request):
+    # Misma página que caregiver_notes_view para el despliegue WSGI (IA_ASYNC_NOTE_VIEWS=0).
     uid = request.session.get('uid')
     user_type = request.session.get('user_type')
     patient_uid = request.session.get('selected_patient_uid')
@@ -186,19 +257,26 @@ def caregiver_notes_view(request):
     if not uid or user_type != 'caregiver' or not patient_uid:
         return redirect('login')
 
-    # Obtener email del paciente desde Django (si está sincronizado)
     try:
-        patient = FirebaseUser.objects.get(uid=patient_uid)
-        patient_email = patient.email
+        patient_email = FirebaseUser.objects.get(uid=patient_uid).email
     except FirebaseUser.DoesNotExist:
         patient_email = "Desconocido"
 
-    # Consultar notas desde Firestore
-    notes_ref = db.collection('users').document(patient_uid).collection('notes')
-    notes = [doc.to_dict() for doc in notes_ref.stream()]
+    try:
+        page_size = page_size_from(request.GET.get('page_size'))
+        notes, next_cursor = fetch_notes_page(
+            db, patient_uid, page_size, cursor=request.GET.get('cursor'), fields=CAREGIVER_NOTE_FIELDS,
+        )
+    except InvalidPageRequest:
+        return redirect('caregiver_notes')
+
+    summary = get_summary(db, patient_uid)
 
     return render(request, 'caregiver_notes.html', {
         'notes': notes,
+        'next_cursor': next_cursor,
+        'page_size': page_size,
+        'total_notes': summary.note_count,
         'patient_uid': patient_uid,
         'patient_email': patient_email
     })
@@ -291,11 +369,17 @@ def link_patient_ajax(request):
                 'error': 'El paciente ya está vinculado a este cuidador'
             }, status=409)
 
-        # Crear el vínculo
-        link = CaregiverPatientLink.objects.create(
-            caregiver=caregiver,
-            patient=patient
-        )
+        # Crear el vínculo (la restricción única cubre dos solicitudes simultáneas)
+        try:
+            link = CaregiverPatientLink.objects.create(
+                caregiver=caregiver,
+                patient=patient
+            )
+        except IntegrityError:
+            return JsonResponse({
+                'success': False,
+                'error': 'El paciente ya está vinculado a este cuidador'
+            }, status=409)
 
         # Crear el vínculo en Firestore también
         try:
@@ -315,6 +399,8 @@ def link_patient_ajax(request):
                 'error': 'Error al crear el vínculo en la base de datos'
             }, status=500)
 
+        link_cache.invalidate(caregiver_uid)
+
         return JsonResponse({
             'success': True,
             'message': 'Paciente vinculado exitosamente',
@@ -388,6 +474,8 @@ def unlink_patient_ajax(request):
             print(f"Error al eliminar vínculo en Firestore: {firestore_error}")
             # No fallar si Firestore falla, el vínculo ya se eliminó en Django
 
+        link_cache.invalidate(caregiver_uid)
+
         return JsonResponse({
             'success': True,
             'message': 'Paciente desvinculado exitosamente'
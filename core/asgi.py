@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
+# Despliegue recomendado: `uvicorn core.asgi:application --workers 2`. Las vistas de notas
+# (api/api_views.py y api/views_web.py) son asíncronas y usan un AsyncClient de Firestore
+# por worker, así que cada worker atiende muchas solicitudes mientras esperan E/S. Para
+# comparar con el despliegue WSGI (`gunicorn core.wsgi`, vistas síncronas):
+# `manage.py compare_deployments`.
 application = get_asgi_application()
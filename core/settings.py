@@ -64,7 +64,15 @@ TEMPLATES = [
         },
     },
 ]
+# Despliegue de producción: ASGI (`uvicorn core.asgi:application --workers N`), con las
+# vistas de notas asíncronas. core/wsgi.py (gunicorn) sirve las versiones síncronas.
 WSGI_APPLICATION = 'core.wsgi.application'
+ASGI_APPLICATION = 'core.asgi.application'
+
+# Vistas de notas (/api/patient-notes/, /api/caregiver-notes/ y las páginas web de notas)
+# asíncronas (AsyncClient de Firestore) o síncronas (cliente de Firestore compartido).
+# core/wsgi.py lo pone a 0 si no se indica.
+IA_ASYNC_NOTE_VIEWS = os.environ.get('IA_ASYNC_NOTE_VIEWS', '1') == '1'
 
 
 # Database
@@ -81,6 +89,25 @@ DATABASES = {
     }
 }
 
+# Caché compartida (vínculos cuidador-paciente, api/link_cache.py). Con REDIS_URL se usa
+# Redis (requiere el paquete redis) y la caché es común a todos los procesos; si no,
+# local-memory por proceso.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'pulsoft',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -170,6 +197,158 @@ LOGGING = {
         },
     },
 }
+# Ciclo de vida del modelo de IA (api/model_lifecycle.py)
+# Con IA_MODEL_PRELOAD=1 el modelo se carga en segundo plano al arrancar el servidor
+# (runserver, gunicorn, uvicorn; no en migrate, shell u otros comandos de manage.py);
+# si no, se carga en la primera solicitud o cuando se consulta /api/health/ready/.
+IA_MODEL_PRELOAD = os.environ.get('IA_MODEL_PRELOAD', '0') == '1'
+# Segundos que una solicitud espera a que termine la carga antes de fallar.
+IA_MODEL_LOAD_TIMEOUT = 300
+# Tras una carga fallida, la siguiente solicitud (o consulta de readiness) pasados estos
+# segundos la reintenta. None = el fallo es definitivo hasta reiniciar el proceso.
+IA_MODEL_RETRY_SECONDS = 60
+
+# Registro de versiones del modelo (api/model_registry.py). Se sirve la versión indicada
+# en IA_MODEL_REGISTRY_DIR/ACTIVE; sin registro se usa IA_MODEL_PATH tal cual.
+# Cada proceso revisa el puntero ACTIVE cada IA_MODEL_REGISTRY_POLL_SECONDS y, si cambió,
+# carga la nueva versión en segundo plano y la intercambia sin cortar el servicio.
+IA_MODEL_REGISTRY_DIR = os.environ.get('IA_MODEL_REGISTRY_DIR', os.path.join(BASE_DIR, 'model_registry'))
+IA_MODEL_PATH = os.environ.get('IA_MODEL_PATH', os.path.join(BASE_DIR, 'fine_tuned_distilgpt2_model'))
+IA_MODEL_REGISTRY_POLL_SECONDS = 10
+
+# Backend de inferencia (api/inference_backends.py): 'torch' (float32), 'int8'
+# (cuantización dinámica, solo CPU) u 'onnx' (ONNX Runtime, requiere optimum[onnxruntime]).
+IA_INFERENCE_BACKEND = 'torch'
+
+# Precalcula la KV-cache del bloque de instrucciones fijo del prompt al cargar el modelo.
+IA_PREFIX_KV_CACHE = True
+
+# Servidor de inferencia dedicado (manage.py run_inference_server).
+# Si se define, los procesos web no cargan el modelo y le delegan la generación.
+# Formato: 'unix:/ruta/al/socket' o 'host:puerto' (solo loopback: 127.0.0.1 / localhost).
+IA_INFERENCE_SERVER_ADDRESS = os.environ.get('IA_INFERENCE_SERVER_ADDRESS') or None
+# Clave compartida entre servidor y clientes. Obligatoria con TCP; con un socket Unix,
+# si falta, se deriva de SECRET_KEY.
+IA_INFERENCE_SERVER_AUTHKEY = os.environ.get('IA_INFERENCE_SERVER_AUTHKEY') or None
+IA_INFERENCE_SERVER_TIMEOUT = 300
+
+# Decodificación asistida por n-gramas del prompt (prompt lookup). Se puede activar por
+# solicitud con {"assisted": true}; este valor es el predeterminado.
+IA_ASSISTED_DECODING = False
+IA_PROMPT_LOOKUP_NUM_TOKENS = 10
+IA_PROMPT_LOOKUP_MAX_NGRAM = 3
+
+# Micro-batching de inferencia (api/inference_batcher.py)
+# Tamaño máximo de lote y tiempo máximo (ms) que se espera a que lleguen más solicitudes.
+IA_BATCH_MAX_SIZE = 8
+IA_BATCH_MAX_WAIT_MS = 10
+
+# Caché de análisis de IA (api/analysis_cache.py): LRU en memoria + tabla en Postgres.
+IA_CACHE_ENABLED = True
+IA_CACHE_MEMORY_MAX_ENTRIES = 1024
+IA_CACHE_DB_MAX_ENTRIES = 50000
+IA_CACHE_TTL_SECONDS = 7 * 24 * 3600
+# Decodificación greedy en lugar de muestreo, para que los análisis cacheados sean reproducibles.
+IA_DETERMINISTIC_GENERATION = False
+
+# API asíncrona de trabajos de análisis (api/analysis_jobs.py)
+# Hilos que ejecutan inferencia y trabajos aceptados sin terminar antes de responder 503.
+IA_JOB_WORKERS = 2
+IA_JOB_QUEUE_SIZE = 100
+# Un trabajo pendiente o en curso desde hace más de esto se da por abandonado (el pool es
+# local al proceso y no sobrevive a un reinicio): se marca como fallido y la nota se puede
+# volver a encolar. Debe superar la espera en cola más IA_MODEL_LOAD_TIMEOUT.
+IA_JOB_STALE_SECONDS = 1800
+
+# Descubrimiento incremental de notas del scheduler (api/note_discovery.py): páginas de
+# IA_DISCOVERY_PAGE_SIZE notas ordenadas por createdAt, hasta IA_DISCOVERY_MAX_NOTES_PER_RUN
+# por ejecución; el resto se recoge en la siguiente.
+IA_DISCOVERY_PAGE_SIZE = 200
+IA_DISCOVERY_MAX_NOTES_PER_RUN = 2000
+
+# Pipeline del análisis programado (api/analysis_pipeline.py). Las colas acotadas entre
+# etapas dan el backpressure: descubrimiento -> [FETCH_QUEUE] -> análisis (ANALYSIS_WORKERS
+# hilos, agrupados por el micro-batcher) -> [WRITE_QUEUE] -> escritura en lotes de Firestore
+# de hasta WRITE_BATCH_SIZE (máx. 500) o cada WRITE_FLUSH_SECONDS.
+IA_PIPELINE_ANALYSIS_WORKERS = 8
+IA_PIPELINE_FETCH_QUEUE_SIZE = 100
+IA_PIPELINE_WRITE_QUEUE_SIZE = 200
+IA_PIPELINE_WRITE_BATCH_SIZE = 100
+IA_PIPELINE_WRITE_FLUSH_SECONDS = 2.0
+
+# Prioridad de análisis (api/analysis_priority.py): primero pacientes con panicMode, luego
+# con alert (Realtime DB patients/{uid}, cacheado IA_PRIORITY_CACHE_SECONDS) y después el
+# resto, por antigüedad de la nota. Una nota que espera más de IA_PRIORITY_STARVATION_SECONDS
+# se atiende aunque haya notas de mayor prioridad.
+IA_PRIORITY_ENABLED = True
+IA_PRIORITY_CACHE_SECONDS = 30
+IA_PRIORITY_STARVATION_SECONDS = 120
+
+# Análisis programado dentro del proceso web (api/scheduler.py). En producción conviene
+# IA_SCHEDULER_ENABLED=0 en el tier web y ejecutar aparte `manage.py run_analysis_worker`.
+IA_SCHEDULER_ENABLED = os.environ.get('IA_SCHEDULER_ENABLED', '1') == '1'
+
+# El scheduler y la precarga del modelo solo arrancan en procesos servidor (api/apps.py:
+# gunicorn, uvicorn, daphne, hypercorn o `manage.py runserver`). Con otro servidor
+# (p. ej. mod_wsgi) hay que declararlo con IA_SERVER_PROCESS=1.
+IA_SERVER_PROCESS = os.environ.get('IA_SERVER_PROCESS') == '1'
+
+# Listener en tiempo real de notas nuevas (api/note_listener.py). El barrido cada
+# IA_SWEEPER_INTERVAL_MINUTES sigue activo como respaldo.
+IA_NOTE_LISTENER_ENABLED = os.environ.get('IA_NOTE_LISTENER_ENABLED', '1') == '1'
+IA_NOTE_LISTENER_CHECK_SECONDS = 30
+IA_NOTE_LISTENER_MAX_BACKOFF_SECONDS = 300
+IA_SWEEPER_INTERVAL_MINUTES = 5
+
+# Coordinación entre procesos y hosts (api/leases.py). Solo el proceso que obtiene el
+# advisory lock de Postgres IA_SCHEDULER_LOCK_KEY ejecuta el barrido y el listener; los
+# demás reintentan cada IA_SCHEDULER_LEADER_CHECK_SECONDS. Además, cada nota se analiza
+# bajo un lease de IA_NOTE_LEASE_SECONDS que se reclama solo si su dueño muere; los leases
+# completados se conservan IA_NOTE_LEASE_RETENTION_SECONDS para evitar análisis repetidos.
+IA_SCHEDULER_LEADER_ELECTION = True
+IA_SCHEDULER_LOCK_KEY = 0x50554C53
+IA_SCHEDULER_LEADER_CHECK_SECONDS = 10
+IA_NOTE_LEASES_ENABLED = True
+IA_NOTE_LEASE_SECONDS = 300
+IA_NOTE_LEASE_RETENTION_SECONDS = 24 * 3600
+# Las notas cuyo análisis o escritura falló (o cuyo proceso murió con el lease) se
+# reintentan al principio de cada barrido: hasta IA_NOTE_RETRY_BATCH_SIZE por barrido y
+# como mucho IA_NOTE_MAX_ATTEMPTS intentos por nota (o hasta que se purgue su lease).
+IA_NOTE_MAX_ATTEMPTS = 5
+IA_NOTE_RETRY_BATCH_SIZE = 200
+
+# Historial de ejecuciones del barrido (AnalysisRun) expuesto en /api/metrics/ en formato
+# Prometheus. Una ejecución "en curso" más antigua que esto se marca como abandonada.
+IA_ANALYSIS_RUN_STALE_SECONDS = 3600
+# /api/metrics/ solo responde a usuarios staff o con `Authorization: Bearer <IA_METRICS_TOKEN>`
+# (el `bearer_token` del scrape de Prometheus). Sin token configurado, solo staff.
+IA_METRICS_TOKEN = os.environ.get('IA_METRICS_TOKEN') or None
+
+# Caché de vínculos cuidador-paciente (api/link_cache.py) en el alias IA_LINK_CACHE_ALIAS de
+# CACHES. Las vistas de vincular/desvincular la invalidan; el TTL cubre cambios externos.
+IA_LINK_CACHE_ALIAS = 'default'
+IA_LINK_CACHE_TTL_SECONDS = 300
+# CaregiverPatientLink (Postgres) autoriza las lecturas; el líder del scheduler repara cada
+# IA_LINK_RECONCILE_INTERVAL_MINUTES la réplica en Firestore (0 desactiva; ver
+# `manage.py reconcile_links` para los vínculos que solo existen en Firestore).
+IA_LINK_RECONCILE_INTERVAL_MINUTES = 60
+
+# Paginación de notas (api/note_pages.py) en /api/patient-notes/ y en las vistas web de
+# notas: IA_NOTES_PAGE_SIZE por defecto y nunca más de IA_NOTES_MAX_PAGE_SIZE por página.
+# Las listas se ordenan por createdAt: las notas antiguas sin ese campo necesitan
+# `manage.py backfill_note_created_at --apply` para aparecer.
+IA_NOTES_PAGE_SIZE = 50
+IA_NOTES_MAX_PAGE_SIZE = 200
+# ETag / Last-Modified de /api/patient-notes/ (api/note_summary.py): el resumen por paciente
+# lo marcan el listener y la escritura de análisis, y se recalcula (número de notas, la más
+# reciente y el update_time máximo, que detecta ediciones de notas antiguas) si está marcado
+# o tiene más de IA_NOTES_SUMMARY_MAX_AGE_SECONDS.
+IA_NOTES_SUMMARY_MAX_AGE_SECONDS = 300
+# /api/caregiver-notes/: notas de hasta IA_BATCH_NOTES_MAX_PATIENTS pacientes por solicitud,
+# leídas con como mucho IA_BATCH_NOTES_CONCURRENCY consultas a Firestore a la vez por solicitud.
+IA_BATCH_NOTES_MAX_PATIENTS = 50
+IA_BATCH_NOTES_CONCURRENCY = 8
+
 FIREBASE_CREDENTIALS_PATH = os.path.join(BASE_DIR, 'firebase_key.json') 
 
 if not firebase_admin._apps: 
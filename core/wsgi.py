@@ -12,5 +12,9 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Bajo WSGI cada vista asíncrona se ejecuta en un event loop nuevo (y con un AsyncClient de
+# Firestore propio): las vistas de notas se sirven en su versión síncrona. El despliegue
+# recomendado es ASGI (core/asgi.py); este queda como referencia para compare_deployments.
+os.environ.setdefault('IA_ASYNC_NOTE_VIEWS', '0')
 
 application = get_wsgi_application()
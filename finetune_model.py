@@ -137,6 +137,7 @@ if __name__ == '__main__':
         tokenizer.save_pretrained(output_dir) # Siempre guarda el tokenizador junto con el modelo
 
         print(f"Modelo fine-tuneado guardado en: {output_dir}")
+        print(f"Para servirlo como nueva versión: python manage.py model_registry register {output_dir} --activate")
 
     except Exception as e:
         print(f"Ocurrió un error durante el entrenamiento: {e}")
@@ -1,3 +1,6 @@
+import asyncio
+import weakref
+
 import firebase_admin
 from firebase_admin import firestore, db as db_alias
 try:
@@ -5,4 +8,40 @@ try:
 except ValueError:
     print("Error: La aplicación Firebase no ha sido inicializada. Asegúrate de que settings.py se carga correctamente.")
 db = firestore.client(app=default_app)
-db_realtime = db_alias.reference(app=default_app)
\ No newline at end of file
+db_realtime = db_alias.reference(app=default_app)
+
+# Un AsyncClient por event loop: sus canales gRPC asíncronos no pueden usarse desde otro
+# loop. Bajo ASGI hay un loop por worker y el cliente dura lo que el proceso; bajo WSGI
+# Django ejecuta cada vista async en un loop nuevo y hay que cerrarlo al terminar
+# (aclose_async_db, api.decorators.closes_async_db).
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_db():
+    """Cliente asíncrono de Firestore (google.cloud.firestore.AsyncClient) del loop actual."""
+    from google.cloud.firestore import AsyncClient
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncClient(project=default_app.project_id, credentials=default_app.credential.get_credential())
+        _async_clients[loop] = client
+    return client
+
+
+async def aclose_async_db():
+    """
+    Cierra el AsyncClient del loop actual y su canal gRPC, si se llegó a crear.
+
+    AsyncClient.close() solo cierra el transporte HTTP; el canal gRPC es del cliente GAPIC
+    (FirestoreAsyncClient), que AsyncClient crea la primera vez que se usa y no expone
+    públicamente. Su `transport.close()` sí es API pública. Depende de la versión fijada
+    en requirements.txt; ClosesAsyncDbTests comprueba que este camino cierra el canal.
+    """
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is None:
+        return
+    client.close()
+    gapic_client = client._firestore_api_internal
+    if gapic_client is not None:
+        await gapic_client.transport.close()
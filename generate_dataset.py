@@ -131,14 +131,17 @@ def generate_note_data():
     }
 
 # Generar y guardar las notas en un archivo .jsonl
-num_notes = 200
-output_filename = "notes_dataset.jsonl" # Este archivo se creará en el mismo directorio que este script
-
-print(f"Generando {num_notes} notas simuladas...")
-with open(output_filename, "w", encoding="utf-8") as f:
-    for i in range(num_notes):
-        data = generate_note_data()
-        f.write(json.dumps(data, ensure_ascii=False) + "\n")
-
-print(f"Se han generado {num_notes} notas simuladas en '{output_filename}'.")
-print("Asegúrate de mover este archivo a la raíz de tu proyecto 'pulsoftWeb' (donde está manage.py) si lo ejecutas desde otro lugar.")
\ No newline at end of file
+# Protegido para poder importar generate_note_data (p. ej. desde manage.py benchmark_inference)
+# sin sobrescribir el dataset.
+if __name__ == "__main__":
+    num_notes = 200
+    output_filename = "notes_dataset.jsonl" # Este archivo se creará en el mismo directorio que este script
+
+    print(f"Generando {num_notes} notas simuladas...")
+    with open(output_filename, "w", encoding="utf-8") as f:
+        for i in range(num_notes):
+            data = generate_note_data()
+            f.write(json.dumps(data, ensure_ascii=False) + "\n")
+
+    print(f"Se han generado {num_notes} notas simuladas en '{output_filename}'.")
+    print("Asegúrate de mover este archivo a la raíz de tu proyecto 'pulsoftWeb' (donde está manage.py) si lo ejecutas desde otro lugar.")
\ No newline at end of file